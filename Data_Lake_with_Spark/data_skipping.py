@@ -0,0 +1,221 @@
+import hashlib
+import math
+from urllib.parse import unquote, urlparse
+from pyspark.sql.functions import col, expr, input_file_name, lit, count, sum as sum_, min as min_, max as max_
+from pyspark.sql.types import *
+
+
+# sidecar index directory inside each table. Spark skips paths starting with '_'
+# when reading the table, so the index never shows up as data.
+INDEX_DIR = "_index"
+
+
+class BloomFilter:
+    """
+    Fixed size bloom filter over the string form of column values, so that
+    91 and "91" test the same. Serialized as the raw bit array.
+    """
+
+    def __init__(self, num_bits, num_hashes, bits=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray(bits) if bits is not None else bytearray((num_bits + 7) // 8)
+
+    @staticmethod
+    def num_hashes_for(fpp):
+        return max(1, round(-math.log2(fpp)))
+
+    @classmethod
+    def for_capacity(cls, capacity, fpp=0.01):
+        """
+        Size a filter for `capacity` distinct values at false positive rate `fpp`.
+        """
+        num_bits = max(64, int(-max(capacity, 1) * math.log(fpp) / math.log(2) ** 2))
+        # whole bytes, the bit count is recovered from the serialized length
+        return cls((num_bits + 7) // 8 * 8, cls.num_hashes_for(fpp))
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(str(value).encode('utf8'), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, value):
+        if value is None:
+            return
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def merge(self, other):
+        for i, byte in enumerate(other.bits):
+            self.bits[i] |= byte
+        return self
+
+    def __contains__(self, value):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(value))
+
+
+def zorder(spark, df, columns, num_files, partition_by=(), bits=10):
+    """
+    Cluster rows on a z-order curve over `columns` so that files cover narrow
+    ranges of every column at once, not just the first sort column.
+
+    Each column is mapped to its rank among the distinct values, scaled to
+    `bits` bits, and the ranks are bit-interleaved into one sort key.
+
+    :param spark: instance of spark session
+    :param df: dataframe to be written
+    :param columns: hot columns used in point and range lookups
+    :param num_files: number of output tasks for the whole table. Tasks cover consecutive ranges of
+        (partition_by, z-value), so a table partition gets its share of them, at least one file
+    :param partition_by: columns the table is partitioned by on write
+    :param bits: bits of each column kept in the z-value
+    :return: dataframe range partitioned and sorted by z-value
+    """
+    if bits * len(columns) > 62:
+        raise ValueError("Z-value of {} columns at {} bits doesn't fit a bigint".format(len(columns), bits))
+
+    ranked = df
+    for i, name in enumerate(columns):
+        values = df.select(name).where(col(name).isNotNull()).distinct().rdd.map(lambda row: row[0])
+        num_values = max(values.count(), 1)
+        ranks = spark.createDataFrame(
+            values.sortBy(lambda v: v).zipWithIndex().map(lambda p: (p[0], p[1] * (1 << bits) // num_values)),
+            StructType([StructField(name, df.schema[name].dataType), StructField("_zrank_{}".format(i), LongType())]))
+        ranked = ranked.join(ranks, name, how="left")
+
+    terms = ["shiftleft(shiftright(coalesce(_zrank_{0}, 0), {1}) & 1, {2})".format(i, b, b * len(columns) + i)
+             for b in range(bits) for i in range(len(columns))]
+    ranked = ranked.withColumn("_zvalue", expr(" | ".join(terms)))
+
+    return ranked.repartitionByRange(num_files, *partition_by, "_zvalue")\
+                 .sortWithinPartitions(*partition_by, "_zvalue")\
+                 .select(df.columns)
+
+
+def write_index(spark, table_path, columns, bloom_columns=(), fpp=0.01):
+    """
+    Build the data-skipping index of a parquet table: per file row count,
+    min/max/null-count of `columns` and bloom filters of `bloom_columns`.
+    Written to the table's _index directory, replacing any previous index.
+
+    :param spark: instance of spark session
+    :param table_path: path of the written table
+    :param columns: columns to collect min/max/null-count statistics for
+    :param bloom_columns: columns used in point lookups
+    :param fpp: false positive rate of the bloom filters
+    """
+    df = spark.read.parquet(table_path).withColumn("_file", input_file_name())
+
+    aggregates = [count(lit(1)).alias("num_rows")]
+    for name in columns:
+        aggregates += [min_(name).alias("{}_min".format(name)),
+                       max_(name).alias("{}_max".format(name)),
+                       sum_(col(name).isNull().cast("long")).alias("{}_nulls".format(name))]
+    index = df.groupBy("_file").agg(*aggregates)
+
+    if bloom_columns:
+        num_hashes = BloomFilter.num_hashes_for(fpp)
+        # size every file's filters from its row count so files of all sizes hit the same fpp
+        row_counts = spark.sparkContext.broadcast({r._file: r.num_rows for r in index.select("_file", "num_rows").collect()})
+
+        def build_filters(rows):
+            filters = {}
+            for row in rows:
+                if row._file not in filters:
+                    capacity = row_counts.value.get(row._file, 1)
+                    filters[row._file] = [BloomFilter.for_capacity(capacity, fpp) for _ in bloom_columns]
+                for bloom, value in zip(filters[row._file], row[1:]):
+                    bloom.add(value)
+            return filters.items()
+
+        blooms = df.select("_file", *bloom_columns).rdd\
+                   .mapPartitions(build_filters)\
+                   .reduceByKey(lambda a, b: [x.merge(y) for x, y in zip(a, b)])\
+                   .map(lambda p: [p[0]] + [bytes(bloom.bits) for bloom in p[1]])
+
+        bloom_schema = StructType([StructField("_file", StringType())] +
+                                  [StructField("{}_bloom".format(name), BinaryType()) for name in bloom_columns])
+        index = index.join(spark.createDataFrame(blooms, bloom_schema), "_file", how="left")\
+                     .withColumn("bloom_hashes", lit(num_hashes))
+
+    index.coalesce(1).write.parquet(table_path.rstrip('/') + '/' + INDEX_DIR, mode="overwrite")
+
+
+def prune_files(spark, table_path, filters):
+    """
+    Use the data-skipping index to list the files of a table that may hold
+    rows matching `filters`.
+
+    :param spark: instance of spark session
+    :param table_path: path of the table
+    :param filters: dict of column to value for equality, or to a (low, high)
+        tuple for an inclusive range where either bound may be None
+    :return: list of file paths
+    """
+    index = spark.read.parquet(table_path.rstrip('/') + '/' + INDEX_DIR)
+
+    condition = lit(True)
+    for name, value in filters.items():
+        if "{}_min".format(name) not in index.columns:
+            continue
+
+        # compare in the column's own type, string ids must not be compared as numbers
+        value_type = index.schema["{}_min".format(name)].dataType
+        if isinstance(value, tuple):
+            low, high = value
+            if low is not None:
+                condition &= col("{}_max".format(name)) >= lit(low).cast(value_type)
+            if high is not None:
+                condition &= col("{}_min".format(name)) <= lit(high).cast(value_type)
+        else:
+            condition &= (col("{}_min".format(name)) <= lit(value).cast(value_type)) & \
+                         (col("{}_max".format(name)) >= lit(value).cast(value_type))
+
+    files = []
+    for row in index.where(condition).collect():
+        row = row.asDict()
+        if all(row.get("{}_bloom".format(name)) is None or
+               value in BloomFilter(len(row["{}_bloom".format(name)]) * 8, row["bloom_hashes"], row["{}_bloom".format(name)])
+               for name, value in filters.items() if not isinstance(value, tuple)):
+            files.append(row["_file"])
+
+    # files appended after the index was built (e.g. by the stream) can't be pruned
+    indexed = {file_key(row._file) for row in index.select("_file").collect()}
+    files += [f for f in spark.read.parquet(table_path).inputFiles() if file_key(f) not in indexed]
+    return files
+
+
+def file_key(path):
+    """
+    Normalize a file uri so 'file:/a' and 'file:///a' or encoded and plain paths compare equal.
+    """
+    parsed = urlparse(path)
+    return parsed.netloc + unquote(parsed.path)
+
+
+def read_table(spark, table_path, filters):
+    """
+    Read only the files of a table that may match `filters` and apply the
+    filters to them. See `prune_files` for the filter format.
+
+    :param spark: instance of spark session
+    :param table_path: path of the table
+    :param filters: dict of column to value or (low, high) tuple
+    :return: dataframe of matching rows
+    """
+    files = prune_files(spark, table_path, filters)
+    if not files:
+        return spark.read.parquet(table_path).limit(0)
+
+    df = spark.read.option("basePath", table_path).parquet(*files)
+    for name, value in filters.items():
+        value_type = df.schema[name].dataType
+        if isinstance(value, tuple):
+            low, high = value
+            if low is not None:
+                df = df.where(col(name) >= lit(low).cast(value_type))
+            if high is not None:
+                df = df.where(col(name) <= lit(high).cast(value_type))
+        else:
+            df = df.where(col(name) == lit(value).cast(value_type))
+    return df
@@ -1,46 +1,211 @@
+import argparse
 import configparser
 from datetime import datetime
+import json
+import logging
 import os
+import time
+from urllib.parse import urlparse
 from pyspark.sql import SparkSession
 from pyspark.sql.functions import udf, col, monotonically_increasing_id
 from pyspark.sql.functions import year, month, dayofmonth, hour, weekofyear, date_format, dayofweek
 from pyspark.sql.types import *
 
+from data_skipping import write_index, zorder
+from storage import LocalStorage, get_storage, merge_settings
+import repository_path
+from sparkify_common.files import find_json_files
+from sparkify_common.event_schema import log_schema, song_schema
+from sparkify_common import quality
+
+
+logger = logging.getLogger(__name__)
 
 config = configparser.ConfigParser()
+# spark setting names are case sensitive
+config.optionxform = str
 config.read('dl.cfg')
 
-os.environ['AWS_ACCESS_KEY_ID']=config['AWS_ACCESS_KEY_ID']
-os.environ['AWS_SECRET_ACCESS_KEY']=config['AWS_SECRET_ACCESS_KEY']
+# data-skipping index of each table: columns with min/max/null-count statistics,
+# columns with bloom filters for point lookups, and hot columns to z-order on
+table_indexes = {
+    'songs': {
+        'columns': ['song_id', 'title', 'duration', 'year', 'artist_id'],
+        'bloom_columns': ['song_id', 'title'],
+        'zorder': ['song_id'],
+    },
+    'time_table': {
+        'columns': ['start_time', 'ts', 'year', 'month'],
+        'bloom_columns': [],
+        'zorder': ['start_time'],
+    },
+    'songplays': {
+        'columns': ['start_time', 'user_id', 'song_id', 'artist_id', 'session_id', 'year', 'month'],
+        'bloom_columns': ['user_id', 'song_id', 'artist_id'],
+        'zorder': ['user_id', 'song_id', 'start_time'],
+    },
+}
+
+
+# data-quality checks of the written tables, results go into the job metrics
+table_checks = [
+    quality.not_null('songplays', 'songplay_id', 'start_time', 'user_id', 'session_id'),
+    quality.unique('songplays', 'songplay_id'),
+    # users keeps a row per level a user had, as the stream does
+    quality.unique('users', 'userId', 'level'),
+    quality.unique('songs', 'song_id'),
+    quality.unique('artists', 'artist_id'),
+    quality.unique('time_table', 'start_time'),
+    quality.references('songplays', 'user_id', 'users', 'userId'),
+    quality.references('songplays', 'song_id', 'songs', 'song_id'),
+    quality.references('songplays', 'artist_id', 'artists', 'artist_id'),
+    quality.references('songplays', 'start_time', 'time_table', 'start_time'),
+    quality.references('songs', 'artist_id', 'artists', 'artist_id'),
+    quality.in_range('songplays', 'start_time', quality.min_event_time, quality.max_event_time),
+    # songplays only keeps matched plays, one row per NextSong event, the rate is taken against the events
+    quality.match_rate('songplays', 'song_id', config.getfloat('QUALITY', 'MIN_MATCH_RATE', fallback=quality.min_match_rate),
+                       plays="SELECT COUNT(*) FROM song_play_events"),
+]
+
+
+def load_profile(name=None):
+    """
+    Look up a Spark tuning profile in dl.cfg.
+
+    :param name: profile name, defaults to PROFILE in the SPARK section
+    :return: tuple of profile name and dict of spark settings
+    """
+    name = name or config.get('SPARK', 'PROFILE', fallback='local')
+    section = 'PROFILE {}'.format(name)
+    if not config.has_section(section):
+        raise ValueError("Unknown spark profile '{}'. Expected one of {}".format(
+            name, [s[len('PROFILE '):] for s in config.sections() if s.startswith('PROFILE ')]))
+    return name, dict(config.items(section))
+
+
+def create_spark_session(profile=None, storages=()):
+    """
+    Create the spark session with the settings of a tuning profile applied.
+
+    :param profile: name of a profile in dl.cfg, defaults to PROFILE in the SPARK section
+    :param storages: Storage backends the job reads from or writes to
+    :return: tuple of spark session and name of the applied profile
+    """
+    profile, settings = load_profile(profile)
+
+    builder = SparkSession.builder
+    for key, value in merge_settings(*[s.spark_settings() for s in storages], settings).items():
+        builder = builder.config(key, value)
+
+    spark = builder.getOrCreate()
+    logger.info("Spark session created with profile '{}': {}".format(profile, settings))
+    return spark, profile
+
+
+def write_table(spark, df, path, table, partition_by, zorder_files=None):
+    """
+    Write a table to parquet and build its data-skipping index.
+
+    :param spark: instance of spark session
+    :param df: dataframe of the table
+    :param path: file path the table is written to
+    :param table: name of the table in `table_indexes`
+    :param partition_by: columns to partition the table by
+    :param zorder_files: z-order the hot columns into this many files for the whole table, None to skip
+    """
+    spec = table_indexes[table]
+    if zorder_files:
+        df = zorder(spark, df, spec['zorder'], zorder_files, partition_by)
+
+    df.write.parquet(path, mode="overwrite", partitionBy=partition_by)
+    write_index(spark, path, spec['columns'], spec['bloom_columns'])
+
+
+def read_cached(spark, cache, filepath, kind):
+    """
+    Read the columnar cache conversion of all json files below a local directory.
+
+    :param spark: instance of spark session
+    :param cache: ColumnarCache
+    :param filepath: local path or file:// uri of the directory
+    :param kind: 'song' or 'log'
+    """
+    return spark.read.parquet(cache.combined(find_json_files(urlparse(filepath).path), kind))
+
+
+def read_json(spark, filepath, schema):
+    """
+    Read json files with the explicit raw schema of an event kind, skipping schema inference.
+
+    :param spark: instance of spark session
+    :param filepath: path or glob of the json files
+    :param schema: EventSchema of the files
+    """
+    return schema.spark_decode(spark.read.json(filepath, schema=schema.spark_schema(raw=True), mode='PERMISSIVE'))
+
+
+def quarantine(df, checks, output_data, kind):
+    """
+    Write the rows failing a row level data-quality check to the quarantine/<kind> table,
+    with the name of the check.
+
+    :param df: dataframe of raw song or log records
+    :param checks: row level checks
+    :param output_data: file path for output data
+    :param kind: 'song' or 'log'
+    :return: dataframe of the rows passing every check
+    """
+    df, failed = quality.split_dataframe(df, checks)
+    failed.write.parquet(os.path.join(output_data, "quarantine", kind), mode="overwrite")
+    return df
+
+
+def check_tables(spark, output_data):
+    """
+    Run the data-quality checks over the written tables.
+
+    :param spark: instance of spark session
+    :param output_data: file path for output data
+    :return: dict of quarantined rows per check and check results
+    """
+    for table in ("songs", "artists", "users", "time_table", "songplays"):
+        spark.read.parquet(os.path.join(output_data, table)).createOrReplaceTempView(table)
 
+    quarantined = {}
+    for kind in ("song", "log"):
+        rows = spark.read.parquet(os.path.join(output_data, "quarantine", kind)).groupBy("check_name").count()
+        quarantined.update({row.check_name: row['count'] for row in rows.collect()})
 
-def create_spark_session():
-    spark = SparkSession \
-        .builder \
-        .config("spark.jars.packages", "org.apache.hadoop:hadoop-aws:2.7.0") \
-        .getOrCreate()
-    return spark
+    return {'quarantined': quarantined, 'quality': quality.run_checks(lambda query: spark.sql(query).first(), table_checks)}
 
 
-def process_song_data(spark, input_data, output_data):
+def process_song_data(spark, input_data, output_data, zorder_files=None, cache=None):
     """
     Retrieve and process song data. Create and tranform song and artist tables.
     
     :param spark: instance of spark session
     :param input_data: file path to s3 bucket containing data
     :param output_data: file path to s3 buck for output data
+    :param zorder_files: z-order indexed tables into this many files each, None to skip
+    :param cache: optional ColumnarCache to read local input through
     """
     # get filepath to song data file
     song_data = input_data + "song_data/*/*/*/*"
 
     # read song data file
-    df = spark.read.json(song_data, mode='PERMISSIVE', columnNameOfCorruptRecord='corrupt_record').drop_duplicates()
+    if cache is not None:
+        df = read_cached(spark, cache, input_data + "song_data/", 'song').drop_duplicates()
+    else:
+        df = read_json(spark, song_data, song_schema).drop_duplicates()
+
+    # set aside rows failing a data-quality check
+    df = quarantine(df, quality.song_checks('song_data'), output_data, 'song')
 
     # extract columns to create songs table
     songs_table = df.select("song_id","title","artist_id","year","duration").drop_duplicates()
 
     # write songs table to parquet files partitioned by year and artist
-    songs_table.write.parquet(output_data + "songs/", mode="overwrite", partitionBy=["year","artist_id"])
+    write_table(spark, songs_table, output_data + "songs/", 'songs', ["year","artist_id"], zorder_files)
 
     # extract columns to create artists table
     artists_table = df.select("artist_id","artist_name","artist_location","artist_latitude","artist_longitude").drop_duplicates()
@@ -49,13 +214,15 @@ def process_song_data(spark, input_data, output_data):
     artists_table.write.parquet(output_data + "artists/", mode="overwrite")
 
 
-def process_log_data(spark, input_data, output_data):
+def process_log_data(spark, input_data, output_data, zorder_files=None, cache=None):
     """
     Retrieve and process all log data. Create and transform time and user tables. 
     
     :param spark: instance of spark session
     :param input_data: file path to s3 bucket containing data
     :param output_data: file path to s3 buck for output data
+    :param zorder_files: z-order indexed tables into this many files each, None to skip
+    :param cache: optional ColumnarCache to read local input through
     """
     
     
@@ -63,10 +230,15 @@ def process_log_data(spark, input_data, output_data):
     log_data = os.path.join(input_data, "log-data/")
 
     # read log data file
-    df = spark.read.json(log_data, mode='PERMISSIVE', columnNameOfCorruptRecord='corrupt_record').drop_duplicates()
+    if cache is not None:
+        df = read_cached(spark, cache, log_data, 'log').drop_duplicates()
+    else:
+        df = read_json(spark, log_data, log_schema).drop_duplicates()
 
-    # filter by actions for song plays
+    # filter by actions for song plays, setting aside rows failing a data-quality check
     df = df.filter(df.page == "NextSong")
+    df = quarantine(df, quality.event_checks('log_data'), output_data, 'log')
+    df.createOrReplaceTempView("song_play_events")
 
     # extract columns for users table
     users_table = df.select("userId","firstName","lastName","gender","level").drop_duplicates()
@@ -88,32 +260,74 @@ def process_log_data(spark, input_data, output_data):
                     .select("ts","start_time","hour", "day", "week", "month", "year", "weekday").drop_duplicates()
 
     # write time table to parquet files partitioned by year and month
-    time_table.write.parquet(os.path.join(output_data, "time_table/"), mode='overwrite', partitionBy=["year","month"])
+    write_table(spark, time_table, os.path.join(output_data, "time_table/"), 'time_table', ["year","month"], zorder_files)
 
-    # read in song data to use for songplays table
-    song_df = spark.read\
-                .format("parquet")\
-                .option("basePath", os.path.join(output_data, "songs/"))\
-                .load(os.path.join(output_data, "songs/*/*/"))
+    # read in song data to use for songplays table. Partition discovery skips the _index directory.
+    # A play matches on title and artist, one song per pair so each event makes at most one songplay
+    song_df = spark.read.parquet(os.path.join(output_data, "songs/"))\
+                   .join(spark.read.parquet(os.path.join(output_data, "artists/")), "artist_id")\
+                   .select("song_id", "title", "artist_id", "artist_name")\
+                   .dropDuplicates(["title", "artist_name"])
 
     # extract columns from joined song and log datasets to create songplays table
-    songplays_table = df.join(song_df, df.song == song_df.title, how='inner')\
+    songplays_table = df.join(song_df, (df.song == song_df.title) & (df.artist == song_df.artist_name), how='inner')\
                         .select(monotonically_increasing_id().alias("songplay_id"),col("start_time"),col("userId").alias("user_id"),"level","song_id","artist_id", col("sessionId").alias("session_id"), "location", col("userAgent").alias("user_agent"))
 
     songplays_table = songplays_table.join(time_table, songplays_table.start_time == time_table.start_time, how="inner")\
                         .select("songplay_id", songplays_table.start_time, "user_id", "level", "song_id", "artist_id", "session_id", "location", "user_agent", "year", "month")
 
     # write songplays table to parquet files partitioned by year and month
-    songplays_table.drop_duplicates().write.parquet(os.path.join(output_data, "songplays/"), mode="overwrite", partitionBy=["year","month"])
+    write_table(spark, songplays_table.drop_duplicates(), os.path.join(output_data, "songplays/"), 'songplays',
+                ["year","month"], zorder_files)
+
+
+def timed(metrics, name, func, *args):
+    """
+    Run one stage of the job and record its wall clock time in `metrics`.
+    """
+    start = time.time()
+    result = func(*args)
+    metrics['{}_seconds'.format(name)] = round(time.time() - start, 3)
+    return result
 
 
 def main():
-    spark = create_spark_session()
-    input_data = "s3a://udacity-dend/"
-    output_data = "s3a://udacity-dend/output/"
-    
-    process_song_data(spark, input_data, output_data)    
-    process_log_data(spark, input_data, output_data)
+    parser = argparse.ArgumentParser(description="Load song and log data into the data lake tables")
+    parser.add_argument("--input-data", default="s3a://udacity-dend/",
+                        help="local path or s3a:// uri containing the song_data and log-data directories")
+    parser.add_argument("--output-data", default="s3a://udacity-dend/output/",
+                        help="local path or s3a:// uri the tables are written to")
+    parser.add_argument("--profile", default=None,
+                        help="spark tuning profile from dl.cfg. Defaults to PROFILE in the SPARK section")
+    parser.add_argument("--zorder-files", type=int, default=None,
+                        help="z-order songs, time and songplays on their hot columns, writing this many files per table, "
+                             "split across its partitions")
+    parser.add_argument("--cache-dir", default=None,
+                        help="read local input json through a columnar cache kept in this directory")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    input_storage = get_storage(args.input_data, config)
+    output_storage = get_storage(args.output_data, config)
+    cache = None
+    if args.cache_dir:
+        if not isinstance(input_storage, LocalStorage):
+            parser.error("--cache-dir needs local --input-data, got {}".format(input_storage))
+        # needs pyarrow, only when reading through the cache
+        from sparkify_common.columnar_cache import ColumnarCache
+        cache = ColumnarCache(args.cache_dir)
+
+    spark, profile = create_spark_session(args.profile, [input_storage, output_storage])
+    input_data = input_storage.uri
+    output_data = output_storage.uri
+
+    metrics = {'profile': profile, 'settings': load_profile(profile)[1],
+               'input': repr(input_storage), 'output': repr(output_storage), 'cache': args.cache_dir}
+    timed(metrics, 'process_song_data', process_song_data, spark, input_data, output_data, args.zorder_files, cache)
+    timed(metrics, 'process_log_data', process_log_data, spark, input_data, output_data, args.zorder_files, cache)
+    metrics.update(timed(metrics, 'check_tables', check_tables, spark, output_data))
+    logger.info("Job metrics: {}".format(json.dumps(metrics)))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,200 @@
+import os
+import re
+from urllib.parse import urlparse
+
+
+def spark_build(jars_dir=None):
+    """
+    Versions of the Spark install the job runs on, read from the names of its jars.
+
+    :param jars_dir: jars directory of the install, by default that of SPARK_HOME or of the pyspark package
+    :return: tuple of the spark, scala and hadoop versions, each None when its jar is not found
+    """
+    if jars_dir is None:
+        if os.environ.get('SPARK_HOME'):
+            jars_dir = os.path.join(os.environ['SPARK_HOME'], 'jars')
+        else:
+            import pyspark
+            jars_dir = os.path.join(os.path.dirname(pyspark.__file__), 'jars')
+
+    spark = scala = hadoop = None
+    for name in sorted(os.listdir(jars_dir)) if os.path.isdir(jars_dir) else []:
+        match = re.match(r'spark-core_(\d+\.\d+)-(.+)\.jar$', name)
+        if match:
+            scala, spark = match.groups()
+        # spark 3.2 and later ship the shaded hadoop client, older builds hadoop-common
+        match = re.match(r'hadoop-(?:client-api|common)-(\d.*)\.jar$', name)
+        if match:
+            hadoop = match.group(1)
+    return spark, scala, hadoop
+
+
+class Storage:
+    """
+    Base class for the places the data lake job reads from and writes to.
+    A backend is picked by the scheme of the path it is given, see `get_storage`.
+    """
+
+    # uri schemes handled by the backend
+    schemes = ()
+
+    def __init__(self, uri, config=None):
+        self.uri = uri if uri.endswith('/') else uri + '/'
+        self.config = config
+
+    def path(self, *parts):
+        """
+        Join path parts onto the root of the storage.
+        """
+        return self.uri + '/'.join(part.strip('/') for part in parts)
+
+    def spark_settings(self):
+        """
+        Spark settings the backend needs before the session is created.
+
+        :return: dict of spark settings
+        """
+        return {}
+
+    def __repr__(self):
+        return "{}('{}')".format(type(self).__name__, self.uri)
+
+
+class LocalStorage(Storage):
+    """
+    Local filesystem, used for the bundled `data/` directory and test runs.
+    """
+
+    schemes = ('', 'file')
+
+    def __init__(self, uri, config=None):
+        if not urlparse(uri).scheme:
+            uri = os.path.abspath(uri)
+        super().__init__(uri, config)
+
+    def spark_settings(self):
+        # the v2 commit algorithm moves task output once instead of twice
+        return {'spark.hadoop.mapreduce.fileoutputcommitter.algorithm.version': '2'}
+
+
+class S3Storage(Storage):
+    """
+    S3, or any S3 compatible object store when ENDPOINT is set in the S3
+    section of dl.cfg. Credentials are only read when the session is configured.
+    """
+
+    schemes = ('s3', 's3a', 's3n')
+
+    # hadoop-aws brings the S3A filesystem and committers, spark-hadoop-cloud binds them to spark sql.
+    # Both have to match the install: hadoop-aws its hadoop, spark-hadoop-cloud its spark and scala build
+    package_template = "org.apache.hadoop:hadoop-aws:{hadoop},org.apache.spark:spark-hadoop-cloud_{scala}:{spark}"
+
+    # the S3A committer and upload buffer options of the dl.cfg tuning profiles start with hadoop-aws 3.1
+    min_hadoop_aws = (3, 1)
+
+    def __init__(self, uri, config=None):
+        parsed = urlparse(uri)
+        super().__init__("s3a://" + parsed.netloc + parsed.path, config)
+
+    def setting(self, section, key):
+        """
+        Read a value from dl.cfg, treating missing, blank and quoted blank values as unset.
+        """
+        if self.config is None:
+            return None
+        value = self.config.get(section, key, fallback='').strip().strip('\'"')
+        return value or None
+
+    def credentials(self):
+        """
+        Access key and secret from dl.cfg, falling back to the environment.
+
+        :return: tuple of access key and secret, or None to use the default AWS provider chain
+        """
+        key = self.setting('AWS', 'AWS_ACCESS_KEY_ID') or os.environ.get('AWS_ACCESS_KEY_ID')
+        secret = self.setting('AWS', 'AWS_SECRET_ACCESS_KEY') or os.environ.get('AWS_SECRET_ACCESS_KEY')
+        return (key, secret) if key and secret else None
+
+    def packages(self):
+        """
+        Packages to load, PACKAGES in dl.cfg or the ones matching the Spark install.
+
+        :raises ValueError: if the install's versions are unknown and PACKAGES is unset, or if a
+            hadoop-aws is older than the S3A committers or differs from the install's hadoop
+        """
+        spark, scala, hadoop = spark_build()
+        packages = self.setting('S3', 'PACKAGES')
+        if packages is None:
+            if not (spark and scala and hadoop):
+                raise ValueError("Could not read the Spark and Hadoop versions of the install, "
+                                 "set PACKAGES in the S3 section of dl.cfg")
+            packages = self.package_template.format(hadoop=hadoop, scala=scala, spark=spark)
+
+        for package in packages.split(','):
+            parts = package.strip().split(':')
+            if parts[:2] == ['org.apache.hadoop', 'hadoop-aws'] and len(parts) == 3:
+                version = tuple(int(v) for v in parts[2].split('.')[:2] if v.isdigit())
+                if version < self.min_hadoop_aws:
+                    raise ValueError("{} has no S3A committers, the tuning profiles need hadoop-aws {}.{} or later"
+                                     .format(package, *self.min_hadoop_aws))
+                if hadoop and parts[2] != hadoop:
+                    raise ValueError("{} does not match the hadoop {} of the Spark install".format(package, hadoop))
+        return packages
+
+    def spark_settings(self):
+        settings = {
+            'spark.jars.packages': self.packages(),
+            'spark.hadoop.fs.s3a.impl': 'org.apache.hadoop.fs.s3a.S3AFileSystem',
+            # write through the S3A committer named by the profile (fs.s3a.committer.name) instead of
+            # renaming task output: s3a paths get the S3A committer factory, and spark sql is bound to it
+            'spark.hadoop.mapreduce.outputcommitter.factory.scheme.s3a':
+                'org.apache.hadoop.fs.s3a.commit.S3ACommitterFactory',
+            'spark.sql.sources.commitProtocolClass': 'org.apache.spark.internal.io.cloud.PathOutputCommitProtocol',
+            'spark.sql.parquet.output.committer.class': 'org.apache.spark.internal.io.cloud.BindingParquetOutputCommitter',
+        }
+
+        credentials = self.credentials()
+        if credentials:
+            settings['spark.hadoop.fs.s3a.access.key'], settings['spark.hadoop.fs.s3a.secret.key'] = credentials
+            settings['spark.hadoop.fs.s3a.aws.credentials.provider'] = \
+                'org.apache.hadoop.fs.s3a.SimpleAWSCredentialsProvider'
+
+        endpoint = self.setting('S3', 'ENDPOINT')
+        if endpoint:
+            settings['spark.hadoop.fs.s3a.endpoint'] = endpoint
+            settings['spark.hadoop.fs.s3a.path.style.access'] = 'true'
+            settings['spark.hadoop.fs.s3a.connection.ssl.enabled'] = str(endpoint.startswith('https')).lower()
+
+        return settings
+
+
+BACKENDS = {scheme: backend for backend in (LocalStorage, S3Storage) for scheme in backend.schemes}
+
+
+def get_storage(uri, config=None):
+    """
+    Pick the storage backend for a path by its uri scheme.
+
+    :param uri: local path or uri such as s3a://bucket/prefix/
+    :param config: parsed dl.cfg, read lazily by backends that need credentials
+    :return: Storage instance
+    """
+    scheme = urlparse(uri).scheme
+    if scheme not in BACKENDS:
+        raise ValueError("No storage backend for '{}'. Supported schemes are {}".format(
+            uri, sorted(s for s in BACKENDS if s)))
+    return BACKENDS[scheme](uri, config)
+
+
+def merge_settings(*settings):
+    """
+    Merge spark settings from several backends, combining their package lists.
+    """
+    merged = {}
+    for item in settings:
+        for key, value in item.items():
+            if key == 'spark.jars.packages' and key in merged:
+                packages = merged[key].split(',')
+                value = ','.join(packages + [p for p in value.split(',') if p not in packages])
+            merged[key] = value
+    return merged
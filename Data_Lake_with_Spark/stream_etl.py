@@ -0,0 +1,224 @@
+import argparse
+import json
+import logging
+import os
+import time
+from functools import reduce
+from pyspark.sql.functions import col, xxhash64
+from pyspark.sql.functions import year, month, dayofmonth, hour, weekofyear, dayofweek
+from pyspark.sql.types import *
+from pyspark.sql.utils import AnalysisException
+
+from etl import config, create_spark_session, log_schema, process_song_data, quality
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+
+class SongDimension:
+    """
+    Song/artist lookup used to resolve song plays in each micro-batch. The
+    dimension is read from the songs and artists parquet tables and re-read
+    once it is older than `refresh_interval` seconds, so songs written by a
+    later batch run are picked up without restarting the stream.
+    """
+
+    def __init__(self, spark, output_data, refresh_interval=600):
+        self.spark = spark
+        self.output_data = output_data
+        self.refresh_interval = refresh_interval
+        self.df = None
+        self.loaded_at = 0
+
+    def get(self):
+        """
+        Return the cached dimension, reloading it when it has gone stale.
+        """
+        if self.df is None or time.time() - self.loaded_at > self.refresh_interval:
+            if self.df is not None:
+                self.df.unpersist()
+
+            songs = self.spark.read.parquet(os.path.join(self.output_data, "songs/"))
+            artists = self.spark.read.parquet(os.path.join(self.output_data, "artists/"))
+
+            self.df = songs.join(artists, "artist_id")\
+                        .select("song_id", "title", "artist_id", "artist_name", "duration")\
+                        .dropDuplicates(["title", "artist_name"])\
+                        .cache()
+            self.loaded_at = time.time()
+        return self.df
+
+
+def read_log_stream(spark, input_data, max_files_per_trigger=None, watermark="10 minutes"):
+    """
+    Open the log-data directory as a streaming file source. Song plays are
+    stamped with their event time and de-duplicated within the watermark.
+
+    :param spark: instance of spark session
+    :param input_data: file path containing the log-data directory
+    :param max_files_per_trigger: upper bound on new files read per micro-batch
+    :param watermark: how late a duplicate event may arrive and still be dropped
+    """
+    # streaming file sources can't infer a schema, the shared event schema is given explicitly
+    reader = spark.readStream.schema(log_schema.spark_schema(raw=True))
+    if max_files_per_trigger:
+        reader = reader.option("maxFilesPerTrigger", max_files_per_trigger)
+
+    df = log_schema.spark_decode(reader.json(os.path.join(input_data, "log-data/")))
+
+    # filter by actions for song plays
+    df = df.filter(df.page == "NextSong")
+
+    # create timestamp column from original timestamp column
+    df = df.withColumn("start_time", (col("ts") / 1000).cast(TimestampType()))
+
+    return df.withWatermark("start_time", watermark)\
+             .dropDuplicates(["userId", "sessionId", "itemInSession", "start_time"])
+
+
+def new_rows(spark, df, path, key, partitions=None):
+    """
+    Rows of a micro-batch not yet in a table, so appending them keeps the table
+    free of duplicates across batches, as the batch job's drop_duplicates does.
+
+    :param spark: instance of spark session
+    :param df: rows of the micro-batch
+    :param path: file path of the table
+    :param key: columns identifying a row
+    :param partitions: optional partition columns; only the partitions the batch touches are read
+    :return: dataframe of the rows of `df` missing from the table
+    """
+    try:
+        existing = spark.read.parquet(path)
+    except AnalysisException:
+        # nothing written yet
+        return df
+
+    if partitions:
+        touched = [row.asDict() for row in df.select(*partitions).distinct().collect()]
+        if not touched:
+            return df
+        existing = existing.filter(reduce(lambda a, b: a | b, [
+            reduce(lambda a, b: a & b, [col(c) == value for c, value in values.items()]) for values in touched]))
+    return df.join(existing.select(*key).distinct(), key, how="left_anti")
+
+
+def write_micro_batch(df, batch_id, song_dimension, output_data):
+    """
+    Write one micro-batch of song plays to the users, time and songplays tables.
+    Users and time rows already in their tables are left out.
+
+    :param df: micro-batch of de-duplicated NextSong events
+    :param batch_id: id of the micro-batch assigned by spark
+    :param song_dimension: SongDimension used to resolve song and artist ids
+    :param output_data: file path for output data
+    """
+    df.persist()
+    events = df
+
+    # set aside events failing a data-quality check, with the columns of the batch quarantine table
+    df, failed = quality.split_dataframe(df, quality.event_checks('log_data'))
+    spark = df.sparkSession
+    failed.select("check_name", *log_schema.names)\
+          .write.parquet(os.path.join(output_data, "quarantine", "log"), mode="append")
+
+    # extract columns for users table. A level change is a new row, like in the batch job
+    users_path = os.path.join(output_data, "users/")
+    users_table = df.select("userId","firstName","lastName","gender","level").drop_duplicates()
+    users_table = new_rows(spark, users_table, users_path, users_table.columns)
+    users_table.write.parquet(users_path, mode="append")
+
+    # extract columns to create time table
+    time_table = df.withColumn("hour",hour("start_time"))\
+                    .withColumn("day",dayofmonth("start_time"))\
+                    .withColumn("week",weekofyear("start_time"))\
+                    .withColumn("month",month("start_time"))\
+                    .withColumn("year",year("start_time"))\
+                    .withColumn("weekday",dayofweek("start_time"))\
+                    .select("ts","start_time","hour", "day", "week", "month", "year", "weekday").drop_duplicates()
+    time_path = os.path.join(output_data, "time_table/")
+    time_table = new_rows(spark, time_table, time_path, ["ts", "start_time"], partitions=["year", "month"])
+    time_table.write.parquet(time_path, mode="append", partitionBy=["year","month"])
+
+    # songplay ids are hashed from the event key so a replayed batch keeps its ids
+    song_df = song_dimension.get()
+    songplays_table = df.join(song_df, (df.song == song_df.title) & (df.artist == song_df.artist_name), how="inner")\
+                        .select(xxhash64("userId", "sessionId", "itemInSession", "ts").alias("songplay_id"),
+                                "start_time", col("userId").alias("user_id"), "level", "song_id", "artist_id",
+                                col("sessionId").alias("session_id"), "location", col("userAgent").alias("user_agent"),
+                                year("start_time").alias("year"), month("start_time").alias("month"))
+    songplays_table.write.parquet(os.path.join(output_data, "songplays/"), mode="append", partitionBy=["year","month"])
+
+    events.unpersist()
+
+
+def process_log_stream(spark, input_data, output_data, checkpoint_dir, trigger_interval="1 minute",
+                       refresh_interval=600, max_files_per_trigger=None):
+    """
+    Start the streaming query that keeps songplays, users and time up to date
+    as new log files land in the log-data directory.
+
+    :param spark: instance of spark session
+    :param input_data: file path containing the log-data directory
+    :param output_data: file path for output data
+    :param checkpoint_dir: file path for the streaming checkpoint
+    :param trigger_interval: processing time between micro-batches
+    :param refresh_interval: seconds before the song dimension is re-read
+    :param max_files_per_trigger: upper bound on new files read per micro-batch
+    :return: the running StreamingQuery
+    """
+    song_dimension = SongDimension(spark, output_data, refresh_interval)
+    df = read_log_stream(spark, input_data, max_files_per_trigger)
+
+    return df.writeStream\
+             .foreachBatch(lambda batch_df, batch_id: write_micro_batch(batch_df, batch_id, song_dimension, output_data))\
+             .option("checkpointLocation", checkpoint_dir)\
+             .trigger(processingTime=trigger_interval)\
+             .queryName("songplays_stream")\
+             .start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream log data into the songplays, users and time tables")
+    parser.add_argument("--input-data", default="s3a://udacity-dend/",
+                        help="local path or s3a:// uri containing the song_data and log-data directories")
+    parser.add_argument("--output-data", default="s3a://udacity-dend/output/",
+                        help="local path or s3a:// uri the tables are written to")
+    parser.add_argument("--checkpoint", default=None,
+                        help="checkpoint location. Defaults to <output-data>/_checkpoints/songplays")
+    parser.add_argument("--trigger", default="1 minute", help="processing time between micro-batches")
+    parser.add_argument("--refresh-interval", type=int, default=600,
+                        help="seconds before the song dimension is re-read")
+    parser.add_argument("--max-files-per-trigger", type=int, default=None,
+                        help="upper bound on new log files read per micro-batch")
+    parser.add_argument("--skip-song-data", action="store_true",
+                        help="don't rebuild the songs and artists tables before streaming")
+    parser.add_argument("--profile", default=None,
+                        help="spark tuning profile from dl.cfg. Defaults to PROFILE in the SPARK section")
+    parser.add_argument("--timeout", type=int, default=None,
+                        help="stop the stream after this many seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    input_storage = get_storage(args.input_data, config)
+    output_storage = get_storage(args.output_data, config)
+    spark, profile = create_spark_session(args.profile, [input_storage, output_storage])
+    input_data = input_storage.uri
+    output_data = output_storage.uri
+    checkpoint_dir = args.checkpoint or output_storage.path("_checkpoints/songplays")
+
+    if not args.skip_song_data:
+        process_song_data(spark, input_data, output_data)
+
+    query = process_log_stream(spark, input_data, output_data, checkpoint_dir,
+                               trigger_interval=args.trigger,
+                               refresh_interval=args.refresh_interval,
+                               max_files_per_trigger=args.max_files_per_trigger)
+    query.awaitTermination(args.timeout)
+    logger.info("Stream metrics: {}".format(json.dumps({'profile': profile, 'last_progress': query.lastProgress})))
+    query.stop()
+
+
+if __name__ == "__main__":
+    main()
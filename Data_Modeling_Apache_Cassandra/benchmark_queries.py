@@ -0,0 +1,94 @@
+import argparse
+import configparser
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from create_tables import create_cluster
+from preprocess import find_event_files, iter_events
+from query_api import create_queries
+import repository_path
+from sparkify_common.stats import percentile
+
+
+def sample_keys(events, size, seed=0):
+    """
+    Pick query keys from loaded events, so every query hits an existing partition.
+    :return: dict of query name to list of parameter tuples
+    """
+    rng = random.Random(seed)
+    events = rng.sample(events, min(size, len(events)))
+    return {
+        'get_session_item': [(e.sessionId, e.itemInSession) for e in events],
+        'get_user_session_playlist': [(e.sessionId, e.userId) for e in events],
+        'get_song_listeners': [(e.song,) for e in events],
+    }
+
+
+def run_client(queries, keys, requests, seed):
+    """
+    Issue `requests` random queries and time each one until its rows are consumed.
+    :return: dict of query name to list of latencies in seconds
+    """
+    rng = random.Random(seed)
+    latencies = {name: [] for name in keys}
+    for _ in range(requests):
+        name = rng.choice(list(keys))
+        parameters = rng.choice(keys[name])
+        start = time.perf_counter()
+        result = getattr(queries, name)(*parameters)
+        if name != 'get_session_item':
+            for _ in result:
+                pass
+        latencies[name].append(time.perf_counter() - start)
+    return latencies
+
+
+def run_benchmark(queries, keys, clients, requests):
+    """
+    Run `clients` concurrent clients of `requests` queries each.
+    :return: tuple of dict of query name to sorted latencies, and wall clock seconds
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results = list(executor.map(lambda seed: run_client(queries, keys, requests, seed), range(clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies = {name: sorted(l for result in results for l in result[name]) for name in keys}
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure query latency under concurrent clients against a Cassandra node")
+    parser.add_argument("--event-data", default="event_data", help="directory of the loaded raw event csv files")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent client threads")
+    parser.add_argument("--requests", type=int, default=1000, help="queries per client")
+    parser.add_argument("--keys", type=int, default=1000, help="distinct keys sampled per query")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('cassandra.cfg')
+
+    cluster = create_cluster(config)
+    session = cluster.connect(config['CASSANDRA']['KEYSPACE'])
+    keys = sample_keys(list(iter_events(find_event_files(args.event_data))), args.keys)
+
+    for label in ('no cache', 'cache'):
+        queries = create_queries(session, config)
+        if label == 'no cache':
+            queries.cache = None
+        latencies, elapsed = run_benchmark(queries, keys, args.clients, args.requests)
+
+        total = sum(len(l) for l in latencies.values())
+        print('{}: {} queries from {} clients in {:.1f}s, {:.0f} queries/s'.format(
+            label, total, args.clients, elapsed, total / elapsed))
+        for name, values in latencies.items():
+            print('    {:<28} p50 {:7.2f} ms   p99 {:7.2f} ms'.format(
+                name, percentile(values, 50) * 1000, percentile(values, 99) * 1000))
+        if queries.cache is not None:
+            print('    cache hit rate {:.1%}'.format(queries.cache.hits / max(queries.cache.hits + queries.cache.misses, 1)))
+
+    cluster.shutdown()
+
+
+if __name__ == "__main__":
+    main()
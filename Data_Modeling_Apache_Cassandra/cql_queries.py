@@ -0,0 +1,67 @@
+import configparser
+from query_model import AccessPattern
+
+
+# CONFIG
+config = configparser.ConfigParser()
+config.read('cassandra.cfg')
+
+# KEYSPACE
+
+keyspace_create = ("""
+CREATE KEYSPACE IF NOT EXISTS {}
+WITH REPLICATION = {{ 'class' : 'SimpleStrategy', 'replication_factor' : {} }}
+""").format(config['CASSANDRA']['KEYSPACE'], config['CASSANDRA']['REPLICATION_FACTOR'])
+
+# ACCESS PATTERNS
+# every query table is generated from the query it answers, see query_model.py
+
+session_item = AccessPattern(
+    'session_item',
+    "artist, song title and song's length heard during a sessionId and itemInSession",
+    filters=['sessionId', 'itemInSession'],
+    columns=['artist', 'song', 'length'],
+    unique_by=['itemInSession'])
+
+user_session = AccessPattern(
+    'user_session',
+    "artist, song (sorted by itemInSession) and user name for a userId and sessionId",
+    filters=['sessionId', 'userId'],
+    columns=['artist', 'song', 'firstName', 'lastName'],
+    order_by=['itemInSession'])
+
+user_song = AccessPattern(
+    'user_song',
+    "every user name who listened to a song",
+    filters=['song'],
+    columns=['firstName', 'lastName'],
+    unique_by=['userId'])
+
+access_patterns = [session_item, user_session, user_song]
+
+# DROP TABLES
+
+session_item_table_drop = session_item.drop_table()
+user_session_table_drop = user_session.drop_table()
+user_song_table_drop = user_song.drop_table()
+
+# CREATE TABLES
+
+session_item_table_create = session_item.create_table()
+user_session_table_create = user_session.create_table()
+user_song_table_create = user_song.create_table()
+
+# SELECT RECORDS
+
+session_item_select = session_item.select()
+user_session_select = user_session.select()
+user_song_select = user_song.select()
+
+# QUERY LISTS
+
+create_table_queries = [p.create_table() for p in access_patterns]
+drop_table_queries = [p.drop_table() for p in access_patterns]
+
+# insert statements with the event fields bound to their placeholders, in order,
+# and the event fields making up the partition key
+insert_table_queries = [p.insert() for p in access_patterns]
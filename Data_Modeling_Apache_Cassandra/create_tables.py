@@ -0,0 +1,71 @@
+import configparser
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.policies import DCAwareRoundRobinPolicy, TokenAwarePolicy
+from cql_queries import keyspace_create, create_table_queries, drop_table_queries
+
+
+def create_cluster(config):
+    """
+    Cluster for the hosts in cassandra.cfg. Requests are routed token aware,
+    straight to a replica of the partition they write or read, instead of
+    through a coordinator that forwards them.
+    """
+    profile = ExecutionProfile(load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy()))
+    return Cluster(config['CASSANDRA']['HOSTS'].split(','), port=int(config['CASSANDRA']['PORT']),
+                   execution_profiles={EXEC_PROFILE_DEFAULT: profile})
+
+
+def create_keyspace(config):
+    """
+    - Connects to the Cassandra cluster
+    - Creates the sparkify keyspace and sets it on the session
+    - Returns the cluster and session
+    """
+    cluster = create_cluster(config)
+    session = cluster.connect()
+
+    session.execute(keyspace_create)
+    session.set_keyspace(config['CASSANDRA']['KEYSPACE'])
+
+    return cluster, session
+
+
+def drop_tables(session):
+    """
+    Drops each table using the queries in `drop_table_queries` list.
+    """
+    for query in drop_table_queries:
+        session.execute(query)
+
+
+def create_tables(session):
+    """
+    Creates each table using the queries in `create_table_queries` list.
+    """
+    for query in create_table_queries:
+        session.execute(query)
+
+
+def main():
+    """
+    - Creates the sparkify keyspace if it doesn't exist.
+
+    - Drops all the tables.
+
+    - Creates all tables needed.
+
+    - Finally, closes the connection.
+    """
+    config = configparser.ConfigParser()
+    config.read('cassandra.cfg')
+
+    cluster, session = create_keyspace(config)
+
+    drop_tables(session)
+    create_tables(session)
+
+    cluster.shutdown()
+
+
+if __name__ == "__main__":
+    main()
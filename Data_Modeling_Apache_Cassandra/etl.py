@@ -0,0 +1,174 @@
+import argparse
+import configparser
+import time
+from collections import defaultdict
+from itertools import islice
+from operator import attrgetter
+from cassandra.concurrent import execute_concurrent
+from cassandra.query import BatchStatement, BatchType
+from create_tables import create_cluster
+from cql_queries import insert_table_queries
+from preprocess import find_event_files, iter_events, read_event_binary, read_event_datafile
+
+
+def chunked(iterable, size):
+    """
+    Split an iterable into lists of at most `size` items without materializing it.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def prepare_inserts(session):
+    """
+    Prepare the insert statement of every query table once.
+    :return: list of prepared statement, bound event columns and partition key columns
+    """
+    prepared = []
+    for query, columns, partition_key in insert_table_queries:
+        statement = session.prepare(query)
+        # inserts can be replayed safely, so the driver may also retry them on timeouts
+        statement.is_idempotent = True
+        prepared.append((statement, columns, partition_key))
+    return prepared
+
+
+def estimate_size(values):
+    """
+    Rough serialized size of a row, used to keep batches under the server's batch size warning.
+    """
+    return sum(len(v.encode('utf8')) if isinstance(v, str) else 8 for v in values) + 16
+
+
+def partition_batches(prepared, events, batch_rows=50, batch_bytes=4096):
+    """
+    Group the rows of each query table by partition key and pack each group
+    into unlogged batches. All rows of a batch share a partition, so the batch
+    is applied as one mutation by a replica and the token-aware policy can
+    route it there directly.
+    :param prepared: prepared inserts from `prepare_inserts`
+    :param events: list of event records
+    :param batch_rows: most rows in one batch
+    :param batch_bytes: most estimated bytes in one batch
+    :return: generator of statement and the number of rows it writes
+    """
+    for statement, columns, partition_key in prepared:
+        key, values = attrgetter(*partition_key), attrgetter(*columns)
+        partitions = defaultdict(list)
+        for event in events:
+            partitions[key(event)].append(values(event))
+
+        for rows in partitions.values():
+            for batch in pack_batch(statement, rows, batch_rows, batch_bytes):
+                yield batch
+
+
+def pack_batch(statement, rows, batch_rows, batch_bytes):
+    """
+    Split the rows of one partition into batches within the row and size limits.
+    A single row is sent as a plain bound statement.
+    """
+    pending, size = [], 0
+    for values in rows + [None]:
+        row_size = estimate_size(values) if values is not None else 0
+        if pending and (values is None or len(pending) >= batch_rows or size + row_size > batch_bytes):
+            if len(pending) == 1:
+                yield statement.bind(pending[0]), 1
+            else:
+                batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+                for row in pending:
+                    batch.add(statement, row)
+                batch.is_idempotent = True
+                yield batch, len(pending)
+            pending, size = [], 0
+        if values is not None:
+            pending.append(values)
+            size += row_size
+
+
+def load_events(session, events, concurrency=64, buffer_rows=5000, batch_rows=50, batch_bytes=4096,
+                retries=3, retry_backoff=0.5):
+    """
+    Write every event to all query tables in a single pass. Events are read
+    `buffer_rows` at a time, grouped into per partition batches, executed
+    asynchronously with at most `concurrency` requests in flight, and failed
+    requests are retried with exponential backoff.
+    :param session: cassandra session with the keyspace set
+    :param events: iterable of event records
+    :param concurrency: number of requests in flight
+    :param buffer_rows: events grouped by partition at once, bounds memory held
+    :param batch_rows: most rows in one batch
+    :param batch_bytes: most estimated bytes in one batch
+    :param retries: times a failed request is retried
+    :param retry_backoff: seconds to wait before the first retry
+    :return: tuple of number of written and failed rows
+    """
+    prepared = prepare_inserts(session)
+
+    written = failed = 0
+    for chunk in chunked(events, buffer_rows):
+        pending = list(partition_batches(prepared, chunk, batch_rows, batch_bytes))
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(retry_backoff * 2 ** (attempt - 1))
+
+            results = execute_concurrent(session, [(statement, None) for statement, _ in pending],
+                                         concurrency=concurrency, raise_on_first_error=False)
+            errors = [(request, result) for request, (success, result) in zip(pending, results) if not success]
+            written += sum(rows for _, rows in pending) - sum(rows for (_, rows), _ in errors)
+            pending = [request for request, _ in errors]
+            if not pending:
+                break
+
+        # whatever is still pending failed on every attempt
+        if pending:
+            for (statement, rows), error in errors:
+                print("Error: Issue writing {} rows".format(rows))
+                print(error)
+            failed += sum(rows for _, rows in pending)
+
+    return written, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load events into the Cassandra query tables")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--event-data", default=None,
+                        help="directory of raw event csv files, streamed directly to the tables. Default EVENT_DATA in cassandra.cfg")
+    source.add_argument("--event-datafile", default=None, help="load from the denormalized event csv instead")
+    source.add_argument("--binary", default=None, help="load from the binary intermediate written by preprocess.py instead")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('cassandra.cfg')
+    loader = config['LOADER']
+
+    if args.event_datafile:
+        events = read_event_datafile(args.event_datafile)
+    elif args.binary:
+        events = read_event_binary(args.binary)
+    else:
+        events = iter_events(find_event_files(args.event_data or loader['EVENT_DATA']))
+
+    cluster = create_cluster(config)
+    session = cluster.connect(config['CASSANDRA']['KEYSPACE'])
+
+    start = time.time()
+    written, failed = load_events(session, events,
+                                  concurrency=int(loader['CONCURRENCY']),
+                                  buffer_rows=int(loader['BUFFER_ROWS']),
+                                  batch_rows=int(loader['BATCH_ROWS']),
+                                  batch_bytes=int(loader['BATCH_BYTES']),
+                                  retries=int(loader['RETRIES']),
+                                  retry_backoff=float(loader['RETRY_BACKOFF']))
+    print('{} rows written, {} failed in {:.1f}s'.format(written, failed, time.time() - start))
+
+    cluster.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+import create_tables as ct
+import etl as etl
+
+if __name__ == "__main__":
+    ct.main()
+    etl.main()
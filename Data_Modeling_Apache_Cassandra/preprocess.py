@@ -0,0 +1,149 @@
+import argparse
+import csv
+import glob
+import os
+import struct
+from operator import attrgetter
+import repository_path
+from sparkify_common.event_schema import log_schema
+
+
+# columns of the raw event_data csv files used by the query tables
+event_columns = ['artist', 'firstName', 'gender', 'itemInSession', 'lastName', 'length',
+                 'level', 'location', 'sessionId', 'song', 'userId']
+
+# events are decoded into records of these fields of the log event schema
+event_schema = log_schema.select(event_columns)
+
+# binary intermediate: a header, then per event the numeric columns packed
+# little endian followed by each text column as a 2 byte length and utf8 bytes
+binary_magic = b'SPKEVT01'
+numeric_columns = ['itemInSession', 'length', 'sessionId', 'userId']
+numeric_struct = struct.Struct('<idii')
+numeric_values = attrgetter(*numeric_columns)
+text_columns = [c for c in event_columns if c not in numeric_columns]
+text_values = attrgetter(*text_columns)
+length_struct = struct.Struct('<H')
+
+
+def find_event_files(filepath):
+    """
+    List all csv files below the event_data directory.
+    :param filepath: parent directory where the files exists
+    :return: sorted list of file paths
+    """
+    all_files = []
+    for root, dirs, files in os.walk(filepath):
+        all_files += glob.glob(os.path.join(root, '*.csv'))
+    return sorted(all_files)
+
+
+def iter_events(filepaths):
+    """
+    Lazily read the raw event csv files, one row at a time. Rows without an
+    artist are not song plays and are skipped before they are decoded. Only
+    `event_columns` are kept, looked up by header name.
+    :param filepaths: list of event csv file paths
+    :return: generator of event records
+    """
+    for filepath in filepaths:
+        with open(filepath, 'r', encoding='utf8', newline='') as csvfile:
+            csvreader = csv.reader(csvfile)
+            header = next(csvreader)
+            decode = event_schema.csv_decoder(header)
+            artist = header.index('artist')
+
+            for row in csvreader:
+                if row[artist] == '':
+                    continue
+                yield decode(row)
+
+
+def read_event_datafile(filepath):
+    """
+    Read the denormalized event csv.
+    :param filepath: path to event_datafile_new.csv
+    :return: generator of event records
+    """
+    return event_schema.read_csv(filepath)
+
+
+def write_event_datafile(events, filepath):
+    """
+    Stream events to the denormalized event csv used by the notebook.
+    :param events: iterable of event records
+    :param filepath: path to event_datafile_new.csv
+    :return: number of rows written
+    """
+    csv.register_dialect('myDialect', quoting=csv.QUOTE_ALL, skipinitialspace=True)
+
+    rows = 0
+    with open(filepath, 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f, dialect='myDialect')
+        writer.writerow(event_columns)
+        for event in events:
+            writer.writerow(event)
+            rows += 1
+    return rows
+
+
+def write_event_binary(events, filepath):
+    """
+    Stream events to the compact binary intermediate, skipping text formatting
+    and csv parsing when the events are loaded again.
+    :param events: iterable of event records
+    :param filepath: path of the binary file
+    :return: number of events written
+    """
+    rows = 0
+    with open(filepath, 'wb') as f:
+        f.write(binary_magic)
+        for event in events:
+            f.write(numeric_struct.pack(*numeric_values(event)))
+            for value in text_values(event):
+                value = value.encode('utf8')
+                f.write(length_struct.pack(len(value)))
+                f.write(value)
+            rows += 1
+    return rows
+
+
+def read_event_binary(filepath):
+    """
+    Read events back from the binary intermediate.
+    :param filepath: path of the binary file
+    :return: generator of event records
+    """
+    with open(filepath, 'rb') as f:
+        if f.read(len(binary_magic)) != binary_magic:
+            raise ValueError("{} is not an event binary file".format(filepath))
+
+        while True:
+            numbers = f.read(numeric_struct.size)
+            if not numbers:
+                return
+            event = dict(zip(numeric_columns, numeric_struct.unpack(numbers)))
+            for name in text_columns:
+                size, = length_struct.unpack(f.read(length_struct.size))
+                event[name] = f.read(size).decode('utf8')
+            yield event_schema.record(**event)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consolidate the raw event csv files for the Cassandra loader")
+    parser.add_argument("--event-data", default="event_data", help="directory of raw event csv files")
+    parser.add_argument("--csv", default=None, help="write the denormalized event csv to this path")
+    parser.add_argument("--binary", default=None, help="write the binary intermediate to this path")
+    args = parser.parse_args()
+
+    filepaths = find_event_files(args.event_data)
+    print('{} files found in {}'.format(len(filepaths), args.event_data))
+
+    if args.csv:
+        print('{} rows written to {}'.format(write_event_datafile(iter_events(filepaths), args.csv), args.csv))
+    if args.binary:
+        print('{} rows written to {}'.format(write_event_binary(iter_events(filepaths), args.binary), args.binary))
+
+
+if __name__ == "__main__":
+    main()
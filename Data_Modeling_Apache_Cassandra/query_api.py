@@ -0,0 +1,146 @@
+import configparser
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain, islice
+from create_tables import create_cluster
+from cql_queries import session_item_select, user_session_select, user_song_select
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire `ttl` seconds after they were stored.
+    Safe to share between client threads.
+    """
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        """
+        :return: tuple of whether the key was found and its value
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+class SparkifyQueries:
+    """
+    Read API over the query tables. Selects are prepared once and routed token
+    aware by the session's cluster. Results are paged `fetch_size` rows at a
+    time while they are iterated, so large partitions stream instead of being
+    materialized. Results of at most `cache_max_rows` rows are kept in a TTL
+    cache, serving hot keys without a round trip.
+
+    :param session: cassandra session with the keyspace set
+    :param fetch_size: rows per page
+    :param cache_size: most cached results, 0 disables the cache
+    :param cache_ttl: seconds a cached result is served
+    :param cache_max_rows: results larger than this aren't cached
+    """
+
+    def __init__(self, session, fetch_size=1000, cache_size=1024, cache_ttl=60, cache_max_rows=100):
+        self.session = session
+        self.cache = TTLCache(cache_size, cache_ttl) if cache_size else None
+        self.cache_max_rows = cache_max_rows
+
+        self.statements = {}
+        for name, query in (('session_item', session_item_select),
+                            ('user_session', user_session_select),
+                            ('user_song', user_song_select)):
+            statement = session.prepare(query)
+            statement.fetch_size = fetch_size
+            self.statements[name] = statement
+
+    def _rows(self, name, parameters):
+        # iterating a result set fetches the following pages on demand
+        return iter(self.session.execute(self.statements[name].bind(parameters)))
+
+    def _query(self, name, parameters):
+        if self.cache is None:
+            return self._rows(name, parameters)
+
+        key = (name,) + tuple(parameters)
+        hit, rows = self.cache.get(key)
+        if hit:
+            return iter(rows)
+
+        rows = self._rows(name, parameters)
+        head = list(islice(rows, self.cache_max_rows + 1))
+        if len(head) <= self.cache_max_rows:
+            self.cache.put(key, head)
+            return iter(head)
+        return chain(head, rows)
+
+    def get_session_item(self, session_id, item_in_session):
+        """
+        Artist, song title and song length heard during a session item.
+        :return: row or None
+        """
+        return next(self._query('session_item', (session_id, item_in_session)), None)
+
+    def get_user_session_playlist(self, session_id, user_id):
+        """
+        Artist, song and user name of every song in a user's session, sorted by itemInSession.
+        :return: iterator of rows
+        """
+        return self._query('user_session', (session_id, user_id))
+
+    def get_song_listeners(self, song):
+        """
+        First and last name of every user who listened to a song.
+        :return: iterator of rows
+        """
+        return self._query('user_song', (song,))
+
+
+def create_queries(session, config):
+    """
+    SparkifyQueries with the settings of the QUERIES section of cassandra.cfg.
+    """
+    settings = config['QUERIES']
+    return SparkifyQueries(session,
+                           fetch_size=int(settings['FETCH_SIZE']),
+                           cache_size=int(settings['CACHE_SIZE']),
+                           cache_ttl=float(settings['CACHE_TTL']),
+                           cache_max_rows=int(settings['CACHE_MAX_ROWS']))
+
+
+def main():
+    config = configparser.ConfigParser()
+    config.read('cassandra.cfg')
+
+    cluster = create_cluster(config)
+    session = cluster.connect(config['CASSANDRA']['KEYSPACE'])
+    queries = create_queries(session, config)
+
+    print(queries.get_session_item(338, 4))
+    for row in queries.get_user_session_playlist(182, 10):
+        print(row)
+    for row in queries.get_song_listeners('All Hands Against His Own'):
+        print(row)
+
+    cluster.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import argparse
+from collections import defaultdict
+from preprocess import event_schema, find_event_files, iter_events
+
+
+# cql types of the event fields the query tables are built from
+event_cql_types = event_schema.cql_types()
+
+# partitions above these are slow to read, repair and compact
+max_partition_rows = 100000
+max_partition_bytes = 100 * 1024 * 1024
+
+
+class AccessPattern:
+    """
+    A query the data model has to answer, declared by what it filters on,
+    how results are ordered and what it returns. A table answering exactly
+    this query is generated from it.
+
+    :param table: name of the generated table
+    :param description: the question the query answers
+    :param filters: event fields the query restricts by equality
+    :param columns: event fields the query returns
+    :param order_by: event fields results are sorted by, optionally as (field, 'DESC')
+    :param unique_by: event fields that, with the filters, identify one row. A filter
+        field listed here becomes a clustering column instead of part of the partition key
+    """
+
+    def __init__(self, table, description, filters, columns, order_by=(), unique_by=()):
+        self.table = table
+        self.description = description
+        self.filters = list(filters)
+        self.columns = list(columns)
+        self.order_by = [o if isinstance(o, tuple) else (o, 'ASC') for o in order_by]
+        self.unique_by = list(unique_by)
+
+        unknown = [c for c in self.filters + self.columns + [o for o, _ in self.order_by] + self.unique_by
+                   if c not in event_cql_types]
+        if unknown:
+            raise ValueError("{}: unknown event fields {}".format(table, unknown))
+
+        if not self.partition_key:
+            raise ValueError("{}: every filter is a clustering column, the table needs a partition key".format(table))
+
+    @property
+    def partition_key(self):
+        return [c for c in self.filters if c not in self.unique_by]
+
+    @property
+    def clustering_key(self):
+        # equality restricted clustering columns have to come first for the select to be valid
+        clustering = [c for c in self.filters if c in self.unique_by]
+        clustering += [c for c, _ in self.order_by if c not in clustering]
+        clustering += [c for c in self.unique_by if c not in clustering]
+        return clustering
+
+    @property
+    def table_columns(self):
+        key = self.partition_key + self.clustering_key
+        return key + [c for c in self.columns if c not in key]
+
+    def create_table(self):
+        partition_key = self.partition_key[0] if len(self.partition_key) == 1 \
+            else "({})".format(", ".join(self.partition_key))
+        primary_key = ", ".join([partition_key] + self.clustering_key)
+        columns = "".join("    {} {},\n".format(c, event_cql_types[c]) for c in self.table_columns)
+
+        query = "\nCREATE TABLE IF NOT EXISTS {}\n(\n{}    PRIMARY KEY ({})\n)\n".format(self.table, columns, primary_key)
+
+        order = dict(self.order_by)
+        if self.clustering_key:
+            query += "WITH CLUSTERING ORDER BY ({})\n".format(
+                ", ".join("{} {}".format(c, order.get(c, 'ASC')) for c in self.clustering_key))
+        return query
+
+    def drop_table(self):
+        return "DROP TABLE IF EXISTS {}".format(self.table)
+
+    def insert(self):
+        """
+        :return: insert query, event fields bound to its placeholders and partition key fields
+        """
+        query = "\nINSERT INTO {} ({}) VALUES ({})\n".format(
+            self.table, ", ".join(self.table_columns), ", ".join("?" for _ in self.table_columns))
+        return query, tuple(self.table_columns), tuple(self.partition_key)
+
+    def select(self):
+        return "\nSELECT {} FROM {} WHERE {}\n".format(
+            ", ".join(self.columns), self.table, " AND ".join("{} = ?".format(c) for c in self.filters))
+
+
+def row_size(pattern, event):
+    """
+    Rough on-disk size of one row of the pattern's table, with a per cell overhead.
+    """
+    values = (getattr(event, c) for c in pattern.table_columns)
+    return sum((len(v.encode('utf8')) if isinstance(v, str) else 4) + 8 for v in values)
+
+
+def estimate_partitions(pattern, events):
+    """
+    Estimate the partition sizes of the pattern's table from sample events.
+
+    Partitions that keep receiving rows in the second half of the sample
+    (events are read in time order) grow with the data and are reported as
+    unbounded, since only a time bucket in the key would cap them.
+
+    :param pattern: AccessPattern
+    :param events: list of sample event records, in time order
+    :return: dict of partition statistics
+    """
+    partitions = defaultdict(dict)
+    first_half, second_half = set(), set()
+    half = len(events) // 2
+    for i, event in enumerate(events):
+        key = tuple(getattr(event, c) for c in pattern.partition_key)
+        # rows with the same clustering key overwrite each other
+        partitions[key][tuple(getattr(event, c) for c in pattern.clustering_key)] = row_size(pattern, event)
+        (first_half if i < half else second_half).add(key)
+
+    recurring = first_half & second_half
+    sizes = [sum(rows.values()) for rows in partitions.values()]
+    rows = [len(rows) for rows in partitions.values()]
+
+    return {
+        'partitions': len(partitions),
+        'mean_rows': sum(rows) / max(len(rows), 1),
+        'max_rows': max(rows, default=0),
+        'mean_bytes': sum(sizes) / max(len(sizes), 1),
+        'max_bytes': max(sizes, default=0),
+        'recurring_fraction': len(recurring) / max(len(first_half), 1),
+    }
+
+
+def check_partitions(pattern, stats, scale=1.0, recurring_threshold=0.2):
+    """
+    Warn about partitions that are, or will grow, too large.
+
+    :param pattern: AccessPattern
+    :param stats: result of `estimate_partitions`
+    :param scale: how many times larger the full data set is than the sample
+    :param recurring_threshold: share of partitions still growing that marks the key as unbounded
+    :return: list of warning messages
+    """
+    warnings = []
+    unbounded = stats['recurring_fraction'] > recurring_threshold
+    # bounded partitions are complete within the sample, unbounded ones grow with the data
+    growth = scale if unbounded else 1.0
+
+    if unbounded:
+        warnings.append("{}: partition key ({}) is unbounded, {:.0%} of partitions keep growing. "
+                        "Consider adding a time bucket to the partition key".format(
+                            pattern.table, ", ".join(pattern.partition_key), stats['recurring_fraction']))
+    if stats['max_rows'] * growth > max_partition_rows:
+        warnings.append("{}: largest partition projected at {:.0f} rows".format(pattern.table, stats['max_rows'] * growth))
+    if stats['max_bytes'] * growth > max_partition_bytes:
+        warnings.append("{}: largest partition projected at {:.1f} MB".format(
+            pattern.table, stats['max_bytes'] * growth / 1024 ** 2))
+    return warnings
+
+
+def main():
+    from cql_queries import access_patterns
+
+    parser = argparse.ArgumentParser(description="Print the generated query tables and their partition size estimates")
+    parser.add_argument("--event-data", default="event_data", help="directory of raw event csv files to sample")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="how many times larger the full data set is than the sample")
+    args = parser.parse_args()
+
+    events = list(iter_events(find_event_files(args.event_data)))
+    for pattern in access_patterns:
+        stats = estimate_partitions(pattern, events)
+        print('-- {}'.format(pattern.description))
+        print(pattern.create_table())
+        print(pattern.select())
+        print('-- {partitions} partitions, {mean_rows:.1f} rows / {mean_bytes:.0f} bytes on average, '
+              'largest {max_rows} rows / {max_bytes} bytes'.format(**stats))
+        for warning in check_partitions(pattern, stats, args.scale):
+            print('-- WARNING {}'.format(warning))
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,106 +1,180 @@
 import os
 import glob
+import argparse
+import json
+from functools import partial
 import psycopg2
+from psycopg2.extras import execute_values
 import pandas as pd
 from sql_queries import *
+import repository_path
+from sparkify_common.event_schema import event_schemas
+from sparkify_common.quality import cursor_executor, min_match_rate, run_checks, split_frame
 
 
-def process_song_file(cur, filepath):
+# most rows inserted by one statement
+batch_rows = 5000
+
+
+def read_data_file(filepath, kind, cache=None):
     """
-    Read and clean/process song data file. Insert processed song data into artists
-    and song database tables.
-    :param cur: database cuser reference
-    :param filepath: path to song data json file
+    Read a song or log json file into a dataframe, from the columnar cache if one is given.
+    :param filepath: path to data json file
+    :param kind: 'song' or 'log'
+    :param cache: optional ColumnarCache
+    """
+    if cache is not None:
+        return cache.read(filepath, kind).to_pandas(integer_object_nulls=True)
+
+    # decode with the event schema instead of letting pandas infer column types
+    schema = event_schemas[kind]
+    records = list(schema.read_json(filepath))
+    columns = list(zip(*records)) or [()] * len(schema.names)
+    frame = {}
+    for field, values in zip(schema.fields, columns):
+        # integer columns with nulls keep python ints instead of becoming floats, as read from the cache
+        nullable_int = field.type in ('int', 'bigint') and None in values
+        frame[field.name] = pd.Series(values, dtype=object if nullable_int else None)
+    return pd.DataFrame(frame)
+
+
+def load_batch(cur, query, columns, rows, target):
     """
-    
-    # open song file
-    df = pd.read_json(filepath, lines=True, convert_dates = False)
-    
-    for value in df.values:
-        artist_id, artist_latitude, artist_location, artist_longitude, artist_name, duration, num_songs, song_id, title, year = value
+    Insert rows with a single statement. If the statement fails, the batch is
+    bisected and each half retried until the failing rows are isolated. Those
+    are written to the dead_letters table with the database error, the good
+    rows stay in the transaction that process_data commits.
+    :param cur: database cursor reference
+    :param query: batch insert query with a VALUES %s placeholder
+    :param columns: column names of the rows, for the dead letter records
+    :param rows: list of row value lists
+    :param target: table name the rows are loaded into
+    :return: number of dead lettered rows
+    """
+    if not rows:
+        return 0
+
+    # a failed statement aborts the transaction, rolling back to the savepoint keeps the earlier batches
+    cur.execute("SAVEPOINT load_batch")
+    try:
+        execute_values(cur, query, rows, page_size=len(rows))
+    except psycopg2.Error as e:
+        cur.execute("ROLLBACK TO SAVEPOINT load_batch")
+        if len(rows) == 1:
+            record = json.dumps(dict(zip(columns, rows[0])), default=str)
+            cur.execute(dead_letter_insert, (target, str(e).strip(), record))
+            return 1
+        middle = len(rows) // 2
+        return load_batch(cur, query, columns, rows[:middle], target) + \
+            load_batch(cur, query, columns, rows[middle:], target)
+    cur.execute("RELEASE SAVEPOINT load_batch")
+    return 0
+
+
+def frame_rows(df):
+    """
+    Rows of a dataframe as lists of python objects instead of numpy scalars, which
+    database drivers can't adapt, with None for missing values.
+    """
+    rows = df.astype(object)
+    return rows.where(rows.notna(), None).values.tolist()
 
-        try:
-            # insert artist record
-            artist_data = (artist_id, artist_name, artist_location, artist_latitude, artist_longitude)
-            cur.execute(artist_table_insert, artist_data)
-        except psycopg2.Error as e:
-            print("Error: Issue inserting artist data into artist table")
-            print(e)
-        try:
-            # insert song record
-            song_data = (song_id, title, artist_id, year, duration)
-            cur.execute(song_table_insert, song_data)
-        except psycopg2.Error as e:
-            print("Error: Issue inserting song data into song table")
-            print(e)
 
+def load_frame(cur, query, df, target):
+    """
+    Insert the rows of a dataframe in batches of at most `batch_rows`, see `load_batch`.
+    :return: number of dead lettered rows
+    """
+    rows = frame_rows(df)
+    columns = list(df.columns)
+    return sum(load_batch(cur, query, columns, rows[i:i + batch_rows], target) for i in range(0, len(rows), batch_rows))
 
 
+def quarantine_frames(df, checks, kind):
+    """
+    Set aside the rows of a data file failing a data-quality check.
+    :param df: dataframe of the data file
+    :param checks: row level checks
+    :param kind: 'song' or 'log'
+    :return: tuple of the dataframe of rows passing every check, and list of
+        quarantine table and dataframe of its rows
+    """
+    df, failed = split_frame(df, checks)
+    table = 'quarantine_songs' if kind == 'song' else 'quarantine_events'
+    return df, [(table, rows.assign(check_name=name)[['check_name'] + event_schemas[kind].names])
+                for name, rows in failed]
+
 
-def process_log_file(cur, filepath):
+def song_file_batches(df):
     """
-    Process log and clean log file. Insert data into user, time, and songplay tables.
-    :param cur: database cuser reference
-    :param filepath: path to song data json file
+    Split a song data file into the rows of each table, in load order. Rows are
+    sorted by key, so concurrent loaders lock rows in the same order.
+    :param df: dataframe of the song data file
+    :return: list of target table and dataframe of its rows
     """
-    # open log file
-    df = pd.read_json(filepath, lines=True)
+    # set aside rows failing a data-quality check
+    df, batches = quarantine_frames(df, song_file_checks, 'song')
+
+    # artist records, the last row of an artist wins as in the upsert
+    artist_df = df[['artist_id', 'artist_name', 'artist_location', 'artist_latitude', 'artist_longitude']]
+    batches.append(('artists', artist_df.drop_duplicates('artist_id', keep='last').sort_values('artist_id')))
 
-    # filter by NextSong action
-    df = df[df['page'] == "NextSong"].astype({'ts': 'datetime64[ms]'})
+    # song records
+    song_df = df[['song_id', 'title', 'artist_id', 'year', 'duration']]
+    batches.append(('songs', song_df.drop_duplicates('song_id').sort_values('song_id')))
+    return batches
+
+
+def log_file_batches(df):
+    """
+    Split a log data file into the rows of each table, in load order. Rows are
+    sorted by key, so concurrent loaders lock rows in the same order.
+    :param df: dataframe of the log data file
+    :return: list of target table and dataframe of its rows
+    """
+    # filter by NextSong action, setting aside rows failing a data-quality check
+    df = df[df['page'] == "NextSong"]
+    df, batches = quarantine_frames(df, log_file_checks, 'log')
+    df = df.astype({'ts': 'datetime64[ms]'})
 
-    # convert timestamp column to datetime
-    t = pd.Series(df['ts'], index=df.index)
-    
-    # insert time data records
+    # time data records
     time_data = []
-    for data in t:
-        time_data.append([data, data.hour, data.day, data.weekofyear, data.month, data.year, data.day_name()])
+    for data in df['ts'].drop_duplicates().sort_values():
+        time_data.append([data, data.hour, data.day, data.isocalendar()[1], data.month, data.year, data.day_name()])
     column_labels = ["timestamp", "hour", "day", "weekofyear", "month", "year", "weekday"]
-    time_df = pd.DataFrame.from_records(data = time_data, columns = column_labels)
-    
-    
-    for i, row in time_df.iterrows():
-        try:
-            cur.execute(time_table_insert, list(row))
-        except psycopg2.Error as e:
-            print("Error: Issue inserting data into time table")
-            print(e)
-
-    # load user table
+    batches.append(('time', pd.DataFrame.from_records(data = time_data, columns = column_labels)))
+
+    # user records, a user's last row wins as in the upsert
     user_df = df[['userId','firstName','lastName','gender','level']]
+    batches.append(('users', user_df.drop_duplicates('userId', keep='last').sort_values('userId')))
+
+    # songplay records, song and artist ids are looked up by the insert
+    batches.append(('songplays', df[['ts', 'userId', 'level', 'song', 'artist', 'length', 'sessionId', 'location', 'userAgent']]))
+    return batches
+
+
+def process_song_file(cur, filepath, cache=None):
+    """
+    Read and clean/process song data file. Insert processed song data into artists
+    and song database tables, one statement per table.
+    :param cur: database cursor reference
+    :param filepath: path to song data json file
+    :param cache: optional ColumnarCache to read the file from
+    """
+    for target, df in song_file_batches(read_data_file(filepath, 'song', cache)):
+        load_frame(cur, batch_insert_queries[target], df, target)
+
 
-    # insert user records
-    for i, row in user_df.iterrows():
-        try:
-            cur.execute(user_table_insert, row)
-        except psycopg2.Error as e:
-            print("Error: Issue inserting data into user table")
-            print(e)
-
-    # insert songplay records
-    for index, row in df.iterrows():
-        
-        # get songid and artistid from song and artist tables
-        try:
-            cur.execute(song_select, (row.song, row.artist, row.length))
-            results = cur.fetchone()
-        except psycopg2.Error as e:
-            print("Error: Issue retrieving songid/artistid from song and artist tables")
-            print(e)
-        
-        if results:
-            songid, artistid = results
-        else:
-            songid, artistid = None, None
-
-        # insert songplay record
-        songplay_data = ( row.ts, row.userId, row.level, songid, artistid, row.sessionId, row.location, row.userAgent)
-        try:
-            cur.execute(songplay_table_insert, songplay_data)
-        except psycopg2.Error as e:
-            print("Error: Issue inserting data into songplay table")
-            print(e)
+def process_log_file(cur, filepath, cache=None):
+    """
+    Process log and clean log file. Insert data into user, time, and songplay tables,
+    one statement per table.
+    :param cur: database cursor reference
+    :param filepath: path to log data json file
+    :param cache: optional ColumnarCache to read the file from
+    """
+    for target, df in log_file_batches(read_data_file(filepath, 'log', cache)):
+        load_frame(cur, batch_insert_queries[target], df, target)
 
 
 def process_data(cur, conn, filepath, func):
@@ -129,12 +203,44 @@ def process_data(cur, conn, filepath, func):
         print('{}/{} files processed.'.format(i, num_files))
 
 
+def check_tables(cur, min_match_rate=min_match_rate):
+    """
+    Run the data-quality checks of the loaded tables.
+    :param cur: database cursor reference
+    :param min_match_rate: lowest share of song plays resolved to a song that passes
+    :return: dict of quarantined rows per check, dead lettered rows per table and check results
+    """
+    cur.execute(quarantine_count)
+    quarantined = dict(cur.fetchall())
+    cur.execute(dead_letter_count)
+    dead_letters = dict(cur.fetchall())
+    return {'quarantined': quarantined, 'dead_letters': dead_letters, 'quality': run_checks(cursor_executor(cur), table_checks(min_match_rate))}
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Load song and log data into the sparkify database")
+    parser.add_argument("--cache-dir", default=None,
+                        help="read the json files through a columnar cache kept in this directory")
+    parser.add_argument("--min-match-rate", type=float, default=min_match_rate,
+                        help="lowest share of song plays resolved to a song that passes the checks")
+    args = parser.parse_args()
+
+    cache = None
+    if args.cache_dir:
+        # needs pyarrow, only when reading through the cache
+        from sparkify_common.columnar_cache import ColumnarCache
+        cache = ColumnarCache(args.cache_dir)
+
     conn = psycopg2.connect("host=127.0.0.1 dbname=sparkifydb user=student password=student")
     cur = conn.cursor()
 
-    process_data(cur, conn, filepath='data/song_data', func=process_song_file)
-    process_data(cur, conn, filepath='data/log_data', func=process_log_file)
+    process_data(cur, conn, filepath='data/song_data', func=partial(process_song_file, cache=cache))
+    process_data(cur, conn, filepath='data/log_data', func=partial(process_log_file, cache=cache))
+
+    if cache is not None:
+        cache.save()
+
+    print('Run metrics: {}'.format(json.dumps(check_tables(cur, args.min_match_rate))))
 
     conn.close()
 
@@ -1,3 +1,7 @@
+import repository_path
+from sparkify_common.event_schema import log_schema, song_schema
+from sparkify_common import quality
+
 # DROP TABLES
 
 songplay_table_drop = "DROP TABLE IF EXISTS songplays"
@@ -5,6 +9,9 @@ user_table_drop = "DROP TABLE IF EXISTS users"
 song_table_drop = "DROP TABLE IF EXISTS songs"
 artist_table_drop = "DROP TABLE IF EXISTS artists"
 time_table_drop = "DROP TABLE IF EXISTS time"
+quarantine_events_table_drop = "DROP TABLE IF EXISTS quarantine_events"
+quarantine_songs_table_drop = "DROP TABLE IF EXISTS quarantine_songs"
+dead_letter_table_drop = "DROP TABLE IF EXISTS dead_letters"
 
 # CREATE TABLES
 
@@ -54,6 +61,20 @@ time_table_create = ("""CREATE TABLE IF NOT EXISTS time(
     weekday VARCHAR NOT NULL)
 """)
 
+# rows of a data file failing a data-quality check are kept here, with the name of the check
+quarantine_events_table_create = log_schema.staging_ddl('quarantine_events', [('check_name', 'VARCHAR')])
+
+quarantine_songs_table_create = song_schema.staging_ddl('quarantine_songs', [('check_name', 'VARCHAR')])
+
+# rows a batch insert rejected, with the database error
+dead_letter_table_create = ("""CREATE TABLE IF NOT EXISTS dead_letters(
+    dead_letter_id SERIAL PRIMARY KEY,
+    target VARCHAR NOT NULL,
+    error TEXT NOT NULL,
+    record TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT now())
+""")
+
 # INSERT RECORDS
 
 songplay_table_insert = ("""INSERT INTO songplays VALUES (DEFAULT, %s, %s, %s, %s, %s, %s, %s, %s)
@@ -79,6 +100,64 @@ artist_table_insert = ("""INSERT INTO artists (artist_id, name, location, latitu
 time_table_insert = ("""INSERT INTO time VALUES (%s, %s, %s, %s, %s, %s, %s) ON CONFLICT (start_time) DO NOTHING
 """)
 
+# BATCH INSERTS
+# every batch is a single statement, its rows expanded into VALUES %s by psycopg2.extras.execute_values
+
+artist_table_batch_insert = ("""INSERT INTO artists (artist_id, name, location, latitude, longitude) VALUES %s
+                                ON CONFLICT (artist_id) DO UPDATE SET
+                                location = EXCLUDED.location,
+                                latitude = EXCLUDED.latitude,
+                                longitude = EXCLUDED.longitude
+""")
+
+song_table_batch_insert = ("""INSERT INTO songs (song_id, title, artist_id, year, duration) VALUES %s
+                              ON CONFLICT (song_id) DO NOTHING
+""")
+
+user_table_batch_insert = ("""INSERT INTO users (user_id, first_name, last_name, gender, level) VALUES %s
+                              ON CONFLICT (user_id) DO UPDATE SET
+                              level = EXCLUDED.level
+""")
+
+time_table_batch_insert = ("""INSERT INTO time VALUES %s ON CONFLICT (start_time) DO NOTHING
+""")
+
+# song and artist ids are looked up in the same statement, unmatched plays keep null ids
+songplay_table_batch_insert = ("""
+    INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
+    SELECT v.start_time::timestamp, v.user_id::int, v.level, m.song_id, m.artist_id, v.session_id::int, v.location, v.user_agent
+    FROM (VALUES %s) AS v (start_time, user_id, level, song, artist, length, session_id, location, user_agent)
+    LEFT JOIN LATERAL (
+        SELECT songs.song_id, artists.artist_id
+        FROM songs JOIN artists ON songs.artist_id = artists.artist_id
+        WHERE songs.title = v.song
+        AND artists.name = v.artist
+        AND songs.duration = v.length::float
+        LIMIT 1
+    ) m ON TRUE
+""")
+
+quarantine_events_insert = "INSERT INTO quarantine_events VALUES %s"
+
+quarantine_songs_insert = "INSERT INTO quarantine_songs VALUES %s"
+
+# batch insert query of each target table
+batch_insert_queries = {
+    'artists': artist_table_batch_insert,
+    'songs': song_table_batch_insert,
+    'users': user_table_batch_insert,
+    'time': time_table_batch_insert,
+    'songplays': songplay_table_batch_insert,
+    'quarantine_events': quarantine_events_insert,
+    'quarantine_songs': quarantine_songs_insert,
+}
+
+dead_letter_insert = ("""INSERT INTO dead_letters (target, error, record) VALUES (%s, %s, %s)
+""")
+
+dead_letter_count = ("""SELECT target, COUNT(*) FROM dead_letters GROUP BY target
+""")
+
 # FIND SONGS
 
 song_select = ("""
@@ -88,7 +167,45 @@ song_select = ("""
     AND artists.name = %s
     AND songs.duration = %s
 """)
+# DATA QUALITY
+
+# row level checks of each data file, failing rows are quarantined instead of loaded
+song_file_checks = quality.song_checks('song_data')
+log_file_checks = quality.event_checks('log_data')
+
+quarantine_count = ("""
+SELECT check_name, COUNT(*) FROM quarantine_events GROUP BY check_name
+UNION ALL
+SELECT check_name, COUNT(*) FROM quarantine_songs GROUP BY check_name
+""")
+
+
+def table_checks(min_match_rate=quality.min_match_rate):
+    """
+    Checks of the loaded tables.
+
+    :param min_match_rate: lowest share of song plays resolved to a song that passes
+    :return: list of Check
+    """
+    return [
+        quality.not_null('songplays', 'start_time', 'user_id', 'session_id'),
+        quality.unique('songplays', 'songplay_id'),
+        quality.unique('users', 'user_id'),
+        quality.unique('songs', 'song_id'),
+        quality.unique('artists', 'artist_id'),
+        quality.unique('time', 'start_time'),
+        quality.references('songplays', 'user_id', 'users', 'user_id'),
+        quality.references('songplays', 'song_id', 'songs', 'song_id'),
+        quality.references('songplays', 'artist_id', 'artists', 'artist_id'),
+        quality.references('songplays', 'start_time', 'time', 'start_time'),
+        quality.references('songs', 'artist_id', 'artists', 'artist_id'),
+        quality.in_range('songplays', 'start_time', quality.min_event_time, quality.max_event_time),
+        # unmatched plays are kept with a null song_id
+        quality.match_rate('songplays', 'song_id', min_match_rate),
+    ]
+
+
 # QUERY LISTS
 
-create_table_queries = [user_table_create, artist_table_create, song_table_create, time_table_create, songplay_table_create]
-drop_table_queries = [songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
\ No newline at end of file
+create_table_queries = [user_table_create, artist_table_create, song_table_create, time_table_create, songplay_table_create, quarantine_events_table_create, quarantine_songs_table_create, dead_letter_table_create]
+drop_table_queries = [songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop, quarantine_events_table_drop, quarantine_songs_table_drop, dead_letter_table_drop]
\ No newline at end of file
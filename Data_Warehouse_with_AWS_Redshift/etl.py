@@ -1,32 +1,94 @@
+import argparse
 import configparser
+import json
+from urllib.parse import urlparse
 import psycopg2
-from sql_queries import copy_table_queries, insert_table_queries
+from sql_queries import copy_table_queries, copy_cache_queries, insert_table_queries, quarantine_queries, \
+    quarantine_count, table_checks
+import repository_path
+from sparkify_common.quality import cursor_executor, run_checks
 
 
-def load_staging_tables(cur, conn):
-    for query in copy_table_queries:
+def upload_cache(config, cache_dir):
+    """
+    Convert the local song and log json files into the columnar cache and
+    upload the combined parquet files to the S3 prefixes the cache COPY reads.
+    :param config: parsed cluster.cfg
+    :param cache_dir: directory holding the cache
+    """
+    # only the cache upload needs pyarrow and boto3
+    import boto3
+    from sparkify_common.columnar_cache import ColumnarCache, find_json_files
+
+    cache = ColumnarCache(cache_dir)
+    s3 = boto3.client('s3', aws_access_key_id=config.get('AWS', 'KEY'), aws_secret_access_key=config.get('AWS', 'SECRET'))
+
+    for kind, source, target in (('log', config['CACHE']['LOG_DATA'], config['S3']['LOG_CACHE']),
+                                 ('song', config['CACHE']['SONG_DATA'], config['S3']['SONG_CACHE'])):
+        path = cache.combined(find_json_files(source), kind)
+        target = urlparse(target.strip("'"))
+        s3.upload_file(path, target.netloc, target.path.strip('/') + '/part-0.parquet')
+        print('Uploaded {} cache {} to {}'.format(kind, path, target.geturl()))
+
+    cache.prune()
+
+
+def load_staging_tables(cur, conn, queries=copy_table_queries):
+    for query in queries:
         cur.execute(query)
         conn.commit()
 
 
+def quarantine_staging_rows(cur, conn):
+    """
+    Move staged rows failing a row level data-quality check into the quarantine tables.
+    :return: dict of check name to number of quarantined rows
+    """
+    for query in quarantine_queries:
+        cur.execute(query)
+    conn.commit()
+
+    cur.execute(quarantine_count)
+    return dict(cur.fetchall())
+
+
 def insert_tables(cur, conn):
     for query in insert_table_queries:
         cur.execute(query)
         conn.commit()
 
 
+def check_tables(cur):
+    """
+    Run the data-quality checks of the star schema tables.
+    :return: dict of check name to result
+    """
+    return run_checks(cursor_executor(cur), table_checks)
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Load the staging tables and the star schema in Redshift")
+    parser.add_argument("--cache-dir", default=None,
+                        help="stage from the columnar cache of the local json files kept in this directory")
+    args = parser.parse_args()
+
     config = configparser.ConfigParser()
     config.read('cluster.cfg')
 
+    if args.cache_dir:
+        upload_cache(config, args.cache_dir)
+
     conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(config['CLUSTER']['ENDPOINT'], config['CLUSTER']['DB_NAME'], config['CLUSTER']['DB_USER'], config['CLUSTER']['DB_PASSWORD'], config['CLUSTER']['DB_PORT']))
     cur = conn.cursor()
     
-    load_staging_tables(cur, conn)
+    load_staging_tables(cur, conn, copy_cache_queries if args.cache_dir else copy_table_queries)
+    metrics = {'quarantined': quarantine_staging_rows(cur, conn)}
     insert_tables(cur, conn)
+    metrics['quality'] = check_tables(cur)
+    print('Run metrics: {}'.format(json.dumps(metrics)))
 
     conn.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,11 @@
+"""
+Puts the top of the repository, where the shared `sparkify_common` package
+lives, on the import path. The project's modules import this first, so the
+scripts keep running from the project directory.
+"""
+import sys
+from pathlib import Path
+
+root = str(Path(__file__).resolve().parents[1])
+if root not in sys.path:
+    sys.path.append(root)
@@ -1,4 +1,7 @@
 import configparser
+import repository_path
+from sparkify_common.event_schema import log_schema, song_schema
+from sparkify_common import quality
 
 
 # CONFIG
@@ -9,6 +12,8 @@ config.read('cluster.cfg')
 
 staging_events_table_drop = "DROP TABLE IF EXISTS staging_events;"
 staging_songs_table_drop = "DROP TABLE IF EXISTS staging_songs;"
+quarantine_events_table_drop = "DROP TABLE IF EXISTS quarantine_events;"
+quarantine_songs_table_drop = "DROP TABLE IF EXISTS quarantine_songs;"
 songplay_table_drop = "DROP TABLE IF EXISTS songplays;"
 user_table_drop = "DROP TABLE IF EXISTS users;"
 song_table_drop = "DROP TABLE IF EXISTS songs;"
@@ -17,45 +22,15 @@ time_table_drop = "DROP TABLE  IF EXISTS time;"
 
 # CREATE TABLES
 
-staging_events_table_create= ("""
-CREATE TABLE IF NOT EXISTS staging_events
-(
-    artist VARCHAR,
-    auth VARCHAR,
-    firstName VARCHAR(50),
-    gender CHAR,
-    itemInSession INTEGER,
-    lastName VARCHAR(50),
-    length FLOAT,
-    level VARCHAR,
-    location VARCHAR,
-    method VARCHAR,
-    page VARCHAR,
-    registration FLOAT,
-    sessionId INTEGER,
-    song VARCHAR,
-    status INTEGER,
-    ts BIGINT,
-    userAgent VARCHAR,
-    userId INTEGER
-);
-""")
+# staging tables hold the raw events, their columns are generated from the shared event schema
+staging_events_table_create = log_schema.staging_ddl('staging_events')
 
-staging_songs_table_create = ("""
-CREATE TABLE IF NOT EXISTS staging_songs
-(
-    num_songs INTEGER,
-    artist_id VARCHAR,
-    artist_latitude FLOAT,
-    artist_longitude FLOAT,
-    artist_location VARCHAR,
-    artist_name VARCHAR,
-    song_id VARCHAR,
-    title VARCHAR,
-    duration FLOAT,
-    year FLOAT
-);
-""")
+staging_songs_table_create = song_schema.staging_ddl('staging_songs')
+
+# staged rows failing a data-quality check are moved here, with the name of the check
+quarantine_events_table_create = log_schema.staging_ddl('quarantine_events', [('check_name', 'VARCHAR')])
+
+quarantine_songs_table_create = song_schema.staging_ddl('quarantine_songs', [('check_name', 'VARCHAR')])
 
 songplay_table_create = ("""
 CREATE TABLE IF NOT EXISTS songplays
@@ -145,6 +120,25 @@ region 'us-west-2'
 FORMAT AS json 'auto';
 """).format(config['S3']['SONG_DATA'], config['IAM_ROLE']['ARN'])
 
+# STAGING TABLES FROM THE COLUMNAR CACHE
+# parquet columns are matched by position, the cache keeps the staging table column order
+
+staging_events_cache_copy = ("""
+COPY staging_events
+FROM {}
+CREDENTIALS 'aws_iam_role={}'
+region 'us-west-2'
+FORMAT AS PARQUET;
+""").format(config.get('S3', 'LOG_CACHE', fallback="''"), config['IAM_ROLE']['ARN'])
+
+staging_songs_cache_copy = ("""
+COPY staging_songs
+FROM {}
+CREDENTIALS 'aws_iam_role={}'
+region 'us-west-2'
+FORMAT AS PARQUET;
+""").format(config.get('S3', 'SONG_CACHE', fallback="''"), config['IAM_ROLE']['ARN'])
+
 # FINAL TABLES
 
 songplay_table_insert = ("""
@@ -161,7 +155,7 @@ SELECT DISTINCT
 FROM staging_songs s
 INNER JOIN staging_events e
 ON (s.title = e.song AND e.artist = s.artist_name)
-AND se.page = 'NextSong';
+AND e.page = 'NextSong';
 """)
 
 user_table_insert = ("""
@@ -200,9 +194,42 @@ SELECT DISTINCT
 FROM staging_events;
 """)
 
+# DATA QUALITY
+
+# staged rows failing a row level check are quarantined before the star schema is loaded
+quarantine_queries = quality.quarantine_queries(quality.event_checks('staging_events'), 'staging_events', 'quarantine_events',
+                                                where="page = 'NextSong'") \
+    + quality.quarantine_queries(quality.song_checks('staging_songs'), 'staging_songs', 'quarantine_songs')
+
+quarantine_count = ("""
+SELECT check_name, COUNT(*) FROM quarantine_events GROUP BY check_name
+UNION ALL
+SELECT check_name, COUNT(*) FROM quarantine_songs GROUP BY check_name;
+""")
+
+table_checks = [
+    quality.not_null('songplays', 'start_time', 'user_id', 'song_id', 'session_id'),
+    quality.unique('songplays', 'start_time', 'user_id', 'session_id'),
+    # users keeps a row per level a user had
+    quality.unique('users', 'userId', 'level'),
+    quality.unique('songs', 'song_id'),
+    quality.unique('artists', 'artist_id'),
+    quality.unique('time', 'start_time'),
+    quality.references('songplays', 'user_id', 'users', 'userId'),
+    quality.references('songplays', 'song_id', 'songs', 'song_id'),
+    quality.references('songplays', 'artist_id', 'artists', 'artist_id'),
+    quality.references('songplays', 'start_time', 'time', 'start_time'),
+    quality.references('songs', 'artist_id', 'artists', 'artist_id'),
+    quality.in_range('songplays', 'start_time', quality.min_event_time, quality.max_event_time),
+    # songplays only keeps matched plays, the rate is taken against the staged plays
+    quality.match_rate('songplays', 'song_id', config.getfloat('QUALITY', 'MIN_MATCH_RATE', fallback=quality.min_match_rate),
+                       plays="SELECT COUNT(*) FROM staging_events WHERE page = 'NextSong'"),
+]
+
 # QUERY LISTS
 
-create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
-drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
+create_table_queries = [staging_events_table_create, staging_songs_table_create, quarantine_events_table_create, quarantine_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
+drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, quarantine_events_table_drop, quarantine_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
 copy_table_queries = [staging_events_copy, staging_songs_copy]
+copy_cache_queries = [staging_events_cache_copy, staging_songs_cache_copy]
 insert_table_queries = [songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert, time_table_insert]
@@ -0,0 +1,169 @@
+import argparse
+import configparser
+import json
+import os
+import random
+import time
+from datetime import datetime
+from pathlib import Path
+from dataset import generate, load_manifest
+from engines import engines, project
+import repository_path
+from sparkify_common.stats import percentile
+
+
+here = Path(__file__).resolve().parent
+
+# the query workload, in report order
+query_names = ['top_songs_per_hour', 'session_playlist', 'song_listeners', 'daily_active_users']
+
+
+def workload(manifest, requests, seed=0):
+    """
+    Draw the parameters of every query run from the generated keys, so each
+    engine runs the same queries in the same order.
+
+    :return: dict of query name to list of parameter dicts
+    """
+    rng = random.Random(seed)
+    hours = [datetime.strptime(h, '%Y-%m-%d %H:%M:%S') for h in manifest['hours']]
+    days = [datetime.strptime(d, '%Y-%m-%d').date() for d in manifest['days']]
+    params = {name: [] for name in query_names}
+    for _ in range(requests):
+        user_id, session_id = rng.choice(manifest['sessions'])
+        params['top_songs_per_hour'].append({'hour': rng.choice(hours)})
+        params['session_playlist'].append({'user_id': user_id, 'session_id': session_id})
+        params['song_listeners'].append({'title': rng.choice(manifest['titles'])})
+        params['daily_active_users'].append({'day': rng.choice(days)})
+    return params
+
+
+def time_queries(engine, params, warmup):
+    """
+    Run every query the engine serves with each parameter set, until its rows are fetched.
+
+    :return: dict of query name to latency summary in milliseconds, or None for unsupported queries
+    """
+    results = {}
+    for name in query_names:
+        query = engine.queries.get(name)
+        if query is None:
+            results[name] = None
+            continue
+        for p in params[name][:warmup]:
+            query(p)
+
+        latencies = []
+        for p in params[name]:
+            start = time.perf_counter()
+            query(p)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        results[name] = {'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+                         'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+                         'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+                         'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3)}
+    return results
+
+
+def run_engine(engine_class, config, data_dir, manifest, params, warmup):
+    """
+    Load the dataset into one engine, measure its footprint and time the workload.
+    Throughput is taken over the generated events, the same count for every
+    engine. Each model keeps a different share of them, reported apart.
+
+    :return: dict of engine metrics
+    """
+    with project(engine_class.directory):
+        engine = engine_class(config)
+        try:
+            start = time.time()
+            engine.load(data_dir)
+            load_seconds = time.time() - start
+
+            metrics = {'load_seconds': round(load_seconds, 3),
+                       'events_per_second': round(manifest['events'] / load_seconds) if load_seconds > 0 else None,
+                       'events_kept': engine.loaded_events(),
+                       'footprint_bytes': engine.footprint()}
+            metrics['queries'] = time_queries(engine, params, warmup)
+        finally:
+            engine.close()
+    return metrics
+
+
+def print_report(results):
+    print('{:<10} {:>10} {:>12} {:>12} {:>14}'.format('engine', 'load s', 'events/s', 'events kept', 'footprint MB'))
+    for name, metrics in results.items():
+        if 'error' in metrics:
+            print('{:<10} failed: {}'.format(name, metrics['error']))
+            continue
+        throughput = metrics['events_per_second']
+        print('{:<10} {:>10.1f} {:>12} {:>12} {:>14.1f}'.format(name, metrics['load_seconds'],
+                                                                '-' if throughput is None else throughput,
+                                                                metrics['events_kept'], metrics['footprint_bytes'] / 2 ** 20))
+
+    for query in query_names:
+        print('\n{}'.format(query))
+        for name, metrics in results.items():
+            if 'error' in metrics:
+                continue
+            latency = metrics['queries'][query]
+            if latency is None:
+                print('    {:<10} not served by the model'.format(name))
+            else:
+                print('    {:<10} p50 {:9.2f} ms   p95 {:9.2f} ms   p99 {:9.2f} ms'.format(
+                    name, latency['p50_ms'], latency['p95_ms'], latency['p99_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the same generated dataset into each storage model and compare "
+                                                 "load throughput, query latency and storage footprint")
+    parser.add_argument("--engines", default=",".join(engines), help="comma separated engines to run, of {}".format(
+        ", ".join(engines)))
+    parser.add_argument("--regenerate", action="store_true", help="generate the dataset even if it exists")
+    parser.add_argument("--requests", type=int, default=None,
+                        help="timed runs of each query. Default REQUESTS in benchmark.cfg")
+    parser.add_argument("--output", default=None, help="also write the results as json to this file")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(here / 'benchmark.cfg')
+    dataset, settings = config['DATASET'], config['WORKLOAD']
+
+    unknown = [e for e in args.engines.split(',') if e not in engines]
+    if unknown:
+        parser.error("unknown engines {}, expected some of {}".format(unknown, list(engines)))
+
+    # the engines run from their project directories, paths are made absolute first
+    data_dir = str(here / dataset['DIRECTORY'])
+    config['SPARK']['OUTPUT'] = str(here / config['SPARK']['OUTPUT'])
+
+    if args.regenerate or not os.path.exists(os.path.join(data_dir, 'manifest.json')):
+        print('Generating dataset in {}'.format(data_dir))
+        generate(data_dir, songs=int(dataset['SONGS']), artists=int(dataset['ARTISTS']), users=int(dataset['USERS']),
+                 days=int(dataset['DAYS']), events_per_day=int(dataset['EVENTS_PER_DAY']), seed=int(dataset['SEED']))
+    manifest = load_manifest(data_dir)
+    print('{} songs, {} log events, {} song plays'.format(manifest['songs'], manifest['events'], manifest['song_plays']))
+
+    params = workload(manifest, args.requests or int(settings['REQUESTS']), int(settings['SEED']))
+    results = {}
+    for name in args.engines.split(','):
+        print('Running {}'.format(name))
+        try:
+            results[name] = run_engine(engines[name], config, data_dir, manifest, params, int(settings['WARMUP']))
+        except Exception as e:
+            # an engine without a local service doesn't stop the others
+            print("Error: {} failed".format(name))
+            print(e)
+            results[name] = {'error': str(e)}
+
+    print_report(results)
+    metrics = {'dataset': {k: manifest[k] for k in ('songs', 'events', 'song_plays')}, 'engines': results}
+    print('Run metrics: {}'.format(json.dumps(metrics)))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(metrics, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import json
+import os
+import random
+import string
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+import repository_path
+from sparkify_common.event_schema import log_schema, song_schema
+
+
+first_names = ['Aiden', 'Ava', 'Chloe', 'Connar', 'Dustin', 'Elijah', 'Emily', 'Jacob', 'Jayden', 'Kate',
+               'Layla', 'Lily', 'Matthew', 'Mohammad', 'Olivia', 'Rylan', 'Sara', 'Tegan', 'Theodore', 'Wyatt']
+last_names = ['Bailey', 'Clark', 'Cruz', 'Fox', 'Garrison', 'Harrell', 'Jones', 'Levine', 'Lynch', 'Moreno',
+              'Patel', 'Reed', 'Rodriguez', 'Scott', 'Silva', 'Simmons', 'Smith', 'Torres', 'Warren', 'Williams']
+locations = ['Atlanta-Sandy Springs-Roswell, GA', 'Chicago-Naperville-Elgin, IL-IN-WI',
+             'Houston-The Woodlands-Sugar Land, TX', 'Los Angeles-Long Beach-Anaheim, CA',
+             'New York-Newark-Jersey City, NY-NJ-PA', 'San Francisco-Oakland-Hayward, CA',
+             'Seattle-Tacoma-Bellevue, WA', 'Tampa-St. Petersburg-Clearwater, FL']
+words = ['all', 'blue', 'broken', 'city', 'dance', 'dream', 'fire', 'ghost', 'golden', 'heart', 'home',
+         'light', 'love', 'midnight', 'moon', 'night', 'ocean', 'rain', 'river', 'road', 'shadow', 'sky',
+         'song', 'summer', 'sun', 'wild', 'wind', 'winter', 'world', 'young']
+user_agents = ['"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.143 Safari/537.36"',
+               '"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.143 Safari/537.36"',
+               'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0']
+
+# share of song plays of songs missing from the catalogue, as in the Udacity logs most plays don't resolve
+unknown_song_rate = 0.1
+# share of session items that are page views rather than song plays
+page_view_rate = 0.1
+
+
+def random_id(rng, prefix):
+    return prefix + ''.join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(16))
+
+
+def random_title(rng):
+    return ' '.join(rng.choice(words) for _ in range(rng.randint(1, 4))).title()
+
+
+def generate_songs(rng, songs, artists):
+    """
+    :return: list of song records
+    """
+    catalogue = []
+    for _ in range(artists):
+        located = rng.random() < 0.5
+        catalogue.append({
+            'artist_id': random_id(rng, 'AR'),
+            'artist_name': '{} {}'.format(rng.choice(first_names), rng.choice(last_names)),
+            'artist_location': rng.choice(locations) if located else '',
+            'artist_latitude': round(rng.uniform(25, 48), 5) if located else None,
+            'artist_longitude': round(rng.uniform(-123, -71), 5) if located else None,
+        })
+    return [song_schema.record(num_songs=1, song_id=random_id(rng, 'SO'), title=random_title(rng),
+                               duration=round(rng.uniform(90, 480), 5), year=rng.choice([0] + list(range(1960, 2019))),
+                               **rng.choice(catalogue))
+            for _ in range(songs)]
+
+
+def generate_users(rng, users):
+    return [{'userId': user_id, 'firstName': rng.choice(first_names), 'lastName': rng.choice(last_names),
+             'gender': rng.choice('MF'), 'location': rng.choice(locations), 'userAgent': rng.choice(user_agents),
+             'level': rng.choice(['free', 'paid']), 'registration': float(rng.randint(1535000000, 1540000000) * 1000)}
+            for user_id in range(1, users + 1)]
+
+
+def generate_day(rng, day, songs, cum_weights, users, events, first_session):
+    """
+    Sessions of one day: each user session plays songs back to back, with
+    popular songs played more often, and views other pages in between.
+
+    :return: tuple of list of log records and the next free session id
+    """
+    records = []
+    session_id = first_session
+    while len(records) < events:
+        user = rng.choice(users)
+        # free users upgrade now and then, so the users table sees level changes
+        if user['level'] == 'free' and rng.random() < 0.02:
+            user['level'] = 'paid'
+        ts = datetime.combine(day, datetime.min.time()) + timedelta(seconds=rng.randint(0, 86399))
+        for item in range(rng.randint(1, 40)):
+            if rng.random() < page_view_rate:
+                page, artist, song, length = rng.choice(['Home', 'Settings', 'Help', 'Thumbs Up']), None, None, None
+            elif rng.random() < unknown_song_rate:
+                page, artist, song = 'NextSong', rng.choice(last_names) + ' Band', random_title(rng)
+                length = round(rng.uniform(90, 480), 5)
+            else:
+                played = rng.choices(songs, cum_weights=cum_weights)[0]
+                page, artist, song, length = 'NextSong', played.artist_name, played.title, played.duration
+            records.append(log_schema.record(
+                artist=artist, auth='Logged In', firstName=user['firstName'], gender=user['gender'],
+                itemInSession=item, lastName=user['lastName'], length=length, level=user['level'],
+                location=user['location'], method='PUT' if page == 'NextSong' else 'GET', page=page,
+                registration=user['registration'], sessionId=session_id, song=song, status=200,
+                ts=int((ts - datetime(1970, 1, 1)).total_seconds() * 1000), userAgent=user['userAgent'],
+                userId=user['userId']))
+            ts += timedelta(seconds=length or rng.randint(5, 60))
+        session_id += 1
+    return records, session_id
+
+
+def write_json(records, filepath):
+    """
+    Write records as json lines, encoded as in the raw files.
+    """
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with open(filepath, 'w', encoding='utf8') as f:
+        for record in records:
+            values = record._asdict()
+            if 'userId' in values:
+                values['userId'] = '' if values['userId'] is None else str(values['userId'])
+            f.write(json.dumps(values) + '\n')
+
+
+def generate(directory, songs=2000, artists=500, users=200, days=7, events_per_day=5000,
+             start=datetime(2018, 11, 1), seed=0):
+    """
+    Generate a Sparkify dataset in the layout of the Udacity data sets, one
+    json file per song in song_data/ and one per day in log-data/, so every
+    engine loads it with its own pipeline. Song popularity follows a zipf
+    distribution. The manifest lists the keys the query workload draws from,
+    songs are drawn from the catalogue so every engine can resolve them.
+
+    :param directory: directory the dataset is written to
+    :return: manifest dict
+    """
+    rng = random.Random(seed)
+    song_records = generate_songs(rng, songs, artists)
+    for song in song_records:
+        write_json([song], os.path.join(directory, 'song_data', song.song_id[2], song.song_id[3], song.song_id[4],
+                                        'TR{}.json'.format(song.song_id[2:])))
+
+    cum_weights = list(accumulate(1 / rank for rank in range(1, len(song_records) + 1)))
+    user_records = generate_users(rng, users)
+    catalogued = {(song.title, song.artist_name) for song in song_records}
+    manifest = {'songs': songs, 'events': 0, 'song_plays': 0,
+                'hours': set(), 'days': [], 'sessions': set(), 'titles': set()}
+    session_id = 1
+    for offset in range(days):
+        day = (start + timedelta(days=offset)).date()
+        records, session_id = generate_day(rng, day, song_records, cum_weights, user_records, events_per_day, session_id)
+        write_json(records, os.path.join(directory, 'log-data', str(day.year), '{:02d}'.format(day.month),
+                                         '{}-events.json'.format(day.isoformat())))
+
+        plays = [r for r in records if r.page == 'NextSong']
+        manifest['events'] += len(records)
+        manifest['song_plays'] += len(plays)
+        manifest['days'].append(day.isoformat())
+        for r in plays:
+            manifest['hours'].add(datetime.fromtimestamp(r.ts // 1000, timezone.utc).strftime('%Y-%m-%d %H:00:00'))
+            manifest['sessions'].add((r.userId, r.sessionId))
+            if (r.song, r.artist) in catalogued:
+                manifest['titles'].add(r.song)
+
+    for key in ('hours', 'sessions', 'titles'):
+        manifest[key] = sorted(manifest[key])
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def load_manifest(directory):
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        return json.load(f)
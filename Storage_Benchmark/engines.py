@@ -0,0 +1,381 @@
+"""
+One adapter per storage model of the repository. Each adapter loads the
+generated dataset with its project's own schema and loading code, answers the
+benchmark queries the model can serve, and reports its storage footprint.
+
+The projects share module names (etl, sql_queries, create_tables) and read
+their config files from the working directory, so an adapter is created and
+used inside `project`, which imports from the project directory alone. Every
+adapter writes to its own schema, keyspace or directory and leaves the
+projects' tables alone.
+"""
+import configparser
+import contextlib
+import csv
+import io
+import os
+import re
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import repository_path
+from sparkify_common.event_schema import log_schema, song_schema
+from sparkify_common.files import find_json_files
+
+repository = Path(repository_path.root)
+
+
+# modules the project directories have in common
+project_modules = ['etl', 'sql_queries', 'create_tables', 'cql_queries', 'query_model', 'preprocess', 'query_api',
+                   'storage', 'data_skipping']
+
+
+@contextlib.contextmanager
+def project(directory):
+    """
+    Import a project's modules from its directory, with it as working directory.
+    """
+    def forget():
+        for name in project_modules:
+            sys.modules.pop(name, None)
+
+    path = str(repository / directory)
+    cwd = os.getcwd()
+    forget()
+    sys.path.insert(0, path)
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+        sys.path.remove(path)
+        forget()
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, dirs, files in os.walk(path) for f in files)
+
+
+# STAR SCHEMA QUERIES, named parameters are filled from the workload keys
+
+postgres_queries = {
+    'top_songs_per_hour': """
+        SELECT s.title, COUNT(*) AS plays
+        FROM songplays sp JOIN songs s ON sp.song_id = s.song_id
+        WHERE sp.start_time >= %(hour)s AND sp.start_time < %(hour)s + INTERVAL '1 hour'
+        GROUP BY s.title ORDER BY plays DESC LIMIT 10""",
+    'session_playlist': """
+        SELECT s.title, a.name
+        FROM songplays sp JOIN songs s ON sp.song_id = s.song_id JOIN artists a ON sp.artist_id = a.artist_id
+        WHERE sp.user_id = %(user_id)s AND sp.session_id = %(session_id)s
+        ORDER BY sp.start_time""",
+    'song_listeners': """
+        SELECT DISTINCT u.first_name, u.last_name
+        FROM songplays sp JOIN songs s ON sp.song_id = s.song_id JOIN users u ON sp.user_id = u.user_id
+        WHERE s.title = %(title)s""",
+    'daily_active_users': """
+        SELECT COUNT(DISTINCT user_id) FROM songplays
+        WHERE start_time >= %(day)s AND start_time < %(day)s + INTERVAL '1 day'""",
+}
+
+# the Redshift star schema names the user columns differently
+warehouse_queries = dict(postgres_queries, song_listeners="""
+        SELECT DISTINCT u.firsname, u.lastname
+        FROM songplays sp JOIN songs s ON sp.song_id = s.song_id JOIN users u ON sp.user_id = u.userId
+        WHERE s.title = %(title)s""")
+
+spark_queries = {
+    'top_songs_per_hour': """
+        SELECT s.title, COUNT(*) AS plays
+        FROM songplays sp JOIN songs s ON sp.song_id = s.song_id
+        WHERE sp.start_time >= TIMESTAMP '{hour}' AND sp.start_time < TIMESTAMP '{hour}' + INTERVAL 1 HOUR
+        GROUP BY s.title ORDER BY plays DESC LIMIT 10""",
+    'session_playlist': """
+        SELECT s.title, a.artist_name
+        FROM songplays sp JOIN songs s ON sp.song_id = s.song_id JOIN artists a ON sp.artist_id = a.artist_id
+        WHERE sp.user_id = {user_id} AND sp.session_id = {session_id}
+        ORDER BY sp.start_time""",
+    'song_listeners': """
+        SELECT DISTINCT u.firstName, u.lastName
+        FROM songplays sp JOIN songs s ON sp.song_id = s.song_id JOIN users u ON sp.user_id = u.userId
+        WHERE s.title = {title}""",
+    'daily_active_users': """
+        SELECT COUNT(DISTINCT user_id) FROM songplays
+        WHERE start_time >= TIMESTAMP '{day}' AND start_time < TIMESTAMP '{day}' + INTERVAL 1 DAY""",
+}
+
+postgres_footprint = """
+SELECT COALESCE(SUM(pg_total_relation_size(format('%%I.%%I', schemaname, tablename))), 0)
+FROM pg_tables WHERE schemaname = %s
+"""
+
+
+class PostgresSchema:
+    """
+    Base of the adapters loading a star schema into a Postgres schema of its own.
+    """
+
+    schema = None
+    query_templates = {}
+    # counts the log events the load kept
+    loaded_events_query = None
+
+    def connect(self, config):
+        import psycopg2
+        self.conn = psycopg2.connect(config['POSTGRES']['DSN'])
+        self.cur = self.conn.cursor()
+        self.cur.execute("DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0}".format(self.schema))
+        # the project's queries name tables without a schema
+        self.cur.execute("SET search_path TO {}".format(self.schema))
+        self.conn.commit()
+        self.queries = {name: self.query_function(query) for name, query in self.query_templates.items()}
+
+    def query_function(self, query):
+        def run(params):
+            self.cur.execute(query, params)
+            return self.cur.fetchall()
+        return run
+
+    def loaded_events(self):
+        self.cur.execute(self.loaded_events_query)
+        return int(self.cur.fetchone()[0])
+
+    def footprint(self):
+        self.cur.execute(postgres_footprint, (self.schema,))
+        return int(self.cur.fetchone()[0])
+
+    def close(self):
+        self.conn.close()
+
+
+class PostgresEngine(PostgresSchema):
+    """
+    Data_Modeling_with_Postgres: normalized star schema with foreign keys,
+    loaded file by file with the project's batched inserts.
+    """
+
+    name = 'postgres'
+    directory = 'Data_Modeling_with_Postgres'
+    schema = 'benchmark_postgres'
+    query_templates = postgres_queries
+    # every song play is kept, matched to a song or not, other pages aren't loaded
+    loaded_events_query = "SELECT COUNT(*) FROM songplays"
+
+    def __init__(self, config):
+        import etl
+        import sql_queries
+        self.etl = etl
+        self.connect(config)
+        for query in sql_queries.drop_table_queries + sql_queries.create_table_queries:
+            self.cur.execute(query)
+        self.conn.commit()
+
+    def load(self, data_dir):
+        # the etl prints a line per file
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.etl.process_data(self.cur, self.conn, os.path.join(data_dir, 'song_data'), self.etl.process_song_file)
+            self.etl.process_data(self.cur, self.conn, os.path.join(data_dir, 'log-data'), self.etl.process_log_file)
+
+
+def postgres_dialect(query):
+    """
+    Postgres form of a Redshift create table statement. Distribution, sort
+    and encoding clauses are dropped, IDENTITY becomes SERIAL, and primary
+    keys, which Redshift declares but doesn't enforce, are left out.
+    """
+    query = re.sub(r'INT IDENTITY\s*\(\s*\d+\s*,\s*\d+\s*\)', 'SERIAL', query)
+    return re.sub(r'DISTSTYLE \w+|DISTKEY\s*\([^)]*\)|SORTKEY\s*\([^)]*\)|ENCODE \w+|PRIMARY KEY', '', query)
+
+
+# the Redshift time insert reuses the start_time alias within its select list, which Postgres doesn't allow
+warehouse_time_table_insert = ("""
+INSERT INTO time
+SELECT DISTINCT start_time,
+       EXTRACT(HOUR FROM start_time),
+       EXTRACT(DAY FROM start_time),
+       EXTRACT(WEEK FROM start_time),
+       EXTRACT(MONTH FROM start_time),
+       EXTRACT(YEAR FROM start_time),
+       to_char(start_time, 'Day')
+FROM (SELECT TIMESTAMP 'epoch' + (ts / 1000) * INTERVAL '1 second' AS start_time FROM staging_events) e;
+""")
+
+
+class WarehouseEngine(PostgresSchema):
+    """
+    Data_Warehouse_with_AWS_Redshift with Postgres standing in for Redshift:
+    raw events are bulk copied into the staging tables, rows failing a check
+    are quarantined, and the star schema is built with the project's set
+    based INSERT ... SELECT statements.
+    """
+
+    name = 'warehouse'
+    directory = 'Data_Warehouse_with_AWS_Redshift'
+    schema = 'benchmark_warehouse'
+    query_templates = warehouse_queries
+    # every event is staged, less the quarantined rows
+    loaded_events_query = "SELECT COUNT(*) FROM staging_events"
+
+    def __init__(self, config):
+        import sql_queries
+        self.sql = sql_queries
+        self.connect(config)
+        for query in sql_queries.drop_table_queries + sql_queries.create_table_queries:
+            self.cur.execute(postgres_dialect(query))
+        self.conn.commit()
+
+    def copy(self, table, schema, filepaths):
+        """
+        COPY the decoded json files into a staging table, like the COPY from S3 does on Redshift.
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for filepath in filepaths:
+            writer.writerows(schema.read_json(filepath))
+        buffer.seek(0)
+        self.cur.copy_expert("COPY {} FROM STDIN WITH (FORMAT csv)".format(table), buffer)
+
+    def load(self, data_dir):
+        self.copy('staging_songs', song_schema, find_json_files(os.path.join(data_dir, 'song_data')))
+        self.copy('staging_events', log_schema, find_json_files(os.path.join(data_dir, 'log-data')))
+        self.conn.commit()
+
+        for query in self.sql.quarantine_queries:
+            self.cur.execute(query)
+        for query in self.sql.insert_table_queries:
+            self.cur.execute(warehouse_time_table_insert if query is self.sql.time_table_insert else query)
+        self.conn.commit()
+
+
+class CassandraEngine:
+    """
+    Data_Modeling_Apache_Cassandra: one denormalized table per query, written
+    by the project's partition batched loader. Only the queries modelled as
+    access patterns can be served; aggregations over time have no table.
+    """
+
+    name = 'cassandra'
+    directory = 'Data_Modeling_Apache_Cassandra'
+
+    def __init__(self, config):
+        import create_tables
+        import etl
+        import preprocess
+        import query_api
+        from cql_queries import create_table_queries, drop_table_queries
+
+        cassandra_config = configparser.ConfigParser()
+        cassandra_config.read('cassandra.cfg')
+        self.etl, self.preprocess = etl, preprocess
+        self.loader = cassandra_config['LOADER']
+        self.keyspace = config['CASSANDRA']['KEYSPACE']
+        self.nodetool = config['CASSANDRA']['NODETOOL']
+
+        self.cluster = create_tables.create_cluster(cassandra_config)
+        self.session = self.cluster.connect()
+        self.session.execute("DROP KEYSPACE IF EXISTS {}".format(self.keyspace))
+        self.session.execute("CREATE KEYSPACE {} WITH REPLICATION = {{ 'class' : 'SimpleStrategy', "
+                             "'replication_factor' : {} }}".format(self.keyspace,
+                                                                   cassandra_config['CASSANDRA']['REPLICATION_FACTOR']))
+        self.session.set_keyspace(self.keyspace)
+        for query in drop_table_queries + create_table_queries:
+            self.session.execute(query)
+
+        # measured without the result cache, like the other engines
+        api = query_api.SparkifyQueries(self.session, fetch_size=int(cassandra_config['QUERIES']['FETCH_SIZE']),
+                                        cache_size=0)
+        self.queries = {
+            'session_playlist': lambda p: list(api.get_user_session_playlist(p['session_id'], p['user_id'])),
+            'song_listeners': lambda p: list(api.get_song_listeners(p['title'])),
+        }
+
+    def load(self, data_dir):
+        schema = self.preprocess.event_schema
+        self.events = 0
+
+        def events():
+            # only events with an artist are loaded, the query tables are keyed by song plays
+            for filepath in find_json_files(os.path.join(data_dir, 'log-data')):
+                for event in schema.read_json(filepath):
+                    if event.artist:
+                        self.events += 1
+                        yield event
+
+        written, failed = self.etl.load_events(self.session, events(),
+                                               concurrency=int(self.loader['CONCURRENCY']),
+                                               buffer_rows=int(self.loader['BUFFER_ROWS']),
+                                               batch_rows=int(self.loader['BATCH_ROWS']),
+                                               batch_bytes=int(self.loader['BATCH_BYTES']),
+                                               retries=int(self.loader['RETRIES']),
+                                               retry_backoff=float(self.loader['RETRY_BACKOFF']))
+        if failed:
+            print("Error: {} rows failed to load into Cassandra".format(failed))
+
+    def loaded_events(self):
+        return self.events
+
+    def footprint(self):
+        """
+        Live sstable bytes reported by nodetool after a flush. Without nodetool,
+        falls back to system.size_estimates, which is refreshed every few minutes.
+        """
+        try:
+            subprocess.run([self.nodetool, 'flush', self.keyspace], check=True, capture_output=True)
+            output = subprocess.run([self.nodetool, 'tablestats', self.keyspace], check=True,
+                                    capture_output=True, text=True).stdout
+            return sum(int(size) for size in re.findall(r'Space used \(live\): (\d+)', output))
+        except (OSError, subprocess.CalledProcessError):
+            rows = self.session.execute("SELECT mean_partition_size, partitions_count FROM system.size_estimates "
+                                        "WHERE keyspace_name = %s", (self.keyspace,))
+            return sum(row.mean_partition_size * row.partitions_count for row in rows)
+
+    def close(self):
+        self.cluster.shutdown()
+
+
+class SparkEngine:
+    """
+    Data_Lake_with_Spark: the project's Spark job writing partitioned,
+    indexed parquet tables to a local directory, queried with Spark SQL.
+    """
+
+    name = 'spark'
+    directory = 'Data_Lake_with_Spark'
+
+    def __init__(self, config):
+        import etl
+        from storage import LocalStorage
+
+        self.etl = etl
+        self.output = LocalStorage(config['SPARK']['OUTPUT'])
+        shutil.rmtree(self.output.uri, ignore_errors=True)
+        self.spark, _ = etl.create_spark_session(config['SPARK']['PROFILE'], [self.output])
+        self.queries = {name: self.query_function(query) for name, query in spark_queries.items()}
+
+    def query_function(self, query):
+        def run(params):
+            params = dict(params, title="'{}'".format(params['title'].replace("'", "\\'")))
+            return self.spark.sql(query.format(**params)).collect()
+        return run
+
+    def load(self, data_dir):
+        input_data = os.path.abspath(data_dir) + '/'
+        self.etl.process_song_data(self.spark, input_data, self.output.uri)
+        self.etl.process_log_data(self.spark, input_data, self.output.uri)
+        for table in ('songs', 'artists', 'users', 'songplays'):
+            self.spark.read.parquet(self.output.path(table)).createOrReplaceTempView(table)
+
+    def loaded_events(self):
+        # the song plays the job kept, the view is registered by process_log_data
+        return self.spark.table('song_play_events').count()
+
+    def footprint(self):
+        return directory_size(self.output.uri)
+
+    def close(self):
+        self.spark.stop()
+
+
+engines = {engine.name: engine for engine in (PostgresEngine, WarehouseEngine, CassandraEngine, SparkEngine)}
@@ -0,0 +1,3 @@
+"""
+Modules shared by the Postgres, Redshift, Cassandra and Spark pipelines.
+"""
@@ -0,0 +1,242 @@
+"""
+Columnar cache of the raw song_data and log-data JSON files.
+
+Every source file is parsed once into a typed, zstd compressed parquet file
+named after a fingerprint of the file's content. Pipelines read the parquet
+files instead of parsing the JSON again. The files stay parquet because Spark
+and Redshift's COPY read them too, so they are decompressed when read rather
+than memory-mapped. A changed source file
+gets a new fingerprint and is converted again, and the stale conversion is
+removed by `prune`.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pa_json
+import pyarrow.parquet as pq
+
+from sparkify_common.event_schema import event_schemas
+from sparkify_common.files import find_json_files
+
+
+# generated from the event schema, whose field order matches the Redshift staging tables,
+# so the cache can be COPYed as parquet
+schemas = {kind: schema.arrow_schema() for kind, schema in event_schemas.items()}
+song_schema = schemas['song']
+log_schema = schemas['log']
+
+
+def parse_json_file(filepath, kind):
+    """
+    Parse a json lines file into an arrow table with the cache schema of `kind`.
+
+    :param filepath: path to a song or log json file
+    :param kind: 'song' or 'log'
+    :return: pyarrow.Table
+    """
+    schema = schemas[kind]
+    table = pa_json.read_json(filepath, parse_options=pa_json.ParseOptions(
+        explicit_schema=event_schemas[kind].arrow_schema(raw=True), unexpected_field_behavior='ignore'))
+
+    # fields the json files hold as strings, e.g. "userId": "91" or "" for logged out users
+    for name in (f.name for f in event_schemas[kind].fields if f.string_encoded):
+        column = table.column(name)
+        column = pc.if_else(pc.equal(column, ''), pa.scalar(None, pa.string()), column)
+        table = table.set_column(table.schema.get_field_index(name), name, column)
+
+    return table.select(schema.names).cast(schema)
+
+
+def write_table(table, path):
+    # write to a temporary file first so a crash never leaves a truncated cache entry. The temporary
+    # name is per process, workers converting files of identical content write the same entry
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    pq.write_table(table, temporary, compression='zstd')
+    os.replace(temporary, path)
+
+
+def convert(filepath, kind, path):
+    """
+    Convert a source file into the cache entry at `path`, unless it exists.
+    Needs no manifest, so worker processes can convert the files the
+    ColumnarCache of the parent process fingerprinted.
+
+    :param filepath: path to a song or log json file
+    :param kind: 'song' or 'log'
+    :param path: cache entry of the file, from `ColumnarCache.entry`
+    :return: path
+    """
+    if not os.path.exists(path):
+        write_table(parse_json_file(filepath, kind), path)
+    return path
+
+
+def read_converted(filepath, kind, path):
+    """
+    Read the cache entry at `path` of a source file, converting the file first if needed.
+
+    :return: pyarrow.Table
+    """
+    return pq.read_table(convert(filepath, kind, path))
+
+
+class ColumnarCache:
+    """
+    Parquet conversions of raw json files, keyed by source file fingerprint.
+
+    The manifest remembers the size, mtime and content digest of each source,
+    so unchanged files are not re-hashed on every run, and the source digests
+    each combined file was built from.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.manifest_path = os.path.join(self.cache_dir, 'manifest.json')
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.manifest = {}
+        self.combined_members = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            # manifests written before combined files were recorded hold only the sources
+            self.manifest = manifest['sources'] if 'sources' in manifest else manifest
+            self.combined_members = manifest.get('combined', {})
+
+    def fingerprint(self, filepath):
+        """
+        Content digest of a source file, re-hashed only if its size or mtime changed.
+        """
+        filepath = os.path.abspath(filepath)
+        stat = os.stat(filepath)
+        entry = self.manifest.get(filepath)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['digest']
+
+        digest = hashlib.blake2b(digest_size=16)
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+
+        self.manifest[filepath] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'digest': digest.hexdigest()}
+        return digest.hexdigest()
+
+    def cache_path(self, kind, digest):
+        return os.path.join(self.cache_dir, kind, digest[:2], digest + '.parquet')
+
+    def entry(self, filepath, kind):
+        """
+        Path of the cache entry of a source file, which may not be written yet.
+        The file's fingerprint is recorded in the manifest.
+        """
+        return self.cache_path(kind, self.fingerprint(filepath))
+
+    def get(self, filepath, kind):
+        """
+        Path of the parquet conversion of a source file, converting it if needed.
+
+        :param filepath: path to a song or log json file
+        :param kind: 'song' or 'log'
+        :return: path to the cached parquet file
+        """
+        return convert(filepath, kind, self.entry(filepath, kind))
+
+    def read(self, filepath, kind):
+        """
+        Read the cached table of a source file.
+
+        :param filepath: path to a song or log json file
+        :param kind: 'song' or 'log'
+        :return: pyarrow.Table
+        """
+        return read_converted(filepath, kind, self.entry(filepath, kind))
+
+    def build(self, filepaths, kind):
+        """
+        Convert every source file missing from the cache and save the manifest.
+
+        :return: list of cached parquet paths, in the order of `filepaths`
+        """
+        paths = [self.get(f, kind) for f in filepaths]
+        self.save()
+        return paths
+
+    def combined(self, filepaths, kind):
+        """
+        A single parquet file holding all of `filepaths`, for readers that
+        prefer one large file to many small ones (Spark, Redshift COPY).
+        Keyed by the fingerprints of all its sources.
+
+        :return: path to the combined parquet file
+        """
+        paths = self.build(filepaths, kind)
+        members = sorted(os.path.basename(p)[:-len('.parquet')] for p in paths)
+        digest = hashlib.blake2b(''.join(members).encode(), digest_size=16)
+        path = os.path.join(self.cache_dir, kind, 'combined-{}.parquet'.format(digest.hexdigest()))
+        if not os.path.exists(path):
+            tables = [pq.read_table(p) for p in paths]
+            write_table(pa.concat_tables(tables) if tables else schemas[kind].empty_table(), path)
+        self.combined_members[os.path.relpath(path, self.cache_dir)] = members
+        self.save()
+        return path
+
+    def prune(self):
+        """
+        Remove conversions whose source file was deleted or has changed, and
+        combined files built from any such conversion. Combined files of other
+        pipelines and runs stay as long as all their sources are live.
+
+        :return: number of removed files
+        """
+        self.manifest = {f: entry for f, entry in self.manifest.items() if os.path.exists(f)}
+        live = {self.fingerprint(f) for f in list(self.manifest)}
+        self.combined_members = {name: members for name, members in self.combined_members.items()
+                                 if os.path.exists(os.path.join(self.cache_dir, name))}
+
+        removed = 0
+        for kind in schemas:
+            for path in glob.glob(os.path.join(self.cache_dir, kind, '*', '*.parquet')):
+                if os.path.basename(path)[:-len('.parquet')] not in live:
+                    os.remove(path)
+                    removed += 1
+            for path in glob.glob(os.path.join(self.cache_dir, kind, 'combined-*.parquet')):
+                name = os.path.relpath(path, self.cache_dir)
+                # unrecorded combined files can't be checked, they are rebuilt when needed
+                members = self.combined_members.get(name)
+                if members is None or not live.issuperset(members):
+                    os.remove(path)
+                    self.combined_members.pop(name, None)
+                    removed += 1
+        self.save()
+        return removed
+
+    def save(self):
+        with open(self.manifest_path + '.tmp', 'w') as f:
+            json.dump({'sources': self.manifest, 'combined': self.combined_members}, f)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert raw song and log json files into the columnar cache")
+    parser.add_argument("--cache-dir", required=True, help="directory holding the cache")
+    parser.add_argument("--song-data", default=None, help="directory of song json files")
+    parser.add_argument("--log-data", default=None, help="directory of log json files")
+    args = parser.parse_args()
+
+    cache = ColumnarCache(args.cache_dir)
+    for kind, filepath in (('song', args.song_data), ('log', args.log_data)):
+        if filepath:
+            files = find_json_files(filepath)
+            print('{} {} files found in {}, combined cache at {}'.format(
+                len(files), kind, filepath, cache.combined(files, kind)))
+    print('{} stale cache files removed'.format(cache.prune()))
+
+
+if __name__ == "__main__":
+    main()
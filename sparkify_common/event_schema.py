@@ -0,0 +1,247 @@
+"""
+Canonical schema of the Sparkify song and log events.
+
+Every field is declared once, with its type and how the raw files encode it.
+Everything else describing the events is generated from the declarations:
+record types and decoders for json lines and csv files, pyarrow and Spark
+schemas, staging table DDL for Postgres and Redshift and Cassandra column
+types. Readers are given the schema, none of them infers one.
+"""
+import csv
+import json
+from collections import namedtuple
+
+
+# how each field type maps to the targets the schema is generated for
+types = {
+    'string': {'sql': 'VARCHAR', 'cql': 'text', 'arrow': 'string', 'spark': 'StringType'},
+    'int': {'sql': 'INTEGER', 'cql': 'int', 'arrow': 'int32', 'spark': 'IntegerType'},
+    'bigint': {'sql': 'BIGINT', 'cql': 'bigint', 'arrow': 'int64', 'spark': 'LongType'},
+    'double': {'sql': 'FLOAT', 'cql': 'double', 'arrow': 'float64', 'spark': 'DoubleType'},
+}
+
+
+def parse_int(value):
+    # spreadsheet exports write large numbers in exponent notation, e.g. 1.54111E+12
+    try:
+        return int(value)
+    except ValueError:
+        return int(float(value))
+
+
+def nullable(parse):
+    """
+    Wrap a text parser so empty and missing values decode to None.
+    """
+    def parse_nullable(value):
+        return None if value is None or value == '' else parse(value)
+    return parse_nullable
+
+
+# parsers of text encoded values, per field type
+text_parsers = {
+    'string': None,
+    'int': nullable(parse_int),
+    'bigint': nullable(parse_int),
+    'double': nullable(float),
+}
+
+
+class Field:
+    """
+    One event field.
+
+    :param name: field name in the raw files
+    :param type: one of `types`
+    :param string_encoded: the json files hold the value as a string, "" for null
+    :param sql_type: staging column type, defaults to the type's sql type
+    """
+
+    def __init__(self, name, type, string_encoded=False, sql_type=None):
+        if type not in types:
+            raise ValueError("{}: unknown field type {}".format(name, type))
+        self.name = name
+        self.type = type
+        self.string_encoded = string_encoded
+        self.sql_type = sql_type or types[type]['sql']
+
+    def __repr__(self):
+        return "Field({!r}, {!r})".format(self.name, self.type)
+
+
+class EventSchema:
+    """
+    Ordered fields of an event kind and the record type decoded events are
+    returned as. Records are namedtuples: tuple backed, with no per record
+    dict, and their fields are read by name or position.
+
+    :param kind: 'song' or 'log'
+    :param fields: list of Field, in staging table column order
+    """
+
+    def __init__(self, kind, fields):
+        self.kind = kind
+        self.fields = list(fields)
+        self.names = [f.name for f in self.fields]
+        self.record = namedtuple(kind.capitalize() + 'Record', self.names)
+
+    def field(self, name):
+        return self.fields[self.names.index(name)]
+
+    def select(self, names):
+        """
+        Schema of a subset of the fields, in the order of `names`.
+        """
+        unknown = [n for n in names if n not in self.names]
+        if unknown:
+            raise ValueError("{}: unknown event fields {}".format(self.kind, unknown))
+        return EventSchema(self.kind, [self.field(n) for n in names])
+
+    def json_decoder(self):
+        """
+        Decoder of one json line into a record. Json values are already typed,
+        only string encoded fields are parsed.
+
+        :return: function of a line to a record
+        """
+        names = self.names
+        parsers = [(i, text_parsers[f.type]) for i, f in enumerate(self.fields) if f.string_encoded]
+        make = self.record._make
+        loads = json.loads
+
+        def decode(line):
+            event = loads(line)
+            values = [event.get(name) for name in names]
+            for i, parse in parsers:
+                values[i] = parse(values[i])
+            return make(values)
+        return decode
+
+    def csv_decoder(self, header):
+        """
+        Decoder of one csv row into a record. Fields are looked up by header
+        name, so extra or reordered columns don't matter. Empty numeric values
+        decode to None, empty text stays ''.
+
+        :param header: list of column names of the csv file
+        :return: function of a row to a record
+        """
+        missing = [n for n in self.names if n not in header]
+        if missing:
+            raise ValueError("{}: csv header lacks {}".format(self.kind, missing))
+
+        columns = [(header.index(f.name), text_parsers[f.type]) for f in self.fields]
+        make = self.record._make
+
+        def decode(row):
+            return make([row[i] if parse is None else parse(row[i]) for i, parse in columns])
+        return decode
+
+    def read_json(self, filepath):
+        """
+        Decode a json lines file.
+
+        :return: generator of records
+        """
+        decode = self.json_decoder()
+        with open(filepath, encoding='utf8') as f:
+            for line in f:
+                if line.strip():
+                    yield decode(line)
+
+    def read_csv(self, filepath):
+        """
+        Decode a csv file with a header row.
+
+        :return: generator of records
+        """
+        with open(filepath, encoding='utf8', newline='') as f:
+            reader = csv.reader(f)
+            decode = self.csv_decoder(next(reader))
+            for row in reader:
+                yield decode(row)
+
+    def cql_types(self):
+        return {f.name: types[f.type]['cql'] for f in self.fields}
+
+    def staging_ddl(self, table, leading_columns=()):
+        """
+        Create statement of a staging table holding the raw events, valid in Postgres and Redshift.
+
+        :param leading_columns: list of column name and sql type placed before the event fields
+        """
+        columns = list(leading_columns) + [(f.name, f.sql_type) for f in self.fields]
+        columns = ",\n".join("    {} {}".format(name, sql_type) for name, sql_type in columns)
+        return "\nCREATE TABLE IF NOT EXISTS {}\n(\n{}\n);\n".format(table, columns)
+
+    def arrow_schema(self, raw=False):
+        """
+        :param raw: keep string encoded fields as strings, as they are in the json files
+        :return: pyarrow.Schema
+        """
+        import pyarrow as pa
+        return pa.schema([(f.name, getattr(pa, 'string' if raw and f.string_encoded else types[f.type]['arrow'])())
+                          for f in self.fields])
+
+    def spark_schema(self, raw=False):
+        """
+        :param raw: keep string encoded fields as strings, as they are in the json files
+        :return: pyspark StructType
+        """
+        from pyspark.sql import types as spark_types
+        return spark_types.StructType([
+            spark_types.StructField(f.name, getattr(spark_types, 'StringType' if raw and f.string_encoded
+                                                    else types[f.type]['spark'])())
+            for f in self.fields])
+
+    def spark_decode(self, df):
+        """
+        Cast the string encoded fields of a dataframe read with the raw Spark schema. Empty strings become null
+        before the cast, which raises on them with ANSI mode on, the default since Spark 4, so logged out
+        events reach the not null check instead of failing the job.
+        """
+        from pyspark.sql import types as spark_types
+        from pyspark.sql.functions import col, when
+        for f in self.fields:
+            if f.string_encoded:
+                value = when(col(f.name) != '', col(f.name))
+                df = df.withColumn(f.name, value.cast(getattr(spark_types, types[f.type]['spark'])()))
+        return df
+
+
+song_schema = EventSchema('song', [
+    Field('num_songs', 'int'),
+    Field('artist_id', 'string'),
+    Field('artist_latitude', 'double'),
+    Field('artist_longitude', 'double'),
+    Field('artist_location', 'string'),
+    Field('artist_name', 'string'),
+    Field('song_id', 'string'),
+    Field('title', 'string'),
+    Field('duration', 'double'),
+    Field('year', 'int'),
+])
+
+log_schema = EventSchema('log', [
+    Field('artist', 'string'),
+    Field('auth', 'string'),
+    Field('firstName', 'string', sql_type='VARCHAR(50)'),
+    Field('gender', 'string', sql_type='CHAR'),
+    Field('itemInSession', 'int'),
+    Field('lastName', 'string', sql_type='VARCHAR(50)'),
+    Field('length', 'double'),
+    Field('level', 'string'),
+    Field('location', 'string'),
+    Field('method', 'string'),
+    Field('page', 'string'),
+    Field('registration', 'double'),
+    Field('sessionId', 'int'),
+    Field('song', 'string'),
+    Field('status', 'int'),
+    Field('ts', 'bigint'),
+    Field('userAgent', 'string'),
+    # "91", or "" for logged out users
+    Field('userId', 'int', string_encoded=True),
+])
+
+event_schemas = {'song': song_schema, 'log': log_schema}
@@ -0,0 +1,18 @@
+"""
+Locating the raw data files.
+"""
+import glob
+import os
+
+
+def find_json_files(filepath):
+    """
+    List all json files below a directory.
+
+    :param filepath: parent directory where the files exists
+    :return: sorted list of absolute file paths
+    """
+    all_files = []
+    for root, dirs, files in os.walk(filepath):
+        all_files += [os.path.abspath(f) for f in glob.glob(os.path.join(root, '*.json'))]
+    return sorted(all_files)
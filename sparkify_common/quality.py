@@ -0,0 +1,247 @@
+"""
+Data-quality checks shared by the pipelines.
+
+A check counts the failing rows of a whole table with a single set based
+query, valid in Postgres, Redshift and Spark SQL, so tables are checked inside
+the engine instead of row by row in python. Row level checks also carry the
+sql predicate and the pandas mask selecting their failing rows, used to route
+them to a quarantine table before a batch is loaded.
+"""
+from datetime import datetime, timedelta, timezone
+
+
+# song plays outside this window have a corrupt timestamp, the end of the window moves with the clock
+min_event_time = datetime(2005, 1, 1)
+max_event_lead = timedelta(days=1)
+
+# share of song plays expected to resolve to a song of the catalogue. Pipelines set their own,
+# the default passes the bundled samples, whose song data only covers a few of the played songs
+min_match_rate = 0.0
+
+
+def max_event_time():
+    """
+    Latest valid event time, as a naive utc datetime taken when a check runs.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None) + max_event_lead
+
+
+def epoch_ms(value):
+    """
+    Milliseconds since the epoch of a naive utc datetime, the unit of the raw `ts` field.
+    """
+    return int((value - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+
+def resolve(value):
+    """
+    Value of a check parameter, calling it if it is taken when the check runs.
+    """
+    return value() if callable(value) else value
+
+
+def sql_literal(value):
+    if isinstance(value, datetime):
+        return "TIMESTAMP '{}'".format(value.strftime('%Y-%m-%d %H:%M:%S'))
+    return repr(value)
+
+
+class Check:
+    """
+    A data-quality rule on one table.
+
+    :param name: identifies the check in metrics and quarantine rows
+    :param table: checked table
+    :param failed: sql query counting the failing rows, or a function building it when the check runs
+    :param total: sql query counting the checked rows, defaults to all rows of `table`
+    :param tolerance: largest share of failing rows that still passes
+    :param predicate: sql condition selecting the failing rows, or a function building it, row level checks only
+    :param mask: function of a pandas dataframe to a boolean series of its failing rows, row level checks only
+    """
+
+    def __init__(self, name, table, failed, total=None, tolerance=0.0, predicate=None, mask=None):
+        self.name = name
+        self.table = table
+        self._failed = failed
+        self.total = total or "SELECT COUNT(*) FROM {}".format(table)
+        self.tolerance = tolerance
+        self._predicate = predicate
+        self.mask = mask
+
+    @property
+    def failed(self):
+        return resolve(self._failed)
+
+    @property
+    def predicate(self):
+        return resolve(self._predicate)
+
+    def query(self):
+        """
+        :return: query of a single row of the failed and total row counts
+        """
+        return "SELECT ({}) AS failed, ({}) AS total".format(self.failed, self.total)
+
+    def result(self, failed, total):
+        rate = failed / total if total else 0.0
+        return {'failed': failed, 'total': total, 'failed_rate': round(rate, 4), 'passed': rate <= self.tolerance}
+
+
+def not_null(table, *columns):
+    """
+    Key columns must be set.
+    """
+    predicate = " OR ".join("{} IS NULL".format(c) for c in columns)
+    return Check("{}: {} not null".format(table, ", ".join(columns)), table,
+                 failed="SELECT COUNT(*) FROM {} WHERE {}".format(table, predicate),
+                 predicate=predicate,
+                 mask=lambda df: df[list(columns)].isna().any(axis=1))
+
+
+def in_range(table, column, low=None, high=None):
+    """
+    Values of `column` must lie within [low, high]. Nulls pass, `not_null` covers them.
+    A bound can be a function, called each time the check runs.
+    """
+    bounds = ([(low, '<')] if low is not None else []) + ([(high, '>')] if high is not None else [])
+
+    def predicate():
+        return " OR ".join("{} {} {}".format(column, op, sql_literal(resolve(bound))) for bound, op in bounds)
+
+    def mask(df):
+        # compare only the set values, object columns holding None can't be compared
+        values = df[column].dropna()
+        masks = [(values < resolve(bound)) if op == '<' else (values > resolve(bound)) for bound, op in bounds]
+        failing = masks[0]
+        for m in masks[1:]:
+            failing = failing | m
+        return failing.reindex(df.index, fill_value=False)
+
+    return Check("{}: {} in range".format(table, column), table,
+                 failed=lambda: "SELECT COUNT(*) FROM {} WHERE {}".format(table, predicate()),
+                 predicate=predicate, mask=mask)
+
+
+def unique(table, *columns):
+    """
+    No two rows may share the primary key. Every row of a duplicated key fails.
+    """
+    key = ", ".join(columns)
+    return Check("{}: {} unique".format(table, key), table,
+                 failed="SELECT COALESCE(SUM(n), 0) FROM (SELECT COUNT(*) AS n FROM {} GROUP BY {} HAVING COUNT(*) > 1) d"
+                        .format(table, key))
+
+
+def references(table, column, parent, parent_column):
+    """
+    Every set value of `column` must exist in the parent table.
+    """
+    return Check("{}: {} references {}.{}".format(table, column, parent, parent_column), table,
+                 failed="SELECT COUNT(*) FROM {} c LEFT JOIN {} p ON c.{} = p.{} WHERE c.{} IS NOT NULL AND p.{} IS NULL"
+                        .format(table, parent, column, parent_column, column, parent_column))
+
+
+def match_rate(table, column, minimum=min_match_rate, plays=None):
+    """
+    Share of song plays resolved to a song. The failing rows are the unmatched plays.
+
+    :param minimum: lowest share of matched plays that passes
+    :param plays: query counting all song plays, for tables that only keep matched plays. The table
+        must hold at most one row per play, more matched rows than plays count as no failures
+    """
+    if plays is None:
+        failed = "SELECT COUNT(*) - COUNT({}) FROM {}".format(column, table)
+    else:
+        failed = "SELECT GREATEST(({}) - COUNT({}), 0) FROM {}".format(plays, column, table)
+    return Check("{}: {} match rate".format(table, column), table, failed=failed, total=plays, tolerance=1 - minimum)
+
+
+def event_checks(table):
+    """
+    Row level checks of raw NextSong log events.
+    """
+    return [not_null(table, 'userId', 'sessionId', 'ts'),
+            in_range(table, 'ts', epoch_ms(min_event_time), lambda: epoch_ms(max_event_time()))]
+
+
+def song_checks(table):
+    """
+    Row level checks of raw song records.
+    """
+    return [not_null(table, 'song_id', 'artist_id', 'title'),
+            in_range(table, 'duration', low=0)]
+
+
+def run_checks(execute, checks):
+    """
+    Run every check with one query each.
+
+    :param execute: function of a query to its single result row
+    :param checks: list of Check
+    :return: dict of check name to result
+    """
+    results = {}
+    for check in checks:
+        failed, total = execute(check.query())
+        results[check.name] = check.result(int(failed or 0), int(total or 0))
+    return results
+
+
+def cursor_executor(cur):
+    """
+    `execute` function of `run_checks` for a dbapi cursor.
+    """
+    def execute(query):
+        cur.execute(query)
+        return cur.fetchone()
+    return execute
+
+
+def split_frame(df, checks):
+    """
+    Split a pandas batch into the rows passing every row level check and the
+    failing rows of each check. A row failing several checks is reported by the first.
+
+    :return: tuple of passing dataframe and list of check name and failing dataframe
+    """
+    failed = []
+    for check in checks:
+        mask = check.mask(df)
+        if mask.any():
+            failed.append((check.name, df[mask]))
+            df = df[~mask]
+    return df, failed
+
+
+def split_dataframe(df, checks):
+    """
+    Split a Spark batch like `split_frame`, evaluating the checks' sql predicates.
+
+    :return: tuple of passing dataframe and dataframe of failing rows with a leading check_name column
+    """
+    from pyspark.sql.functions import coalesce, expr, lit
+
+    quarantine = None
+    for check in checks:
+        condition = coalesce(expr(check.predicate), lit(False))
+        failing = df.filter(condition).select(lit(check.name).alias('check_name'), *df.columns)
+        quarantine = failing if quarantine is None else quarantine.unionByName(failing)
+        df = df.filter(~condition)
+    return df, quarantine
+
+
+def quarantine_queries(checks, source, quarantine, where=None):
+    """
+    Queries moving the rows of a staging table failing a row level check into
+    its quarantine table, which has a leading check_name column followed by
+    the staging columns.
+
+    :param where: condition restricting the checked rows
+    :return: list of queries
+    """
+    queries = []
+    for check in checks:
+        condition = "({})".format(check.predicate) if where is None else "{} AND ({})".format(where, check.predicate)
+        queries.append("INSERT INTO {} SELECT '{}', * FROM {} WHERE {};".format(quarantine, check.name, source, condition))
+        queries.append("DELETE FROM {} WHERE {};".format(source, condition))
+    return queries
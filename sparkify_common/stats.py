@@ -0,0 +1,12 @@
+"""
+Summary statistics of the benchmarks.
+"""
+
+
+def percentile(values, p):
+    """
+    Nearest rank percentile of a sorted list.
+    """
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
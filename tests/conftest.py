@@ -0,0 +1,50 @@
+"""
+The projects share module names (etl, sql_queries, create_tables) and read
+their config files from the working directory, so a test imports a project's
+modules inside the `project` fixture, like the projects are run.
+"""
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+repository = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(repository))
+
+# modules the project directories have in common
+project_modules = ['etl', 'sql_queries', 'create_tables', 'cql_queries', 'query_model', 'preprocess', 'query_api',
+                   'storage', 'data_skipping', 'async_etl', 'stream_etl', 'benchmark', 'benchmark_queries',
+                   'dataset', 'engines', 'repository_path']
+
+
+def forget():
+    for name in project_modules:
+        sys.modules.pop(name, None)
+
+
+@pytest.fixture
+def project(monkeypatch):
+    """
+    Make a project directory the import path and working directory of the test.
+    """
+    def use(directory):
+        forget()
+        monkeypatch.syspath_prepend(str(repository / directory))
+        monkeypatch.chdir(repository / directory)
+
+    yield use
+    forget()
+
+
+@pytest.fixture(scope='session')
+def spark():
+    pytest.importorskip('pyspark')
+    if shutil.which('java') is None:
+        pytest.skip('Spark needs a java runtime')
+    from pyspark.sql import SparkSession
+
+    session = SparkSession.builder.master('local[1]').config('spark.sql.shuffle.partitions', '1')\
+        .config('spark.ui.enabled', 'false').getOrCreate()
+    yield session
+    session.stop()
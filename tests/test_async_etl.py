@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture
+def async_etl(project):
+    pytest.importorskip('asyncpg')
+    pytest.importorskip('pandas')
+    project('Data_Modeling_with_Postgres')
+    import async_etl
+    return async_etl
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    for i in range(20):
+        (tmp_path / '{:02d}.json'.format(i)).write_text('{}\n')
+    return str(tmp_path)
+
+
+def process(async_etl, data_dir, connections=2, queue_size=1):
+    async def run():
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            await asyncio.wait_for(async_etl.process_data(None, executor, data_dir, 'song', workers=2,
+                                                          connections=connections, queue_size=queue_size), 10)
+    asyncio.run(run())
+
+
+def test_process_data_loads_every_file(async_etl, data_dir, monkeypatch):
+    loaded = []
+
+    async def load_file(pool, batches):
+        loaded.append(batches)
+
+    monkeypatch.setattr(async_etl, 'parse_file', lambda filepath, kind, cache_entry: filepath)
+    monkeypatch.setattr(async_etl, 'load_file', load_file)
+
+    process(async_etl, data_dir)
+
+    assert sorted(loaded) == async_etl.find_json_files(data_dir)
+
+
+def test_failing_loaders_stop_the_load(async_etl, data_dir, monkeypatch):
+    parsed = []
+
+    def parse_file(filepath, kind, cache_entry):
+        parsed.append(filepath)
+        return filepath
+
+    async def load_file(pool, batches):
+        raise ValueError('load failed')
+
+    monkeypatch.setattr(async_etl, 'parse_file', parse_file)
+    monkeypatch.setattr(async_etl, 'load_file', load_file)
+
+    # with every loader gone the parsers used to wait on the full queue forever
+    with pytest.raises(ValueError, match='load failed'):
+        process(async_etl, data_dir)
+    assert len(parsed) < 20
+
+
+def test_failing_parser_stops_the_loaders(async_etl, data_dir, monkeypatch):
+    def parse_file(filepath, kind, cache_entry):
+        raise ValueError('parse failed')
+
+    async def load_file(pool, batches):
+        pass
+
+    monkeypatch.setattr(async_etl, 'parse_file', parse_file)
+    monkeypatch.setattr(async_etl, 'load_file', load_file)
+
+    with pytest.raises(ValueError, match='parse failed'):
+        process(async_etl, data_dir)
+
+
+def test_numbered_query(async_etl):
+    query = async_etl.numbered_query('users', 5)
+
+    assert 'VALUES ($1, $2, $3, $4, $5)' in query
+    assert '$1::timestamp' in async_etl.numbered_query('songplays', 9)
+
+
+class FakePool:
+
+    async def close(self):
+        pass
+
+
+def test_run_with_cache_dir_keeps_the_manifest(async_etl, tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    from sparkify_common.columnar_cache import ColumnarCache
+    source = Path(async_etl.__file__).parent / 'data'
+    for kind, count in (('song_data', 3), ('log_data', 2)):
+        for path in sorted(source.joinpath(kind).rglob('*.json'))[:count]:
+            target = tmp_path / 'data' / kind / path.name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(path, target)
+    monkeypatch.chdir(tmp_path)
+
+    loaded = []
+
+    async def create_pool(dsn, min_size, max_size):
+        return FakePool()
+
+    async def load_file(pool, batches):
+        loaded.append(batches)
+
+    async def check_tables(pool, min_match_rate):
+        return {}
+
+    monkeypatch.setattr(async_etl.asyncpg, 'create_pool', create_pool)
+    monkeypatch.setattr(async_etl, 'load_file', load_file)
+    monkeypatch.setattr(async_etl, 'check_tables', check_tables)
+    args = argparse.Namespace(dsn=None, workers=2, connections=2, queue_size=2, cache_dir='cache', min_match_rate=0.0)
+
+    asyncio.run(async_etl.run(args))
+
+    assert len(loaded) == 5
+    cache = ColumnarCache('cache')
+    assert len(cache.manifest) == 5
+    # the conversions made by the workers are recorded, so a prune keeps them
+    assert cache.prune() == 0
+    assert len(list((tmp_path / 'cache').rglob('*.parquet'))) == 5
+
+    # a second run reads the conversions back
+    loaded.clear()
+    asyncio.run(async_etl.run(args))
+    assert len(loaded) == 5 and len(list((tmp_path / 'cache').rglob('*.parquet'))) == 5
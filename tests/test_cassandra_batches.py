@@ -0,0 +1,122 @@
+from collections import namedtuple
+
+import pytest
+
+Event = namedtuple('Event', ['sessionId', 'itemInSession', 'userId', 'song'])
+
+
+class FakeStatement:
+    """
+    Prepared statement stand-in, bound rows are returned as tuples.
+    """
+
+    def bind(self, values):
+        return tuple(values)
+
+
+class FakeBatch:
+
+    def __init__(self, batch_type=None):
+        self.rows = []
+
+    def add(self, statement, row):
+        self.rows.append(tuple(row))
+
+
+@pytest.fixture
+def etl(project, monkeypatch):
+    pytest.importorskip('cassandra')
+    project('Data_Modeling_Apache_Cassandra')
+    import etl
+    monkeypatch.setattr(etl, 'BatchStatement', FakeBatch)
+    return etl
+
+
+def rows_of(statement):
+    return statement.rows if isinstance(statement, FakeBatch) else [statement]
+
+
+def test_pack_batch_sends_single_row_bound(etl):
+    (statement, rows), = etl.pack_batch(FakeStatement(), [(1, 0, 'a')], batch_rows=50, batch_bytes=4096)
+
+    assert statement == (1, 0, 'a') and rows == 1
+
+
+def test_pack_batch_splits_at_row_limit(etl):
+    rows = [(1, i, 'a') for i in range(5)]
+
+    batches = list(etl.pack_batch(FakeStatement(), rows, batch_rows=2, batch_bytes=4096))
+
+    assert [count for _, count in batches] == [2, 2, 1]
+    assert isinstance(batches[0][0], FakeBatch) and batches[2][0] == (1, 4, 'a')
+    assert [row for statement, _ in batches for row in rows_of(statement)] == rows
+
+
+def test_pack_batch_splits_at_size_limit(etl):
+    rows = [(1, i, 'x' * 100) for i in range(4)]
+    row_size = etl.estimate_size(rows[0])
+
+    batches = list(etl.pack_batch(FakeStatement(), rows, batch_rows=50, batch_bytes=2 * row_size))
+
+    assert [count for _, count in batches] == [2, 2]
+
+
+@pytest.mark.parametrize('columns, partition_key', [
+    (['sessionId', 'itemInSession', 'song'], ['sessionId']),
+    (['userId', 'sessionId', 'itemInSession'], ['userId', 'sessionId']),
+])
+def test_partition_batches_share_a_partition(etl, columns, partition_key):
+    events = [Event(session, item, 10, 'song {}'.format(item)) for session in (1, 2, 3) for item in range(4)]
+    prepared = [(FakeStatement(), columns, partition_key)]
+
+    batches = list(etl.partition_batches(prepared, events, batch_rows=3, batch_bytes=4096))
+
+    assert sum(count for _, count in batches) == len(events)
+    for statement, count in batches:
+        rows = rows_of(statement)
+        assert len(rows) == count <= 3
+        assert len({row[:len(partition_key)] for row in rows}) == 1
+
+
+def test_partition_batches_write_every_table(etl):
+    events = [Event(1, item, 10, 'song') for item in range(3)]
+    prepared = [(FakeStatement(), ['sessionId', 'itemInSession'], ['sessionId']),
+                (FakeStatement(), ['userId', 'itemInSession'], ['userId'])]
+
+    batches = list(etl.partition_batches(prepared, events))
+
+    assert [count for _, count in batches] == [3, 3]
+
+
+class FakeSession:
+
+    def prepare(self, query):
+        return FakeStatement()
+
+
+def test_load_events_retries_failed_requests(etl, monkeypatch):
+    from preprocess import event_schema
+    songs = ['steady', 'flaky', 'broken', 'steady']
+    events = [event_schema.record(**dict(dict.fromkeys(event_schema.names), sessionId=i, itemInSession=0,
+                                         userId=i, song=song)) for i, song in enumerate(songs)]
+    attempts = []
+
+    def execute_concurrent(session, statements, concurrency, raise_on_first_error):
+        # every table row holds the song, 'flaky' rows fail once and 'broken' rows on every attempt
+        songs = [next(v for v in statement if v in ('steady', 'flaky', 'broken')) for statement, _ in statements]
+        attempts.append(songs)
+        failing = ('flaky', 'broken') if len(attempts) == 1 else ('broken',)
+        return [(False, 'timeout') if song in failing else (True, []) for song in songs]
+
+    sleeps = []
+    monkeypatch.setattr(etl, 'execute_concurrent', execute_concurrent)
+    monkeypatch.setattr(etl.time, 'sleep', sleeps.append)
+
+    # one row per request, so each request is one event for one of the three tables
+    written, failed = etl.load_events(FakeSession(), events, batch_rows=1, retries=3, retry_backoff=0.5)
+
+    assert (written, failed) == (9, 3)
+    assert sorted(attempts[0]) == sorted(songs * 3)
+    # a retry only sends the requests that failed
+    assert [sorted(songs) for songs in attempts[1:]] == [['broken'] * 3 + ['flaky'] * 3] + [['broken'] * 3] * 2
+    assert sleeps == [0.5, 1.0, 2.0]
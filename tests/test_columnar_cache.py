@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+pytest.importorskip('pyarrow')
+from sparkify_common.columnar_cache import ColumnarCache
+
+
+song = ('{"num_songs": 1, "artist_id": "ARD7TVE1187B99BFB1", "artist_latitude": null, "artist_longitude": null, '
+        '"artist_location": "California - LA", "artist_name": "Casual", "song_id": "SOMZWCG12A8C13C480", '
+        '"title": "I Didn\'t Mean To", "duration": 218.93179, "year": %d}\n')
+
+
+def write_song(path, year=0):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(song % year)
+    return str(path)
+
+
+def cached_files(cache_dir):
+    return sorted(os.path.relpath(os.path.join(root, f), cache_dir)
+                  for root, dirs, files in os.walk(cache_dir) for f in files if f.endswith('.parquet'))
+
+
+def test_fingerprint_follows_content(tmp_path):
+    cache = ColumnarCache(tmp_path / 'cache')
+    first = write_song(tmp_path / 'data' / 'a.json')
+    same = write_song(tmp_path / 'data' / 'b.json')
+
+    digest = cache.fingerprint(first)
+    assert cache.fingerprint(same) == digest
+
+    write_song(tmp_path / 'data' / 'a.json', year=2000)
+    os.utime(first, ns=(0, 0))
+    assert cache.fingerprint(first) != digest
+
+
+def test_fingerprint_is_remembered_across_runs(tmp_path):
+    source = write_song(tmp_path / 'data' / 'a.json')
+    cache = ColumnarCache(tmp_path / 'cache')
+    cache.build([source], 'song')
+
+    reopened = ColumnarCache(tmp_path / 'cache')
+    assert os.path.abspath(source) in reopened.manifest
+    assert reopened.read(source, 'song').column('year').to_pylist() == [0]
+
+
+def test_prune_removes_stale_conversions(tmp_path):
+    source = write_song(tmp_path / 'data' / 'a.json')
+    cache = ColumnarCache(tmp_path / 'cache')
+    stale = cache.get(source, 'song')
+
+    write_song(tmp_path / 'data' / 'a.json', year=2000)
+    os.utime(source, ns=(0, 0))
+    fresh = cache.get(source, 'song')
+
+    assert cache.prune() == 1
+    assert not os.path.exists(stale) and os.path.exists(fresh)
+
+
+def test_prune_keeps_combined_files_of_other_runs(tmp_path):
+    songs = [write_song(tmp_path / 'data' / 'song' / '{}.json'.format(i), year=i) for i in range(2)]
+    other = write_song(tmp_path / 'data' / 'other' / 'c.json', year=5)
+
+    first = ColumnarCache(tmp_path / 'cache')
+    combined = first.combined(songs, 'song')
+
+    # another pipeline sharing the cache builds and prunes its own files
+    second = ColumnarCache(tmp_path / 'cache')
+    second.combined([other], 'song')
+    assert second.prune() == 0
+    assert os.path.exists(combined)
+
+    os.remove(songs[0])
+    third = ColumnarCache(tmp_path / 'cache')
+    assert third.prune() == 2
+    assert not os.path.exists(combined)
+    assert len(cached_files(tmp_path / 'cache')) == 3
+
+
+def test_prune_removes_unrecorded_combined_files(tmp_path):
+    cache = ColumnarCache(tmp_path / 'cache')
+    unrecorded = tmp_path / 'cache' / 'song' / 'combined-0.parquet'
+    unrecorded.parent.mkdir(parents=True)
+    unrecorded.write_bytes(b'')
+
+    assert cache.prune() == 1
+    assert not unrecorded.exists()
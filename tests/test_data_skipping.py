@@ -0,0 +1,74 @@
+import pytest
+
+
+@pytest.fixture
+def data_skipping(project):
+    pytest.importorskip('pyspark')
+    project('Data_Lake_with_Spark')
+    import data_skipping
+    return data_skipping
+
+
+def test_bloom_filter_has_no_false_negatives(data_skipping):
+    bloom = data_skipping.BloomFilter.for_capacity(1000)
+    for i in range(1000):
+        bloom.add('SO{}'.format(i))
+
+    assert all('SO{}'.format(i) in bloom for i in range(1000))
+
+
+def test_bloom_filter_false_positive_rate(data_skipping):
+    bloom = data_skipping.BloomFilter.for_capacity(1000, fpp=0.01)
+    for i in range(1000):
+        bloom.add(i)
+
+    false_positives = sum(i in bloom for i in range(1000, 11000))
+    assert false_positives / 10000 < 0.03
+
+
+def test_bloom_filter_sizing(data_skipping):
+    bloom = data_skipping.BloomFilter.for_capacity(100)
+
+    # whole bytes, so the bit count survives serialization
+    assert bloom.num_bits % 8 == 0
+    assert len(bloom.bits) * 8 == bloom.num_bits
+    assert data_skipping.BloomFilter.num_hashes_for(0.01) == 7
+
+
+def test_bloom_filter_tests_string_form(data_skipping):
+    bloom = data_skipping.BloomFilter.for_capacity(10)
+    bloom.add(91)
+
+    assert '91' in bloom
+
+
+def test_bloom_filter_skips_nulls(data_skipping):
+    bloom = data_skipping.BloomFilter.for_capacity(10)
+    bloom.add(None)
+
+    assert not any(bloom.bits)
+
+
+def test_bloom_filter_merge_and_serialization(data_skipping):
+    BloomFilter = data_skipping.BloomFilter
+    first, second = BloomFilter.for_capacity(10), BloomFilter.for_capacity(10)
+    first.add('a')
+    second.add('b')
+
+    merged = BloomFilter(first.num_bits, first.num_hashes, bytes(first.bits)).merge(second)
+    assert 'a' in merged and 'b' in merged
+    assert 'b' not in first
+
+
+def test_zorder_rejects_wide_keys(data_skipping):
+    with pytest.raises(ValueError):
+        data_skipping.zorder(None, None, ['a', 'b', 'c', 'd'], 1, bits=16)
+
+
+def test_zorder_interleaves_column_bits(data_skipping, spark):
+    df = spark.createDataFrame([(x, y) for x in range(4) for y in range(4)], ['x', 'y'])
+
+    rows = data_skipping.zorder(spark, df, ['x', 'y'], 1, bits=2).collect()
+
+    # the first column takes the low bit of each pair, so the curve walks 2x2 quadrants
+    assert [(r.x, r.y) for r in rows[:8]] == [(0, 0), (1, 0), (0, 1), (1, 1), (2, 0), (3, 0), (2, 1), (3, 1)]
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from sparkify_common.event_schema import EventSchema, Field, log_schema, song_schema
+
+
+log_event = {'artist': None, 'auth': 'Logged In', 'firstName': 'Walter', 'gender': 'M', 'itemInSession': 0,
+             'lastName': 'Frye', 'length': None, 'level': 'free', 'location': 'San Francisco-Oakland-Hayward, CA',
+             'method': 'GET', 'page': 'Home', 'registration': 1540919166796.0, 'sessionId': 38, 'song': None,
+             'status': 200, 'ts': 1541105830796, 'userAgent': 'Mozilla/5.0', 'userId': '39'}
+
+
+def test_json_decoder_parses_string_encoded_fields():
+    decode = log_schema.json_decoder()
+
+    event = decode(json.dumps(log_event))
+    logged_out = decode(json.dumps(dict(log_event, userId='')))
+
+    assert event.userId == 39 and event.ts == 1541105830796 and event.artist is None
+    assert logged_out.userId is None
+
+
+def test_json_decoder_fills_missing_fields():
+    event = song_schema.json_decoder()('{"song_id": "SOMZWCG12A8C13C480", "title": "I Didn\'t Mean To"}')
+
+    assert event.song_id == 'SOMZWCG12A8C13C480' and event.duration is None
+    assert event._fields == tuple(song_schema.names)
+
+
+def test_csv_decoder_looks_up_columns_by_header():
+    schema = log_schema.select(['userId', 'length', 'song', 'sessionId'])
+    decode = schema.csv_decoder(['song', 'extra', 'sessionId', 'length', 'userId'])
+
+    event = decode(['Halo', 'x', '1.54111E+12', '', '91'])
+
+    # numbers exported in exponent notation still parse, empty numbers decode to None and empty text stays ''
+    assert event == schema.record(userId=91, length=None, song='Halo', sessionId=1541110000000)
+    assert decode(['', 'x', '5', '231.5', ''])[2] == ''
+
+
+def test_csv_decoder_requires_every_field():
+    with pytest.raises(ValueError):
+        log_schema.select(['userId', 'song']).csv_decoder(['song'])
+
+
+def test_select_rejects_unknown_fields():
+    with pytest.raises(ValueError):
+        log_schema.select(['userId', 'user_id'])
+
+
+def test_unknown_field_type():
+    with pytest.raises(ValueError):
+        Field('ts', 'timestamp')
+
+
+def test_read_json_and_csv(tmp_path):
+    path = tmp_path / 'events.json'
+    path.write_text(json.dumps(log_event) + '\n\n' + json.dumps(dict(log_event, itemInSession=1)) + '\n')
+    schema = EventSchema('log', [log_schema.field('itemInSession'), log_schema.field('userId')])
+    csv_path = tmp_path / 'events.csv'
+    csv_path.write_text('userId,itemInSession\n39,0\n,1\n')
+
+    assert [e.itemInSession for e in log_schema.read_json(str(path))] == [0, 1]
+    assert list(schema.read_csv(str(csv_path))) == [schema.record(0, 39), schema.record(1, None)]
+
+
+def test_generated_schemas_keep_field_order():
+    ddl = log_schema.staging_ddl('staging_events', [('event_id', 'BIGINT IDENTITY(0,1)')])
+
+    assert ddl.index('event_id') < ddl.index('artist VARCHAR') < ddl.index('userId INTEGER')
+    assert 'gender CHAR' in ddl
+    assert song_schema.cql_types()['duration'] == 'double'
+
+
+def test_arrow_schema():
+    pytest.importorskip('pyarrow')
+
+    assert str(log_schema.arrow_schema().field('userId').type) == 'int32'
+    assert str(log_schema.arrow_schema(raw=True).field('userId').type) == 'string'
+    assert log_schema.arrow_schema().names == log_schema.names
+
+
+def test_spark_decode_nulls_empty_strings(spark):
+    spark.conf.set('spark.sql.ansi.enabled', 'true')
+    df = spark.createDataFrame([('91',), ('',), (None,)], log_schema.select(['userId']).spark_schema(raw=True))
+
+    rows = log_schema.select(['userId']).spark_decode(df).collect()
+
+    assert [r.userId for r in rows] == [91, None, None]
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+
+class FakeCursor:
+    """
+    Cursor stand-in keeping the rows inserted since each savepoint, so
+    rolling back drops them like the database would.
+    """
+
+    def __init__(self):
+        self.loaded = []
+        self.dead_letters = []
+        self.savepoints = []
+        self.statements = 0
+
+    def execute(self, query, params=None):
+        if query == "SAVEPOINT load_batch":
+            self.savepoints.append(len(self.loaded))
+        elif query == "ROLLBACK TO SAVEPOINT load_batch":
+            del self.loaded[self.savepoints.pop():]
+        elif query == "RELEASE SAVEPOINT load_batch":
+            self.savepoints.pop()
+        else:
+            self.dead_letters.append(params)
+
+
+@pytest.fixture
+def etl(project, monkeypatch):
+    pytest.importorskip('psycopg2')
+    pytest.importorskip('pandas')
+    project('Data_Modeling_with_Postgres')
+    import etl
+    import psycopg2
+
+    def execute_values(cur, query, rows, page_size):
+        # one statement for the batch, failing as a whole on any bad row
+        cur.statements += 1
+        for row in rows:
+            cur.loaded.append(row)
+            if row[1] is None:
+                raise psycopg2.IntegrityError('null value in column "level"')
+
+    monkeypatch.setattr(etl, 'execute_values', execute_values)
+    return etl
+
+
+def test_load_batch_inserts_in_one_statement(etl):
+    cur = FakeCursor()
+    rows = [[i, 'free'] for i in range(10)]
+
+    assert etl.load_batch(cur, 'INSERT', ['user_id', 'level'], rows, 'users') == 0
+    assert cur.loaded == rows and cur.statements == 1 and not cur.savepoints
+
+
+def test_load_batch_bisects_to_failing_rows(etl):
+    cur = FakeCursor()
+    rows = [[i, None if i in (3, 6) else 'free'] for i in range(8)]
+
+    assert etl.load_batch(cur, 'INSERT', ['user_id', 'level'], rows, 'users') == 2
+
+    assert cur.loaded == [row for row in rows if row[1] is not None]
+    assert [(target, json.loads(record)) for target, error, record in cur.dead_letters] == [
+        ('users', {'user_id': 3, 'level': None}), ('users', {'user_id': 6, 'level': None})]
+    assert 'null value' in cur.dead_letters[0][1]
+    assert not cur.savepoints
+
+
+def test_load_batch_without_rows(etl):
+    cur = FakeCursor()
+
+    assert etl.load_batch(cur, 'INSERT', ['user_id'], [], 'users') == 0
+    assert cur.statements == 0
+
+
+def test_load_frame_splits_batches(etl, monkeypatch):
+    import pandas as pd
+    monkeypatch.setattr(etl, 'batch_rows', 4)
+    cur = FakeCursor()
+    df = pd.DataFrame({'user_id': range(10), 'level': ['free'] * 9 + [None]})
+
+    assert etl.load_frame(cur, 'INSERT', df, 'users') == 1
+    assert len(cur.loaded) == 9 and all(type(row[0]) is int for row in cur.loaded)
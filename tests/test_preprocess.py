@@ -0,0 +1,86 @@
+import csv
+import types
+
+import pytest
+
+header = ['artist', 'auth', 'firstName', 'gender', 'itemInSession', 'lastName', 'length', 'level', 'location',
+          'method', 'page', 'registration', 'sessionId', 'song', 'status', 'ts', 'userId']
+
+
+def event_row(artist, item, song):
+    return {'artist': artist, 'auth': 'Logged In', 'firstName': 'Kate', 'gender': 'F', 'itemInSession': str(item),
+            'lastName': 'Harrell', 'length': '231.78' if artist else '', 'level': 'paid',
+            'location': 'Lansing-East Lansing, MI', 'method': 'PUT', 'page': 'NextSong' if artist else 'Home',
+            'registration': '1.54047E+12', 'sessionId': '293', 'song': song, 'status': '200',
+            'ts': '1.54111E+12', 'userId': '97'}
+
+
+def write_events(path, rows, columns=header):
+    with open(path, 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([row[c] for c in columns])
+    return str(path)
+
+
+@pytest.fixture
+def preprocess(project):
+    project('Data_Modeling_Apache_Cassandra')
+    import preprocess
+    return preprocess
+
+
+def test_iter_events_skips_rows_without_artist(preprocess, tmp_path):
+    path = write_events(tmp_path / 'events.csv', [event_row('Fall Out Boy', 0, 'Dance, Dance'),
+                                                  event_row('', 1, ''),
+                                                  event_row('Muse', 2, 'Hysteria')])
+
+    events = list(preprocess.iter_events([path]))
+
+    assert [e.song for e in events] == ['Dance, Dance', 'Hysteria']
+    assert events[1].itemInSession == 2 and events[1].sessionId == 293 and events[1].userId == 97
+    assert events[1].length == 231.78
+
+
+def test_iter_events_is_lazy(preprocess, tmp_path):
+    first = write_events(tmp_path / 'first.csv', [event_row('Muse', 0, 'Hysteria')])
+
+    events = preprocess.iter_events([first, str(tmp_path / 'missing.csv')])
+
+    assert isinstance(events, types.GeneratorType)
+    assert next(events).song == 'Hysteria'
+    with pytest.raises(FileNotFoundError):
+        next(events)
+
+
+def test_iter_events_looks_up_columns_by_name(preprocess, tmp_path):
+    path = write_events(tmp_path / 'events.csv', [event_row('Muse', 3, 'Hysteria')], columns=list(reversed(header)))
+
+    event, = preprocess.iter_events([path])
+
+    assert event.artist == 'Muse' and event.itemInSession == 3
+
+
+def test_binary_intermediate_round_trip(preprocess, tmp_path):
+    path = write_events(tmp_path / 'events.csv', [event_row('Fall Out Boy', 0, 'Dance, Dance'),
+                                                  event_row('Beyoncé', 1, 'Halo')])
+    events = list(preprocess.iter_events([path]))
+
+    assert preprocess.write_event_binary(iter(events), str(tmp_path / 'events.bin')) == 2
+    assert list(preprocess.read_event_binary(str(tmp_path / 'events.bin'))) == events
+
+
+def test_event_datafile_round_trip(preprocess, tmp_path):
+    path = write_events(tmp_path / 'events.csv', [event_row('Muse', 0, 'Hysteria')])
+    events = list(preprocess.iter_events([path]))
+
+    assert preprocess.write_event_datafile(iter(events), str(tmp_path / 'event_datafile_new.csv')) == 1
+    assert list(preprocess.read_event_datafile(str(tmp_path / 'event_datafile_new.csv'))) == events
+
+
+def test_read_event_binary_rejects_other_files(preprocess, tmp_path):
+    path = write_events(tmp_path / 'events.csv', [])
+
+    with pytest.raises(ValueError):
+        list(preprocess.read_event_binary(path))
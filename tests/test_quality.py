@@ -0,0 +1,143 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from sparkify_common import quality
+
+
+@pytest.fixture
+def cur():
+    conn = sqlite3.connect(':memory:')
+    conn.create_function('GREATEST', 2, max)
+    cur = conn.cursor()
+    cur.executescript("""
+        CREATE TABLE users (user_id INTEGER, level TEXT);
+        INSERT INTO users VALUES (1, 'free'), (2, 'paid'), (2, 'free'), (NULL, 'free');
+        CREATE TABLE songplays (songplay_id INTEGER, user_id INTEGER, song_id TEXT, ts INTEGER);
+        INSERT INTO songplays VALUES (1, 1, 'SO1', 10), (2, 2, NULL, 20), (3, 9, NULL, 30), (4, 1, 'SO2', 99);
+        CREATE TABLE events (page TEXT);
+        INSERT INTO events VALUES ('NextSong'), ('NextSong'), ('Home');
+    """)
+    yield cur
+    conn.close()
+
+
+def run(cur, *checks):
+    return quality.run_checks(quality.cursor_executor(cur), checks)
+
+
+def test_table_checks_count_failing_rows(cur):
+    results = run(cur,
+                  quality.not_null('users', 'user_id'),
+                  quality.unique('users', 'user_id'),
+                  quality.references('songplays', 'user_id', 'users', 'user_id'),
+                  quality.in_range('songplays', 'ts', 0, 50))
+
+    assert [r['failed'] for r in results.values()] == [1, 2, 1, 1]
+    assert results['users: user_id not null'] == {'failed': 1, 'total': 4, 'failed_rate': 0.25, 'passed': False}
+
+
+def test_match_rate_tolerance(cur):
+    half, = run(cur, quality.match_rate('songplays', 'song_id', 0.5)).values()
+    more, = run(cur, quality.match_rate('songplays', 'song_id', 0.6)).values()
+
+    assert (half['failed'], half['total'], half['passed']) == (2, 4, True)
+    assert not more['passed']
+
+
+def test_match_rate_against_plays_never_negative(cur):
+    # more matched rows than plays, as a join fanning out would produce
+    check = quality.match_rate('songplays', 'song_id', plays="SELECT COUNT(*) FROM events WHERE page = 'NextSong'")
+
+    result, = run(cur, check).values()
+
+    assert result['failed'] == 0 and result['total'] == 2 and result['passed']
+
+
+def test_default_match_rate_always_passes(cur):
+    cur.execute("UPDATE songplays SET song_id = NULL")
+
+    result, = run(cur, quality.match_rate('songplays', 'song_id')).values()
+
+    assert result['failed_rate'] == 1.0 and result['passed']
+
+
+def test_max_event_time_is_taken_when_checks_run(monkeypatch):
+    check = quality.event_checks('log_data')[1]
+    before = check.predicate
+
+    class Later(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(2100, 1, 1, tzinfo=timezone.utc)
+
+    monkeypatch.setattr(quality, 'datetime', Later)
+    assert check.predicate != before
+    assert str(quality.epoch_ms(datetime(2100, 1, 2))) in check.predicate
+    assert quality.max_event_time() == datetime(2100, 1, 2)
+
+
+def test_max_event_time_is_naive_utc():
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    assert abs(quality.max_event_time() - now - quality.max_event_lead) < timedelta(seconds=5)
+
+
+def test_in_range_sql_literals():
+    check = quality.in_range('songplays', 'start_time', quality.min_event_time, quality.max_event_time)
+
+    assert check.predicate.startswith("start_time < TIMESTAMP '2005-01-01 00:00:00' OR start_time > TIMESTAMP '")
+
+
+def test_split_frame_routes_failing_rows():
+    pd = pytest.importorskip('pandas')
+    df = pd.DataFrame({'userId': [1, None, 3, 4], 'sessionId': [1, 2, 3, 4],
+                       'ts': [1541105830796, 1541105830796, 0, None]}, dtype=object)
+
+    passing, failed = quality.split_frame(df, quality.event_checks('log_data'))
+
+    assert passing.index.tolist() == [0]
+    # a row failing several checks is reported by the first
+    assert [(name, rows.index.tolist()) for name, rows in failed] == [
+        ('log_data: userId, sessionId, ts not null', [1, 3]), ('log_data: ts in range', [2])]
+
+
+def test_quarantine_queries():
+    queries = quality.quarantine_queries([quality.not_null('staging_events', 'userId')], 'staging_events',
+                                         'quarantine_events', where="page = 'NextSong'")
+
+    assert queries == [
+        "INSERT INTO quarantine_events SELECT 'staging_events: userId not null', * FROM staging_events "
+        "WHERE page = 'NextSong' AND (userId IS NULL);",
+        "DELETE FROM staging_events WHERE page = 'NextSong' AND (userId IS NULL);"]
+
+
+def test_postgres_match_rate_threshold(project):
+    project('Data_Modeling_with_Postgres')
+    import sql_queries
+
+    default, = [c for c in sql_queries.table_checks() if c.name == 'songplays: song_id match rate']
+    configured, = [c for c in sql_queries.table_checks(0.25) if c.name == 'songplays: song_id match rate']
+
+    assert default.tolerance == 1 - quality.min_match_rate
+    assert configured.tolerance == 0.75
+
+
+@pytest.mark.parametrize('directory', ['Data_Warehouse_with_AWS_Redshift', 'Data_Lake_with_Spark'])
+def test_users_keep_a_row_per_level(project, directory):
+    if directory == 'Data_Lake_with_Spark':
+        pytest.importorskip('pyspark')
+    project(directory)
+    module = __import__('sql_queries' if directory == 'Data_Warehouse_with_AWS_Redshift' else 'etl')
+    conn = sqlite3.connect(':memory:')
+    conn.executescript("""
+        CREATE TABLE users (userId INTEGER, level TEXT);
+        INSERT INTO users VALUES (1, 'free'), (1, 'paid'), (2, 'free');
+    """)
+
+    checks = [c for c in module.table_checks if c.table == 'users' and c.name.endswith('unique')]
+    results = quality.run_checks(quality.cursor_executor(conn.cursor()), checks)
+
+    # a level change is a new row, not a duplicate key
+    assert len(results) == 1 and all(r['passed'] for r in results.values())
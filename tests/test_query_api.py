@@ -0,0 +1,101 @@
+import pytest
+
+
+class FakeStatement:
+
+    def __init__(self, query):
+        self.query = query
+        self.fetch_size = None
+
+    def bind(self, parameters):
+        return self.query, tuple(parameters)
+
+
+class FakeSession:
+    """
+    Session stand-in answering every select with `rows`, counting round trips.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = 0
+
+    def prepare(self, query):
+        return FakeStatement(query)
+
+    def execute(self, statement):
+        self.executed += 1
+        return list(self.rows)
+
+
+@pytest.fixture
+def query_api(project):
+    pytest.importorskip('cassandra')
+    project('Data_Modeling_Apache_Cassandra')
+    import query_api
+    return query_api
+
+
+@pytest.fixture
+def clock(query_api, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(query_api.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_ttl_cache_hits_and_misses(query_api, clock):
+    cache = query_api.TTLCache(max_size=2, ttl=10)
+
+    assert cache.get('a') == (False, None)
+    cache.put('a', 1)
+    assert cache.get('a') == (True, 1)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_ttl_cache_expires_entries(query_api, clock):
+    cache = query_api.TTLCache(max_size=2, ttl=10)
+    cache.put('a', 1)
+
+    clock[0] = 10
+    assert cache.get('a') == (True, 1)
+    clock[0] = 10.5
+    assert cache.get('a') == (False, None)
+    assert 'a' not in cache.entries
+
+
+def test_ttl_cache_evicts_least_recently_used(query_api, clock):
+    cache = query_api.TTLCache(max_size=2, ttl=10)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+
+    assert list(cache.entries) == ['a', 'c']
+
+
+def test_small_results_are_served_from_the_cache(query_api, clock):
+    session = FakeSession(['row 1', 'row 2'])
+    queries = query_api.SparkifyQueries(session, fetch_size=10, cache_max_rows=2)
+
+    assert list(queries.get_song_listeners('Halo')) == ['row 1', 'row 2']
+    assert list(queries.get_song_listeners('Halo')) == ['row 1', 'row 2']
+    assert session.executed == 1
+    assert all(statement.fetch_size == 10 for statement in queries.statements.values())
+
+
+def test_large_results_are_not_cached(query_api, clock):
+    session = FakeSession(['row {}'.format(i) for i in range(5)])
+    queries = query_api.SparkifyQueries(session, cache_max_rows=2)
+
+    assert len(list(queries.get_user_session_playlist(1, 2))) == 5
+    assert len(list(queries.get_user_session_playlist(1, 2))) == 5
+    assert session.executed == 2
+
+
+def test_cache_can_be_disabled(query_api):
+    session = FakeSession(['row'])
+    queries = query_api.SparkifyQueries(session, cache_size=0)
+
+    assert queries.get_session_item(338, 4) == 'row'
+    assert queries.get_session_item(338, 4) == 'row'
+    assert session.executed == 2
@@ -0,0 +1,93 @@
+import re
+
+import pytest
+
+
+@pytest.fixture
+def query_model(project):
+    project('Data_Modeling_Apache_Cassandra')
+    import query_model
+    return query_model
+
+
+@pytest.fixture
+def cql_queries(query_model):
+    import cql_queries
+    return cql_queries
+
+
+def compact(query):
+    return re.sub(r'\s+', ' ', query).strip()
+
+
+def event(**values):
+    from preprocess import event_schema
+    return event_schema.record(**dict(dict.fromkeys(event_schema.names), **values))
+
+
+def test_declared_patterns_ddl(cql_queries):
+    assert compact(cql_queries.session_item.create_table()) == (
+        "CREATE TABLE IF NOT EXISTS session_item ( sessionId int, itemInSession int, artist text, song text, "
+        "length double, PRIMARY KEY (sessionId, itemInSession) ) WITH CLUSTERING ORDER BY (itemInSession ASC)")
+    assert compact(cql_queries.user_session.create_table()) == (
+        "CREATE TABLE IF NOT EXISTS user_session ( sessionId int, userId int, itemInSession int, artist text, "
+        "song text, firstName text, lastName text, PRIMARY KEY ((sessionId, userId), itemInSession) ) "
+        "WITH CLUSTERING ORDER BY (itemInSession ASC)")
+    assert compact(cql_queries.user_song.create_table()) == (
+        "CREATE TABLE IF NOT EXISTS user_song ( song text, userId int, firstName text, lastName text, "
+        "PRIMARY KEY (song, userId) ) WITH CLUSTERING ORDER BY (userId ASC)")
+
+
+def test_declared_patterns_select_and_insert(cql_queries):
+    assert compact(cql_queries.session_item.select()) == (
+        "SELECT artist, song, length FROM session_item WHERE sessionId = ? AND itemInSession = ?")
+
+    query, fields, partition_key = cql_queries.user_session.insert()
+    assert compact(query) == ("INSERT INTO user_session (sessionId, userId, itemInSession, artist, song, "
+                              "firstName, lastName) VALUES (?, ?, ?, ?, ?, ?, ?)")
+    assert fields == ('sessionId', 'userId', 'itemInSession', 'artist', 'song', 'firstName', 'lastName')
+    assert partition_key == ('sessionId', 'userId')
+
+
+def test_descending_order(query_model):
+    pattern = query_model.AccessPattern('plays', 'plays of a user', filters=['userId'], columns=['song'],
+                                        order_by=[('sessionId', 'DESC'), 'itemInSession'])
+
+    assert 'PRIMARY KEY (userId, sessionId, itemInSession)' in compact(pattern.create_table())
+    assert compact(pattern.create_table()).endswith("WITH CLUSTERING ORDER BY (sessionId DESC, itemInSession ASC)")
+
+
+def test_every_filter_clustering_is_rejected(query_model):
+    with pytest.raises(ValueError, match='needs a partition key'):
+        query_model.AccessPattern('item', 'an item', filters=['itemInSession'], columns=['song'],
+                                  unique_by=['itemInSession'])
+
+
+def test_unknown_fields_are_rejected(query_model):
+    with pytest.raises(ValueError, match='unknown event fields'):
+        query_model.AccessPattern('item', 'an item', filters=['sessionId'], columns=['ts'])
+
+
+def test_growing_partitions_are_unbounded(query_model, cql_queries):
+    # the same few songs keep being played, sessions end within the sample
+    events = [event(sessionId=i // 4, itemInSession=i % 4, song='song {}'.format(i % 3), userId=i)
+              for i in range(40)]
+
+    song_stats = query_model.estimate_partitions(cql_queries.user_song, events)
+    session_stats = query_model.estimate_partitions(cql_queries.session_item, events)
+
+    assert song_stats['partitions'] == 3 and song_stats['recurring_fraction'] == 1.0
+    warning, = query_model.check_partitions(cql_queries.user_song, song_stats)
+    assert warning.startswith('user_song: partition key (song) is unbounded')
+    assert session_stats['partitions'] == 10 and session_stats['max_rows'] == 4
+    assert query_model.check_partitions(cql_queries.session_item, session_stats, scale=1000) == []
+
+
+def test_unbounded_partitions_are_projected_with_scale(query_model, cql_queries, monkeypatch):
+    monkeypatch.setattr(query_model, 'max_partition_rows', 100)
+    stats = {'partitions': 3, 'mean_rows': 10, 'max_rows': 14, 'mean_bytes': 500, 'max_bytes': 700,
+             'recurring_fraction': 1.0}
+
+    assert len(query_model.check_partitions(cql_queries.user_song, stats, scale=5)) == 1
+    warnings = query_model.check_partitions(cql_queries.user_song, stats, scale=10)
+    assert warnings[1] == 'user_song: largest partition projected at 140 rows'
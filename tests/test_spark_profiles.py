@@ -0,0 +1,32 @@
+import pytest
+
+
+@pytest.fixture
+def etl(project):
+    pytest.importorskip('pyspark')
+    project('Data_Lake_with_Spark')
+    import etl
+    return etl
+
+
+def test_default_profile(etl, monkeypatch):
+    monkeypatch.setitem(etl.config['SPARK'], 'PROFILE', 'small-cluster')
+
+    name, settings = etl.load_profile()
+
+    assert name == 'small-cluster'
+    assert settings['spark.sql.shuffle.partitions'] == '32'
+
+
+def test_unknown_profile(etl):
+    with pytest.raises(ValueError, match=r"Unknown spark profile 'huge'. "
+                                         r"Expected one of \['local', 'small-cluster', 'large-cluster'\]"):
+        etl.load_profile('huge')
+
+
+def test_profiles_keep_setting_case(etl):
+    for name in ('local', 'small-cluster', 'large-cluster'):
+        _, settings = etl.load_profile(name)
+        # spark setting names are case sensitive, configparser lowercases them by default
+        assert 'spark.sql.adaptive.skewJoin.enabled' in settings
+        assert settings['spark.hadoop.fs.s3a.committer.name'] in ('directory', 'partitioned', 'magic')
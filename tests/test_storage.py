@@ -0,0 +1,96 @@
+import configparser
+import os
+
+import pytest
+
+
+@pytest.fixture
+def storage(project):
+    project('Data_Lake_with_Spark')
+    import storage
+    return storage
+
+
+def test_spark_build_reads_jar_names(storage, tmp_path):
+    for name in ('spark-core_2.13-4.0.1.jar', 'hadoop-client-api-3.4.1.jar', 'scala-library-2.13.14.jar'):
+        (tmp_path / name).touch()
+
+    assert storage.spark_build(str(tmp_path)) == ('4.0.1', '2.13', '3.4.1')
+    assert storage.spark_build(str(tmp_path / 'missing')) == (None, None, None)
+
+
+def test_default_packages_match_the_install(storage, monkeypatch):
+    monkeypatch.setattr(storage, 'spark_build', lambda: ('3.5.1', '2.12', '3.3.4'))
+
+    assert storage.S3Storage('s3a://b/').packages() == (
+        "org.apache.hadoop:hadoop-aws:3.3.4,org.apache.spark:spark-hadoop-cloud_2.12:3.5.1")
+
+
+def test_packages_need_the_install_versions_or_an_override(storage, monkeypatch):
+    monkeypatch.setattr(storage, 'spark_build', lambda: (None, None, None))
+    config = configparser.ConfigParser()
+    config.read_dict({'S3': {'PACKAGES': 'org.apache.hadoop:hadoop-aws:3.3.6'}})
+
+    with pytest.raises(ValueError, match='PACKAGES'):
+        storage.S3Storage('s3a://b/').packages()
+    assert storage.S3Storage('s3a://b/', config).packages() == 'org.apache.hadoop:hadoop-aws:3.3.6'
+
+
+def test_packages_reject_hadoop_aws_of_another_hadoop(storage, monkeypatch):
+    monkeypatch.setattr(storage, 'spark_build', lambda: ('4.0.1', '2.13', '3.4.1'))
+    config = configparser.ConfigParser()
+    config.read_dict({'S3': {'PACKAGES': 'org.apache.hadoop:hadoop-aws:3.3.4'}})
+
+    with pytest.raises(ValueError, match='does not match the hadoop 3.4.1'):
+        storage.S3Storage('s3a://b/', config).packages()
+
+
+def test_get_storage_picks_backend_by_scheme(storage, tmp_path):
+    assert type(storage.get_storage(str(tmp_path))) is storage.LocalStorage
+    assert type(storage.get_storage('file:///data/')) is storage.LocalStorage
+    for uri in ('s3://bucket/prefix', 's3a://bucket/prefix/', 's3n://bucket/prefix/'):
+        backend = storage.get_storage(uri)
+        assert type(backend) is storage.S3Storage and backend.uri == 's3a://bucket/prefix/'
+
+    assert storage.get_storage('data').uri == os.path.abspath('data') + '/'
+    assert storage.get_storage('s3a://bucket').path('songs', '/year=2018/') == 's3a://bucket/songs/year=2018'
+    with pytest.raises(ValueError, match="No storage backend for 'gs://bucket/'"):
+        storage.get_storage('gs://bucket/')
+
+
+def test_merge_settings_combines_packages(storage):
+    merged = storage.merge_settings({'spark.jars.packages': 'a:b:1,c:d:2', 'x': '1'},
+                                    {'spark.jars.packages': 'c:d:2,e:f:3', 'x': '2'})
+
+    assert merged == {'spark.jars.packages': 'a:b:1,c:d:2,e:f:3', 'x': '2'}
+
+
+def test_packages_reject_hadoop_aws_without_committers(storage, monkeypatch):
+    monkeypatch.setattr(storage, 'spark_build', lambda: (None, None, None))
+    config = configparser.ConfigParser()
+    config.read_dict({'S3': {'PACKAGES': 'org.apache.hadoop:hadoop-aws:2.7.3'}})
+
+    with pytest.raises(ValueError, match='hadoop-aws:2.7.3 has no S3A committers'):
+        storage.S3Storage('s3a://b/', config).packages()
+
+
+def test_credentials_fall_back_to_the_environment(storage, monkeypatch):
+    monkeypatch.setattr(storage, 'spark_build', lambda: ('4.0.1', '2.13', '3.4.1'))
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'env-key')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'env-secret')
+    config = configparser.ConfigParser()
+    # dl.cfg ships with quoted blank keys
+    config.read_dict({'AWS': {'AWS_ACCESS_KEY_ID': "''", 'AWS_SECRET_ACCESS_KEY': "''"}})
+
+    settings = storage.S3Storage('s3a://b/', config).spark_settings()
+    assert (settings['spark.hadoop.fs.s3a.access.key'], settings['spark.hadoop.fs.s3a.secret.key']) == (
+        'env-key', 'env-secret')
+
+    config.read_dict({'AWS': {'AWS_ACCESS_KEY_ID': 'cfg-key', 'AWS_SECRET_ACCESS_KEY': 'cfg-secret'}})
+    assert storage.S3Storage('s3a://b/', config).credentials() == ('cfg-key', 'cfg-secret')
+
+    # without keys the default AWS provider chain is left in place
+    monkeypatch.delenv('AWS_ACCESS_KEY_ID')
+    settings = storage.S3Storage('s3a://b/').spark_settings()
+    assert 'spark.hadoop.fs.s3a.access.key' not in settings
+    assert 'spark.hadoop.fs.s3a.aws.credentials.provider' not in settings
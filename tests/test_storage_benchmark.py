@@ -0,0 +1,117 @@
+import math
+import re
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def benchmark(project):
+    project('Storage_Benchmark')
+    import benchmark
+    return benchmark
+
+
+@pytest.fixture
+def engines(benchmark):
+    import engines
+    return engines
+
+
+def test_postgres_dialect_drops_redshift_clauses(engines):
+    query = engines.postgres_dialect("""
+        CREATE TABLE IF NOT EXISTS songplays
+        (
+            songplay_id INT IDENTITY (1, 1) PRIMARY KEY ,
+            gender CHAR(1) ENCODE BYTEDICT,
+            start_time TIMESTAMP NOT NULL
+        )
+        DISTSTYLE KEY
+        DISTKEY ( start_time )
+        SORTKEY ( start_time );""")
+
+    assert re.sub(r'\s+', ' ', query).strip() == ("CREATE TABLE IF NOT EXISTS songplays ( songplay_id SERIAL , "
+                                                  "gender CHAR(1) , start_time TIMESTAMP NOT NULL ) ;")
+
+
+def test_postgres_dialect_of_every_warehouse_table(engines, project):
+    project('Data_Warehouse_with_AWS_Redshift')
+    import sql_queries
+
+    for query in sql_queries.create_table_queries:
+        query = engines.postgres_dialect(query)
+        assert not re.search(r'IDENTITY|DISTSTYLE|DISTKEY|SORTKEY|ENCODE|PRIMARY KEY', query)
+
+
+def test_percentile(benchmark):
+    values = [0.1 * i for i in range(1, 101)]
+
+    assert benchmark.percentile(values, 50) == values[50]
+    assert benchmark.percentile(values, 99) == values[98]
+    assert benchmark.percentile([3.0], 95) == 3.0
+    assert math.isnan(benchmark.percentile([], 50))
+
+
+class InstantEngine:
+    """
+    Engine stand-in whose load takes no measurable time.
+    """
+
+    directory = 'Storage_Benchmark'
+    queries = {'song_listeners': lambda params: []}
+
+    def __init__(self, config):
+        pass
+
+    def load(self, data_dir):
+        pass
+
+    def loaded_events(self):
+        return 42
+
+    def footprint(self):
+        return 2 ** 20
+
+    def close(self):
+        pass
+
+
+def test_run_engine_reports_loaded_events(benchmark, monkeypatch, capsys):
+    monkeypatch.setattr(benchmark.time, 'time', lambda: 1.0)
+    params = {name: [{'title': 'Halo'}] * 3 for name in benchmark.query_names}
+
+    metrics = benchmark.run_engine(InstantEngine, None, 'data', {'events': 100}, params, warmup=1)
+
+    assert metrics['events_kept'] == 42 and metrics['events_per_second'] is None
+    assert metrics['queries']['top_songs_per_hour'] is None
+    assert set(metrics['queries']['song_listeners']) == {'p50_ms', 'p95_ms', 'p99_ms', 'mean_ms'}
+
+    benchmark.print_report({'instant': metrics, 'broken': {'error': 'no service'}})
+    report = capsys.readouterr().out
+    assert re.search(r'instant\s+0\.0\s+-\s+42\s+1\.0', report)
+    assert 'broken     failed: no service' in report
+    assert 'instant    not served by the model' in report
+
+
+def test_generated_hours_are_utc(benchmark, tmp_path):
+    import dataset
+    from sparkify_common.event_schema import log_schema
+
+    manifest = dataset.generate(str(tmp_path), songs=20, artists=5, users=3, days=1, events_per_day=50)
+
+    plays = [e for e in log_schema.read_json(str(tmp_path / 'log-data' / '2018' / '11' / '2018-11-01-events.json'))
+             if e.page == 'NextSong']
+    hours = {(datetime(1970, 1, 1) + timedelta(milliseconds=e.ts)).strftime('%Y-%m-%d %H:00:00') for e in plays}
+    assert dataset.load_manifest(str(tmp_path))['hours'] == sorted(hours)
+    assert manifest['song_plays'] == len(plays)
+
+
+def test_throughput_is_taken_over_generated_events(benchmark, monkeypatch):
+    clock = iter([0.0, 2.0])
+    monkeypatch.setattr(benchmark.time, 'time', lambda: next(clock))
+    params = {name: [{'title': 'Halo'}] for name in benchmark.query_names}
+
+    metrics = benchmark.run_engine(InstantEngine, None, 'data', {'events': 100}, params, warmup=0)
+
+    # the same count for every engine, whatever share of it the engine keeps
+    assert metrics['events_per_second'] == 50 and metrics['events_kept'] == 42
@@ -0,0 +1,99 @@
+import json
+import os
+
+import pytest
+
+
+@pytest.fixture
+def stream_etl(project, spark):
+    project('Data_Lake_with_Spark')
+    import stream_etl
+    return stream_etl
+
+
+def test_new_rows_without_table_keeps_batch(stream_etl, spark, tmp_path):
+    df = spark.createDataFrame([(1, 'Kate')], ['userId', 'firstName'])
+
+    assert stream_etl.new_rows(spark, df, str(tmp_path / 'users'), ['userId']).count() == 1
+
+
+def test_new_rows_leaves_out_written_rows(stream_etl, spark, tmp_path):
+    path = str(tmp_path / 'users')
+    spark.createDataFrame([(1, 'Kate', 'free')], ['userId', 'firstName', 'level']).write.parquet(path)
+    df = spark.createDataFrame([(1, 'Kate', 'free'), (1, 'Kate', 'paid'), (2, 'Ava', 'free')],
+                               ['userId', 'firstName', 'level'])
+
+    rows = stream_etl.new_rows(spark, df, path, ['userId', 'firstName', 'level']).collect()
+
+    # a level change is a new row, like in the batch job
+    assert sorted((r.userId, r.level) for r in rows) == [(1, 'paid'), (2, 'free')]
+
+
+def test_new_rows_reads_touched_partitions(stream_etl, spark, tmp_path):
+    path = str(tmp_path / 'time_table')
+    spark.createDataFrame([(1000, 2018, 11), (2000, 2018, 12)], ['ts', 'year', 'month'])\
+        .write.partitionBy('year', 'month').parquet(path)
+    df = spark.createDataFrame([(1000, 2018, 11), (2000, 2018, 11)], ['ts', 'year', 'month'])
+
+    rows = stream_etl.new_rows(spark, df, path, ['ts'], partitions=['year', 'month']).collect()
+
+    # ts 2000 is only written in another month
+    assert [r.ts for r in rows] == [2000]
+
+
+def play(**values):
+    event = {'artist': 'Des\'ree', 'auth': 'Logged In', 'firstName': 'Kaylee', 'gender': 'F', 'itemInSession': 1,
+             'lastName': 'Summers', 'length': 246.3, 'level': 'free', 'location': 'Phoenix-Mesa-Scottsdale, AZ',
+             'method': 'PUT', 'page': 'NextSong', 'registration': 1540344794796.0, 'sessionId': 139,
+             'song': 'You Gotta Be', 'status': 200, 'ts': 1541106106796, 'userAgent': 'Mozilla/5.0', 'userId': '8'}
+    return json.dumps(dict(event, **values))
+
+
+def drop_log_file(input_data, name, lines):
+    # written aside and moved in, so the stream never reads a partial file
+    path = input_data / name
+    path.write_text('\n'.join(lines) + '\n')
+    os.replace(path, input_data / 'log-data' / name)
+
+
+def test_log_stream_writes_tables(stream_etl, spark, tmp_path):
+    input_data, output_data = tmp_path / 'input', tmp_path / 'output'
+    (input_data / 'log-data').mkdir(parents=True)
+    spark.createDataFrame([('SOXVLOJ12AB0189215', 'You Gotta Be', 'ARMJAGH1187FB546F3', 246.3, 1994)],
+                          ['song_id', 'title', 'artist_id', 'duration', 'year'])\
+        .write.parquet(str(output_data / 'songs'))
+    spark.createDataFrame([('ARMJAGH1187FB546F3', "Des'ree")], ['artist_id', 'artist_name'])\
+        .write.parquet(str(output_data / 'artists'))
+
+    drop_log_file(input_data, '2018-11-01-events.json', [
+        play(),
+        # the same event delivered twice
+        play(),
+        play(itemInSession=2, song='Unknown Song', ts=1541106352796),
+        play(itemInSession=3, page='Home', song=None, artist=None, ts=1541106400796),
+    ])
+    query = stream_etl.process_log_stream(spark, str(input_data), str(output_data), str(tmp_path / 'checkpoint'),
+                                          trigger_interval='1 second')
+    try:
+        query.processAllAvailable()
+        # a redelivery in a later file, within the watermark, and a new play of a returning user
+        drop_log_file(input_data, '2018-11-02-events.json', [
+            play(),
+            play(sessionId=140, itemInSession=0, level='paid', ts=1541106500796),
+        ])
+        query.processAllAvailable()
+    finally:
+        query.stop()
+
+    songplays = spark.read.parquet(str(output_data / 'songplays')).collect()
+    users = spark.read.parquet(str(output_data / 'users')).collect()
+    time_table = spark.read.parquet(str(output_data / 'time_table')).collect()
+
+    # only the plays resolved to a song, each once
+    assert sorted((r.session_id, r.song_id, r.level) for r in songplays) == [
+        (139, 'SOXVLOJ12AB0189215', 'free'), (140, 'SOXVLOJ12AB0189215', 'paid')]
+    assert len({r.songplay_id for r in songplays}) == 2
+    # a level change is a new user row
+    assert sorted((r.userId, r.level) for r in users) == [(8, 'free'), (8, 'paid')]
+    assert sorted(r.ts for r in time_table) == [1541106106796, 1541106352796, 1541106500796]
+    assert {(r.year, r.month) for r in time_table} == {(2018, 11)}